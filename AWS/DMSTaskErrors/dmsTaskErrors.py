@@ -0,0 +1,179 @@
+# Description: Reports AWS Database Migration Service (DMS) replication tasks with tables in a validation
+# error state to Dynatrace as CUSTOM_ALERT events, the Python replacement of check_dms_tasks.sh.
+#
+# The shell script read the table statistics of one task at a time and listed every task of the region
+# again to name each task it found errors on.  This scanner lists the tasks of each region once (the
+# listing is also the arn -> name index) and then reads the table statistics of all the tasks
+# stats_workers at a time, page by page.  The events are the same as before: the deduplicated error
+# states and the task name as the title, the affected tables in the message property and the task ARN
+# in resource_id.
+#
+# Which validation states count is set in the ini file: the tables listed in the message are the ones
+# whose ValidationState matches table_validation_states, and an event is only sent when one of them
+# matches error_validation_states (the shell script's "Suspended records" tables are listed but don't
+# raise an event on their own).
+#
+# Usage: You must supply a valid customer ID, Environment, and path to ini file
+#   python3 ./dmsTaskErrors.py --customer RFD --environment PRD --iniFile ./env.ini
+#   python3 ./dmsTaskErrors.py --customer RFD --environment PRD --iniFile ./env.ini --regions us-east-1,us-east-2 --dryRun
+#
+# With aws_endpoint_url set every AWS call goes to that url instead, such as the AwsStandIn of
+# Benchmark/standIns.py, so the scanner can be tried without an AWS account.
+#
+import os, re, sys, time, configparser, argparse
+
+# Shared modules are kept in the lib directory at the root of this repository.  If the files were
+# copied into one directory instead they are found next to this script.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'lib'))
+import awsScan, dynatraceClient, eventSpool, selfMetrics
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import BotoCoreError, ClientError
+
+DEFAULT_TABLE_STATES = 'Mismatched records,Suspended records,Table error,Error'
+DEFAULT_ERROR_STATES = 'Mismatched records,Table error,Error'
+DEFAULT_STATS_WORKERS = 8
+# Largest page DescribeTableStatistics hands out
+TABLE_STATS_PAGE_SIZE = 500
+
+####
+#### Subroutine area
+####
+
+# Parse incoming arguments to python script
+def parseArguments(argv=None) :
+    parser = argparse.ArgumentParser('Report DMS replication task validation errors to Dynatrace')
+    parser.add_argument("--customer", help="Supply a customer value")
+    parser.add_argument("--environment", help="Supply something like LAB, DR, TST, or PRD")
+    parser.add_argument("--iniFile", help="Supply path to ini file")
+    parser.add_argument("--regions", help="Comma separated regions to scan instead of aws_regions")
+    parser.add_argument("--dryRun", action="store_true", help="Print the events instead of sending them")
+
+    global args
+    args = parser.parse_args(argv)
+    return args
+
+def statePattern(states) :
+    # Same matching as the jq test("(A|B|C)") of the shell script, a state matches when it contains one
+    # of the names
+    return re.compile("(" + "|".join(re.escape(state.strip()) for state in states.split(',') if state.strip()) + ")")
+
+def listTasks(dms, region, metrics) :
+    # arn -> name of every replication task in the region, one paginated listing without the task settings
+    with metrics.timer('task_listing'):
+        tasks = {task['ReplicationTaskArn']: task['ReplicationTaskIdentifier']
+                 for task in awsScan.paginate(dms, 'describe_replication_tasks', 'ReplicationTasks', WithoutSettings=True)}
+    print("DMS " + region + ": " + str(len(tasks)) + " replication task(s)")
+    return tasks
+
+def checkTask(dms, task_arn, task_name, metrics) :
+    # Reads the table statistics of one task.  Returns the alert to send, or None.
+    with metrics.timer('table_stats_fetch'):
+        tables = list(awsScan.paginate(dms, 'describe_table_statistics', 'TableStatistics',
+                                       ReplicationTaskArn=task_arn, MaxRecords=TABLE_STATS_PAGE_SIZE))
+
+    error_tables = [table['TableName'] for table in tables if table_states.search(table.get('ValidationState', ''))]
+    # Dedups errors and makes them more readable
+    errors = sorted(set(table['ValidationState'] for table in tables if error_states.search(table.get('ValidationState', ''))))
+    print("\t" + task_arn + " - " + ", ".join(error_tables) + " - " + ", ".join(errors))
+    if not errors:
+        return None
+    print("\t\tFound replication error.")
+    return awsScan.customAlert(task_arn, ", ".join(error_tables), task_name, ", ".join(errors), event_timeout)
+
+def safely(what, call, metrics) :
+    # Runs one AWS call of the scan.  A failure becomes an error event, like the shell error trap.
+    try:
+        return call(), None
+    except (BotoCoreError, ClientError) as e:
+        print("Error " + what + ": " + str(e))
+        metrics.error('dms', e)
+        return None, awsScan.errorAlert(__file__, what, e, event_timeout)
+
+def runStatusCheck(run_config) :
+    global config, event_timeout, table_states, error_states
+    config = run_config
+    run_started = time.monotonic()
+
+    section_name = str(args.customer) + "_" + str(args.environment)
+    if not config.has_section(section_name):
+        print("Section " + section_name + " not found in the ini file...exiting")
+        sys.exit(1)
+    section = config[section_name]
+    event_timeout = section.getint('event_timeout_minutes', awsScan.DEFAULT_EVENT_TIMEOUT_MINUTES)
+    table_states = statePattern(section.get('table_validation_states', DEFAULT_TABLE_STATES))
+    error_states = statePattern(section.get('error_validation_states', DEFAULT_ERROR_STATES))
+    regions = awsScan.regionsFromConfig(section, args.regions)
+    workers = max(1, section.getint('stats_workers', DEFAULT_STATS_WORKERS))
+
+    metrics = selfMetrics.fromConfig(section, 'aws_dms_tasks', customer=args.customer, environment=args.environment)
+
+    print("Checking DMS tasks for errors in: " + ", ".join(regions))
+    alerts = []
+    task_count = 0
+    try:
+        session = awsScan.sessionFromConfig(section)
+        # One client per region shared by the workers, with a connection for each of them
+        clients = {region: awsScan.client(session, section, 'dms', region, pool_size=workers) for region in regions}
+    except (BotoCoreError, ClientError) as e:
+        print("Unable to get AWS credentials: " + str(e))
+        alerts.append(awsScan.errorAlert(__file__, "assume role", e, event_timeout))
+    else:
+        with metrics.timer('scan'):
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                # First the task index of every region, then the statistics of all the tasks
+                listings = executor.map(lambda region: safely("listing DMS tasks in " + region,
+                                                              lambda: listTasks(clients[region], region, metrics), metrics), regions)
+                checks = []
+                for region, (tasks, error_alert) in zip(regions, list(listings)):
+                    if error_alert:
+                        alerts.append(error_alert)
+                        continue
+                    task_count += len(tasks)
+                    checks.extend((clients[region], task_arn, task_name) for task_arn, task_name in tasks.items())
+
+                results = executor.map(lambda check: safely("reading table statistics of " + check[1],
+                                                            lambda: checkTask(check[0], check[1], check[2], metrics), metrics), checks)
+                for alert, error_alert in results:
+                    if alert or error_alert:
+                        alerts.append(alert or error_alert)
+
+    unsent = 0
+    if args.dryRun:
+        for alert in alerts:
+            print("Would send: " + awsScan.compactJson(alert))
+    elif alerts:
+        dynatrace = dynatraceClient.fromConfig(section, metrics=metrics)
+        with metrics.timer('event_send'):
+            unsent = awsScan.sendAlerts(dynatrace, awsScan.eventUrl(section), alerts, spool=eventSpool.fromConfig(section),
+                                        workers=section.getint('event_delivery_workers', awsScan.DEFAULT_SEND_WORKERS))
+        dynatrace.close()
+
+    print("")
+    print("##### Summary #####")
+    print("Regions scanned: " + str(len(regions)))
+    print("Replication tasks checked: " + str(task_count))
+    print("Events: " + str(len(alerts)) + ", not delivered: " + str(unsent))
+    print("")
+    print("Complete")
+
+    metrics.observe('phase.duration', (time.monotonic() - run_started) * 1000.0, phase='run')
+    metrics.flush()
+    return
+
+###
+### End subroutine area
+###
+
+##############
+### Main logic
+##############
+
+if __name__ == '__main__':
+    # Parse arguments passed into program
+    parseArguments()
+
+    # Load configuration file supplied
+    config = configparser.ConfigParser()
+    config.read(args.iniFile)
+
+    runStatusCheck(config)
@@ -0,0 +1,151 @@
+# Description: Reports the pending maintenance of AWS managed services (RDS and DMS replication
+# instances) to Dynatrace as CUSTOM_ALERT events, the Python replacement of check_aws_pending_maint.sh.
+#
+# The shell script asked for the pending actions of one instance at a time and listed every instance
+# of the region again to name each one it found.  This scanner asks for all the pending actions of a
+# region in one paginated call per service, names them from one listing of the region (kept in
+# name_cache_file between runs when set), and scans the regions in aws_regions scan_workers at a time.
+# The events are the same as before: "Maintenance Pending - <name>" with the pending actions as json in
+# the message property and the ARN in resource_id.
+#
+# Usage: You must supply a valid customer ID, Environment, and path to ini file
+#   python3 ./pendingMaintenance.py --customer RFD --environment PRD --iniFile ./env.ini
+#   python3 ./pendingMaintenance.py --customer RFD --environment PRD --iniFile ./env.ini --regions us-east-1,us-east-2 --dryRun
+#
+# With aws_endpoint_url set every AWS call goes to that url instead, such as the AwsStandIn of
+# Benchmark/standIns.py, so the scanner can be tried without an AWS account.
+#
+import os, sys, time, configparser, argparse
+
+# Shared modules are kept in the lib directory at the root of this repository.  If the files were
+# copied into one directory instead they are found next to this script.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'lib'))
+import awsScan, dynatraceClient, eventSpool, selfMetrics
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import BotoCoreError, ClientError
+
+# Per service: the listing that names the resources, its arn / name fields, and the alert subject
+SERVICES = {
+    'rds': {'listing': 'describe_db_instances', 'key': 'DBInstances', 'arn': 'DBInstanceArn', 'name': 'DBInstanceIdentifier'},
+    'dms': {'listing': 'describe_replication_instances', 'key': 'ReplicationInstances', 'arn': 'ReplicationInstanceArn', 'name': 'ReplicationInstanceIdentifier'},
+}
+SUBJECT = 'Maintenance Pending'
+
+####
+#### Subroutine area
+####
+
+# Parse incoming arguments to python script
+def parseArguments(argv=None) :
+    parser = argparse.ArgumentParser('Report pending maintenance of AWS managed services to Dynatrace')
+    parser.add_argument("--customer", help="Supply a customer value")
+    parser.add_argument("--environment", help="Supply something like LAB, DR, TST, or PRD")
+    parser.add_argument("--iniFile", help="Supply path to ini file")
+    parser.add_argument("--regions", help="Comma separated regions to scan instead of aws_regions")
+    parser.add_argument("--dryRun", action="store_true", help="Print the events instead of sending them")
+
+    global args
+    args = parser.parse_args(argv)
+    return args
+
+def listNames(aws_client, service) :
+    # arn -> name of every instance of the service in the client's region, one paginated listing
+    listing = SERVICES[service]
+    return {item[listing['arn']]: item[listing['name']] for item in awsScan.paginate(aws_client, listing['listing'], listing['key'])}
+
+def scanService(aws_client, service, region, names, metrics) :
+    # Every pending action of the service in the region, named.  Returns the alerts to send.
+    with metrics.timer('pending_actions_fetch', service=service):
+        pending = list(awsScan.paginate(aws_client, 'describe_pending_maintenance_actions', 'PendingMaintenanceActions'))
+    print(service.upper() + " " + region + ": " + str(len(pending)) + " resource(s) with pending maintenance")
+
+    alerts = []
+    for resource in pending:
+        arn = resource['ResourceIdentifier']
+        # RDS also reports clusters, which are not in the instance listing and go by their ARN
+        name = names.lookup(service + "/" + region, arn, lambda: listNames(aws_client, service)) or awsScan.arnName(arn)
+        message = awsScan.compactJson(resource)
+        print("\t" + arn + " - " + message)
+        alerts.append(awsScan.customAlert(arn, message, name, SUBJECT, event_timeout))
+    return alerts
+
+def scanRegion(clients, service, region, names, metrics) :
+    try:
+        return scanService(clients[(service, region)], service, region, names, metrics)
+    except (BotoCoreError, ClientError) as e:
+        print("Error scanning " + service.upper() + " in " + region + ": " + str(e))
+        metrics.error(service, e)
+        return [awsScan.errorAlert(__file__, service + " " + region, e, event_timeout)]
+
+def runStatusCheck(run_config) :
+    global config, event_timeout
+    config = run_config
+    run_started = time.monotonic()
+
+    section_name = str(args.customer) + "_" + str(args.environment)
+    if not config.has_section(section_name):
+        print("Section " + section_name + " not found in the ini file...exiting")
+        sys.exit(1)
+    section = config[section_name]
+    event_timeout = section.getint('event_timeout_minutes', awsScan.DEFAULT_EVENT_TIMEOUT_MINUTES)
+    regions = awsScan.regionsFromConfig(section, args.regions)
+
+    metrics = selfMetrics.fromConfig(section, 'aws_maintenance', customer=args.customer, environment=args.environment)
+    names = awsScan.NameIndex(section.get('name_cache_file'), ttl_minutes=section.getfloat('name_cache_ttl_minutes', awsScan.DEFAULT_NAME_CACHE_TTL_MINUTES))
+
+    print("Scanning " + ", ".join(sorted(SERVICES)).upper() + " pending maintenance in: " + ", ".join(regions))
+    try:
+        session = awsScan.sessionFromConfig(section)
+        clients = {(service, region): awsScan.client(session, section, service, region) for service in SERVICES for region in regions}
+    except (BotoCoreError, ClientError) as e:
+        print("Unable to get AWS credentials: " + str(e))
+        alerts = [awsScan.errorAlert(__file__, "assume role", e, event_timeout)]
+    else:
+        scans = [(service, region) for region in regions for service in sorted(SERVICES)]
+        with metrics.timer('scan'):
+            with ThreadPoolExecutor(max_workers=max(1, section.getint('scan_workers', awsScan.DEFAULT_SCAN_WORKERS))) as executor:
+                results = executor.map(lambda scan: scanRegion(clients, scan[0], scan[1], names, metrics), scans)
+                alerts = [alert for region_alerts in results for alert in region_alerts]
+        names.save()
+        metrics.cache('names', hits=names.hits, misses=names.listings)
+
+    unsent = 0
+    if args.dryRun:
+        for alert in alerts:
+            print("Would send: " + awsScan.compactJson(alert))
+    elif alerts:
+        dynatrace = dynatraceClient.fromConfig(section, metrics=metrics)
+        with metrics.timer('event_send'):
+            unsent = awsScan.sendAlerts(dynatrace, awsScan.eventUrl(section), alerts, spool=eventSpool.fromConfig(section),
+                                        workers=section.getint('event_delivery_workers', awsScan.DEFAULT_SEND_WORKERS))
+        dynatrace.close()
+
+    print("")
+    print("##### Summary #####")
+    print("Regions scanned: " + str(len(regions)))
+    print("Events: " + str(len(alerts)) + ", not delivered: " + str(unsent))
+    print("Instance listings made: " + str(names.listings) + ", names reused: " + str(names.hits))
+    print("")
+    print("Complete")
+
+    metrics.observe('phase.duration', (time.monotonic() - run_started) * 1000.0, phase='run')
+    metrics.flush()
+    return
+
+###
+### End subroutine area
+###
+
+##############
+### Main logic
+##############
+
+if __name__ == '__main__':
+    # Parse arguments passed into program
+    parseArguments()
+
+    # Load configuration file supplied
+    config = configparser.ConfigParser()
+    config.read(args.iniFile)
+
+    runStatusCheck(config)
@@ -8,69 +8,391 @@
 #
 # Usage: You must supply a valid customer ID, Environment, and path to ini file
 #
-import os, sys, requests, feedparser, json, math, configparser, datetime, argparse, pprint
+# When feed_cache_file is set in the ini file every feed is fetched with a conditional GET and a feed
+# that has not changed since the last run is answered from the cache without being parsed again.
+#
+# When incident_journal_file is set in the ini file an open issue is only sent to Dynatrace when it is
+# new, its status text changed, or its event is about to time out.  Issues AWS no longer reports
+# are closed out explicitly.
+#
+# Feeds are fetched concurrently (--workers, default 10) with a per feed timeout (--feedTimeout,
+# default 20 seconds) so one slow status page does not hold up the whole run.  The classification
+# of each feed and the summary counters are still done on the main thread.
+#
+# One run can report to several Dynatrace environments: --sections RFD_PRD,ABC_TST (or --allSections)
+# fetches and classifies the feeds once and then sends the events of every section, tenant_workers
+# sections at a time.  Each section gets the feeds of its own aws_regions / aws_services filters.
+#
+# With self_metrics=true in the ini file the run reports its phase timings, http requests, bytes,
+# errors and cache hit rates to the local OneAgent metric ingest endpoint (see lib/selfMetrics.py).
+#
+# Output is logged as json lines (log_format=text for plain lines) at log_level INFO by default, see
+# lib/statusLog.py.  The feed urls, event payloads and response bodies are only written at DEBUG.
+#
+import os, sys, time, requests, feedparser, json, math, configparser, datetime, argparse
+from concurrent.futures import ThreadPoolExecutor
+
+# Shared modules are kept in the lib directory at the root of this repository.  If the files were
+# copied into one directory instead they are found next to this script.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'lib'))
+import feedCache, dynatraceClient, incidentJournal, selfMetrics, tenantFanout, statusLog
+import feedManifest  # next to this script
+
+log = statusLog.getLogger('aws')
 
 
-def parseArguments() :
+def parseArguments(argv=None) :
     parser = argparse.ArgumentParser('Evaluate status of AWS Services')
     parser.add_argument("--customer", help="Supply a customer acronym, like RFD")
     parser.add_argument("--environment", help="Supply either LAB, DR, TST, or PRD for example.")
     parser.add_argument("--iniFile", help="Supply path to ini file that contains necessary environment links")
+    parser.add_argument("--sections", help="Comma separated ini sections (like RFD_PRD,ABC_TST) to report to in one run, instead of --customer/--environment")
+    parser.add_argument("--allSections", action="store_true", help="Report to every ini section that has an event_feed_url")
+    parser.add_argument("--tenantWorkers", type=int, help="Number of sections sent their events at the same time (default 4)")
+    parser.add_argument("--refreshEntities", action="store_true", help="Ignore the cached application entity ids and look them up again")
+    parser.add_argument("--workers", type=int, help="Number of RSS feeds fetched at the same time (default 10)")
+    parser.add_argument("--feedTimeout", type=float, help="Seconds to wait on a single RSS feed before giving up (default 20)")
 
     global args
-    args = parser.parse_args()
-    return
+    args = parser.parse_args(argv)
+    return args
+
+def isTenantSection(section) :
+    return bool(section.get('event_feed_url') and section.get('entity_application_feed_url'))
+
+def getEntityIds(tenant) :
+    # Resolved the first time an event is about to be sent, so a run with no open issues never calls
+    # the tenant.  A fresh lookup from the entity cache is used when there is one.
+    if tenant.entity_ids:
+        return tenant.entity_ids
+
+    lookup_url = tenant.section['entity_application_feed_url']
+    if tenant.entity_cache:
+        cached_ids = tenant.entity_cache.get(lookup_url)
+        if cached_ids is not None:
+            tenant.metrics.cache('entity', hits=1)
+            tenant.entity_ids.extend(cached_ids)
+            log.debug("Using cached application entity ids", extra=statusLog.fields(section=tenant.name, entity_ids=tenant.entity_ids))
+            return tenant.entity_ids
+        tenant.metrics.cache('entity', misses=1)
 
-def getEntityIds() :
-    print("Retrieving Applications from Dynatrace for: " + str(args.customer) + "/" + str(args.environment) + " at "+ str(datetime.datetime.now()))
+    log.info("Retrieving applications from Dynatrace", extra=statusLog.fields(section=tenant.name))
 
     try:
-        response = requests.get(config[args.customer + "_" + args.environment]['entity_application_feed_url'], headers=headers)
-        # print("Response Code: " + str(response.status_code))
-        # print("Response Body: " + response.text)
+        with tenant.metrics.timer('entity_lookup'):
+            response = tenant.dynatrace.get(lookup_url)
+        log.debug("Applications response %s: %s", response.status_code, statusLog.lazy(lambda: response.text))
         dynatraceAppData = json.loads(response.text)
 
         if not dynatraceAppData:
-            print("Dynatrace Returned no Applications...exiting")
+            log.error("Dynatrace returned no applications...exiting", extra=statusLog.fields(section=tenant.name))
             sys.exit(1)
 
         for i, val in enumerate(dynatraceAppData):
-            entity_ids.append(str(dynatraceAppData[i]['entityId']))
-            #print("Entity ID:" + str(dynatraceAppData[i]['entityId']))
+            tenant.entity_ids.append(str(dynatraceAppData[i]['entityId']))
 
     except requests.exceptions.RequestException as e:
-        print("Error retrieving data from Dynatrace: " + e)
-        print("Response Code: " + str(response.status_code))
+        log.error("Error retrieving data from Dynatrace: %s", e, extra=statusLog.fields(section=tenant.name))
         sys.exit(1)
 
-    return
+    if tenant.entity_cache:
+        tenant.entity_cache.put(lookup_url, tenant.entity_ids)
+
+    return tenant.entity_ids
 
-def buildDynatraceEventPayload(service_name, service_status):
+def buildDynatraceEventPayload(tenant, service_name, service_status):
     payload = {}
     payload['title'] = service_name
     payload['description']  = "This may potentially impact the identified application.\n\n" + service_status
     payload['eventType'] = "AVAILABILITY_EVENT"
-    payload['timeoutMinutes'] = 10
+    payload['timeoutMinutes'] = incidentJournal.eventTimeoutMinutes(tenant.section)
     payload['source'] = 'AWS Status Extension (from RFD)'
     # payload['annotationType'] = 'defect'
     # payload['annotationDescription'] = 'Extended Description text here....'
     payload['attachRules'] = { }
-    payload['attachRules']['entityIds'] = entity_ids
+    if tenant.section.get('event_entity_selector'):
+        # Events v2, the tenant attaches the event to whatever the selector matches so the applications
+        # are never looked up here
+        payload = dynatraceClient.toEventsV2(payload, tenant.section['event_entity_selector'])
+    else:
+        payload['attachRules']['entityIds'] = getEntityIds(tenant)
     # payload['attachRules'][1]['tagRule'] = [ { "meTypes": [ "APPLICATION" ], "tags": [ { "context": "CONTEXTLESS", "key": "PRD" } ] } ]
-    # print(payload)
-    print(json.dumps(payload))
+    log.debug("Event payload: %s", statusLog.lazyJson(payload))
     return payload
 
-def sendEvent2Dynatrace(event):
+def sendEvent2Dynatrace(tenant, event, issue=None):
+    with tenant.metrics.timer('event_send'):
+        return postEvent(tenant, event, issue)
+
+def eventUrl(tenant) :
+    # The v2 ingest url when events are attached by entity selector, next to the v1 url unless set
+    if tenant.section.get('event_entity_selector'):
+        return tenant.section.get('event_ingest_url') or tenant.section['event_feed_url'].replace('/api/v1/events', '/api/v2/events/ingest')
+    return tenant.section['event_feed_url']
+
+def postEvent(tenant, event, issue=None):
+    # issue is (issue id, content) of an open issue.  Returns whether the tenant accepted the event, or
+    # None when it was queued: spoolResult() then handles the answer once the event is delivered.
+    if tenant.event_spool:
+      # Written to the outbox on disk and delivered at the end of the run
+      tenant.event_spool.enqueue(eventUrl(tenant), event, key=[tenant.journal_source, issue[0]] if issue else None,
+                                 context=issue[1] if issue else None)
+      return None
+
+    try:
+      response = tenant.dynatrace.post(eventUrl(tenant), data=json.dumps(event))
+      log.info("Sent event to Dynatrace", extra=statusLog.fields(section=tenant.name, title=event.get('title'), status_code=response.status_code))
+      log.debug("Event response body: %s", statusLog.lazy(lambda: response.text))
+      if response.status_code == 400 and tenant.entity_cache:
+          # Most likely one of the cached applications no longer exists, look them up again next run
+          tenant.entity_cache.invalidate(tenant.section['entity_application_feed_url'])
+    except requests.exceptions.RequestException as e:
+      log.error("Error sending event to Dynatrace: %s", e, extra=statusLog.fields(section=tenant.name, title=event.get('title')))
+      return False
+
+    return response.ok
+
+def spoolResult(tenant, key, content, payload, status) :
+    # The tenant's final answer to a spooled event, handled the way postEvent() handles a direct send
+    if status == 400 and tenant.entity_cache:
+        # Most likely one of the cached applications no longer exists, look them up again next run
+        tenant.entity_cache.invalidate(tenant.section['entity_application_feed_url'])
+    if key is None or not 200 <= status < 300:
+        return
+    tenant.counts['sent'] +=1
+    if tenant.journal:
+        tenant.journal.markSent(key[0], key[1], content, payload)
+    return
+
+def fetchFeed(feed_url):
+    # Runs on a worker thread.  Only fetch and parse here, the counters are updated by the caller.
+    with metrics.timer('feed_fetch'):
+        try:
+            if feed_cache:
+                return feed_cache.fetch(feed_url, timeout=feed_timeout, session=feed_session)
+
+            response = feed_session.get(feed_url, timeout=feed_timeout)
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            log.warning("Error retrieving RSS feed: %s", e, extra=statusLog.fields(feed=feed_url))
+            if e.response is None:
+                metrics.error('aws_status', e)
+            return None
+
+        return feedparser.parse(response.content)
+
+def evaluateFeed(feed_url, NewsFeed):
+    # Classify one feed and keep the result for every section that selected it.  Feeds that could not
+    # be read get no result, so issues open on them stay open until they can be checked.
+    global serviceNormal, serviceNotNormal, serviceNoStatus, serviceFetchError
+
+    if NewsFeed is None or 'subtitle' not in NewsFeed.feed:
+        log.warning("Unable to read RSS feed", extra=statusLog.fields(feed=feed_url))
+        serviceFetchError +=1
+        return
+
+    service_name=NewsFeed.feed.subtitle.replace(' Service Status', '')
+
+    if len(NewsFeed.entries) >= 1:
+        entry = NewsFeed.entries[0]
+        service_status=entry.title
+        log.debug("Service status", extra=statusLog.fields(service=service_name, status=service_status))
+        # Finding either of these strings means AWS sees no issues with their services
+        with metrics.timer('classification'):
+            status_text = service_status.lower()
+            status_normal = "normal" in status_text or ("informational" in status_text and ("resolved" in status_text or "insufficient" in status_text))
+        if status_normal:
+            # print("Service Working Normally")
+            serviceNormal +=1
+        else:
+            log.warning("Service alert", extra=statusLog.fields(service=service_name, status=service_status, feed=feed_url))
+            serviceNotNormal +=1
+        feed_results[feed_url] = {'service': service_name, 'status': service_status, 'normal': status_normal}
+    else:
+        # print("No status to report")
+        serviceNoStatus +=1
+        feed_results[feed_url] = {'service': service_name, 'status': None, 'normal': True}
+
+    return
+
+def notifyTenant(tenant) :
+    # Send the open issues of the feeds this section selected to its tenant.  Runs next to the other
+    # sections on worker threads, so only the tenant and the (by now read only) feed results are used.
+    checked_services = []
+    open_services = []
+    for feed_url in tenant_feeds[tenant.name]:
+        result = feed_results.get(feed_url)
+        if result is None:
+            continue
+        checked_services.append(result['service'])
+        if result['normal']:
+            continue
+        open_services.append(result['service'])
+
+        if tenant.journal and not tenant.journal.check(tenant.journal_source, result['service'], result['status']):
+            log.info("Already reported and not due for a refresh yet", extra=statusLog.fields(section=tenant.name, service=result['service']))
+            tenant.counts['skipped'] +=1
+            continue
+
+        # Create Event Payload for Dynatrace
+        payload = buildDynatraceEventPayload(tenant, result['service'], result['status'])
+
+        # Send event to Dynatrace
+        if sendEvent2Dynatrace(tenant, payload, (result['service'], result['status'])):
+            tenant.counts['sent'] +=1
+            if tenant.journal:
+                tenant.journal.markSent(tenant.journal_source, result['service'], result['status'], payload)
+
+    if tenant.journal:
+        closeResolvedIssues(tenant, open_services, checked_services)
+
+    if tenant.event_spool:
+        with tenant.metrics.timer('event_delivery'):
+            tenant.event_spool.deliver(tenant.dynatrace, onResult=lambda key, content, payload, status: spoolResult(tenant, key, content, payload, status))
+        if tenant.journal:
+            # The issues delivered just now were only recorded as sent by spoolResult()
+            tenant.journal.save()
+
+    if tenant.section.get('status_metrics_url'):
+        sendServiceStatus(tenant)
+
+    tenant.metrics.gauge('issues.open', len(open_services))
+    return
+
+def sendServiceStatus(tenant) :
+    # A 0 (normal) / 1 (issue) gauge for every service and region this section selected, all of them in
+    # one metric ingest request.  Feeds that could not be read this run are left out, not sent as normal.
+    key = tenant.section.get('self_metrics_prefix', selfMetrics.DEFAULT_PREFIX) + ".service.status"
+    status = {}
+    for feed_url in tenant_feeds[tenant.name]:
+        result = feed_results.get(feed_url)
+        if result is None:
+            continue
+        series = feed_services[feed_url]
+        status[series] = max(status.get(series, 0), 0 if result['normal'] else 1)
+
+    lines = [selfMetrics.metricLine(key, [('provider', 'aws'), ('service', service), ('region', region)], value)
+             for (service, region), value in status.items()]
+    with tenant.metrics.timer('status_metrics'):
+        selfMetrics.postLines(tenant.dynatrace, tenant.section['status_metrics_url'], lines, label="Service status metrics")
+    return
+
+def closeResolvedIssues(tenant, open_services, checked_services) :
+    # Services that were alerting on an earlier run and now read normal again.  A feed that could not
+    # be read this run is left open until it can be checked.
+    for issue in tenant.journal.resolve(tenant.journal_source, open_services, checked_services):
+        log.info("Closing resolved issue", extra=statusLog.fields(section=tenant.name, issue=issue['issueId']))
+        sendEvent2Dynatrace(tenant, incidentJournal.closingPayload(issue, "RESOLVED - AWS no longer reports an issue for this service."))
+        tenant.counts['closed'] +=1
+    tenant.journal.save()
+    return
+
+def runStatusCheck(run_config, tenant_pool=None) :
+    # One complete pass over the AWS feeds for the ini sections selected in args.  Called once by the
+    # main logic below, or on every cycle by the status daemon which keeps the process running.
+    # The daemon passes a tenantFanout.TenantPool so the tenants are reused from one cycle to the next.
+    global config, fetch_workers, feed_timeout, feed_cache, feed_session, metrics, feed_results, tenant_feeds, feed_services
+    global servicesChecked, serviceRegionCheck, serviceNormal, serviceNotNormal, serviceNoStatus, serviceFetchError
+    config = run_config
+    run_started = time.monotonic()
+
+    # create summary variables
+    servicesChecked = 0
+    serviceRegionCheck = 0
+    serviceNormal = 0
+    serviceNotNormal = 0
+    serviceNoStatus = 0
+    serviceFetchError = 0
+
+    # Other values declared
+    feed_results = {}
+
+    # Every selected section is a tenant with its own pooled Dynatrace client, entity ids, journal and
+    # spool.  The feed settings (manifest, workers, timeout, cache) come from the first section.
+    try:
+        section_names = tenantFanout.selectSections(config, args, isTenantSection)
+    except ValueError as e:
+        log.error("%s...exiting", e)
+        sys.exit(1)
+    statusLog.fromConfig(config[section_names[0]])
+    tenants = tenantFanout.openTenants(config, section_names, 'aws', 'AWS', pool=tenant_pool)
+    source = tenants[0].section
+
+    # Timings, request counts and cache hit rates of this run, only sent when self_metrics is set.  With
+    # several sections the feed work is shared, so it is reported once for all of them.
+    if len(tenants) == 1:
+        metrics = tenants[0].metrics
+    else:
+        metrics = selfMetrics.fromConfig(source, 'aws', customer='all', environment='all')
+
+    # Command line values win over the ini file, otherwise fall back to the defaults
+    fetch_workers = args.workers or source.getint('fetch_workers', 10)
+    feed_timeout = args.feedTimeout or source.getfloat('feed_timeout', 20)
+    feed_cache = feedCache.fromConfig(source)
+
+    # The feeds all live on status.aws.amazon.com, keep those connections open between feeds as well
+    feed_session = requests.Session()
+    feed_session.mount('https://', requests.adapters.HTTPAdapter(pool_maxsize=max(1, fetch_workers)))
+    metrics.watch(feed_session, 'aws_status')
+
+    # However the run ends (an exit included) the connections are closed and the self monitoring sent,
+    # the status daemon runs the next cycle in this same process
     try:
-      response = requests.post(config[args.customer + "_" + args.environment]['event_feed_url'], data=json.dumps(event), headers=headers)
-      print("Succesfully sent data to Dynatrace, response code: " + str(response.status_code))
-      print("Response Body: " + str(response.text))
-    except:
-      e = sys.exc_info()[0]
-      print("Error sending data to Dynatrace: " + str(e))
-      print("Response Code: " + str(response.status_code))
+        # Application Entity ID's (tag "AWS_STATUS") are only retrieved from Dynatrace, or the entity cache,
+        # once an event needs to be sent
+        for tenant in tenants:
+            if tenant.entity_cache and args.refreshEntities:
+                tenant.entity_cache.invalidate(tenant.section['entity_application_feed_url'])
 
+        # Only the feeds of the services and regions selected in the ini file are fetched, each feed once
+        # however many sections selected it.  The manifest is compiled once and only read again when the
+        # file changes.
+        manifest = feedManifest.fromConfig(source)
+        tenant_feeds = {}
+        for tenant in tenants:
+            tenant_feeds[tenant.name] = [feed_url for service, region, feed_url in manifest.select(**feedManifest.filtersFromConfig(tenant.section))]
+        wanted = set(feed_url for feed_urls in tenant_feeds.values() for feed_url in feed_urls)
+        selected_feeds = [(service, region, feed_url) for service, region, feed_url in manifest.select() if feed_url in wanted]
+        feed_urls = []
+        feed_services = {}
+        for service, region, feed_url in selected_feeds:
+            log.debug("Call this feed", extra=statusLog.fields(feed=feed_url))
+            feed_urls.append(feed_url)
+            feed_services[feed_url] = (service, region)
+        servicesChecked = len(set(service for service, region, feed_url in selected_feeds))
+        serviceRegionCheck = len(feed_urls)
+        log.info("Feeds selected", extra=statusLog.fields(selected=len(feed_urls), manifest=manifest.feedCount()))
+
+        # Fetch the feeds concurrently, map() hands the results back in file order so the output
+        # reads the same as a serial run.
+        with ThreadPoolExecutor(max_workers=max(1, fetch_workers)) as executor:
+            for feed_url, NewsFeed in zip(feed_urls, executor.map(fetchFeed, feed_urls)):
+                evaluateFeed(feed_url, NewsFeed)
+
+        if feed_cache:
+            feed_cache.save()
+            log.info("Feed cache", extra=statusLog.fields(hits=feed_cache.hits, misses=feed_cache.misses))
+            metrics.cache('feed', hits=feed_cache.hits, misses=feed_cache.misses)
+        feed_session.close()
+
+        # Then the events, sent to each section's own tenant
+        failed = tenantFanout.dispatch(tenants, notifyTenant, workers=tenantFanout.workersFromConfig(source, args.tenantWorkers))
+
+        log.info("Summary", extra=statusLog.fields(services_checked=servicesChecked, services_by_region_checked=serviceRegionCheck,
+                                                   no_status=serviceNoStatus, fetch_errors=serviceFetchError,
+                                                   normal=serviceNormal, abnormal=serviceNotNormal))
+        for tenant in tenants:
+            log.info("Section summary", extra=statusLog.fields(section=tenant.name, sent=tenant.counts['sent'],
+                                                               skipped=tenant.counts['skipped'], closed=tenant.counts['closed']))
+        if failed:
+            log.error("Sections that could not be reported to", extra=statusLog.fields(sections=failed))
+        log.info("Complete")
+
+        metrics.gauge('feeds.checked', serviceRegionCheck)
+        metrics.observe('phase.duration', (time.monotonic() - run_started) * 1000.0, phase='run')
+    finally:
+        feed_session.close()
+        tenantFanout.close(tenants, metrics, pool=tenant_pool)
     return
 ###
 ### End function area
@@ -80,89 +402,13 @@ def sendEvent2Dynatrace(event):
 ### Main logic
 ##############
 
-# create summary variables
-servicesChecked = 0
-serviceRegionCheck = 0
-serviceNormal = 0
-serviceNotNormal = 0
-serviceNoStatus = 0
-
-# Other values declared
-entity_ids = []
-
-# Parse arguments passed into program
-parseArguments()
-
-# Load configuration file supplied
-config = configparser.ConfigParser()
-config.read(args.iniFile)
-config.sections()
-
-token = "Api-Token " + config[args.customer + "_" + args.environment]['api_token']
-headers = {'Accept': 'application/json','Content-Type': 'application/json', 'Authorization': token}
-
-# Retrieve Application Entity ID's from Dynatrace
-# looking specifically for entities with tag "AWS_STATUS"
-getEntityIds()
-# print("Entity Ids: " + str(entity_ids))
-
-with open(config[args.customer + "_" + args.environment]['aws_rss_feeds']) as feed_list:
-   for cnt, line in enumerate(feed_list):
-       #print("Line {}: {}".format(cnt, line))
-       if line.startswith('['):
-            # print("Processing " + line)
-            servicesChecked +=1
-            #continue
-       else:
-            serviceRegionCheck +=1
-            # print("Processing RSS Feed: " + line)
-            if "us-" in line:
-                if str(config[args.customer + "_" + args.environment]['aws_region']) in line:
-                    print("Call this feed: " + line)
-                else:
-                    # Contains a region, but not the one that this app runs in.
-                    print("Skipping this feed: " + line)
-                    continue
-
-            else:
-                # no "us-" in string
-                print("Call this feed: " + line)
-
-            NewsFeed = feedparser.parse(str(line))
-
-            service_name=NewsFeed.feed.subtitle.replace(' Service Status', '')
-            print("Service Name: " + service_name)
-            # print('Number of RSS posts :', len(NewsFeed.entries))
-
-            if len(NewsFeed.entries) >= 1:
-                entry = NewsFeed.entries[0]
-                service_status=entry.title
-                print("Service Status: " + str(json.dumps(service_status, indent=4)))
-                # Finding either of these strings means AWS sees no issues with their services
-                if "normal" in service_status.lower():
-                    # print("Service Working Normally")
-                    serviceNormal +=1
-                elif "informational" in service_status.lower() and ("resolved" in service_status.lower() or "insufficient" in service_status.lower()):
-                    # print("Service Working Normally")
-                    serviceNormal +=1
-                else:
-                    print("SERVICE ALERT: " + service_status)
-                    # Create Event Payload for Dynatrace
-                    payload = buildDynatraceEventPayload(service_name, service_status)
-
-                    # Send event to Dynatrace
-                    sendEvent2Dynatrace(payload)
-
-                    serviceNotNormal +=1
-            else:
-                # print("No status to report")
-                serviceNoStatus +=1
-
-print("")
-print("##### Summary #####")
-print("Services Checked:" + str(servicesChecked))
-print("Services by Region Checked: " + str(serviceRegionCheck))
-print("Services with no status: " + str(serviceNoStatus))
-print("Services Reporting Normal: " + str(serviceNormal))
-print("Services Reporting Abnormal: " + str(serviceNotNormal))
-print("Complete")
+if __name__ == '__main__':
+    # Parse arguments passed into program
+    parseArguments()
+
+    # Load configuration file supplied
+    config = configparser.ConfigParser()
+    config.read(args.iniFile)
+    config.sections()
+
+    runStatusCheck(config)
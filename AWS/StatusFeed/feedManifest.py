@@ -0,0 +1,134 @@
+# Description: Compiled form of aws-services-rss-feeds.txt.  The manifest is parsed once into a
+# service -> region -> feed url index and only parsed again when the file changes (its size or
+# modification time).  The index is kept in memory for the status daemon and, when a cache file is
+# configured, on disk for cron runs.  select() returns the feeds of the services and regions a
+# customer cares about, so only those feeds are ever requested.
+#
+# Region and service filters are lists of prefixes, matched without regard to case.  Feeds without a
+# region in their url (cloudfront.rss, route53.rss, ...) belong to the region "global".
+#
+# Usage:
+#   manifest = feedManifest.fromConfig(config['RFD_PRD'])
+#   for service, region, feed_url in manifest.select(regions=['us-east-1', 'global']):
+#       ...
+#
+import os, re, threading, jsonStore, statusLog
+
+GLOBAL_REGION = 'global'
+# apigateway-us-east-1.rss, ec2-ap-southeast-2.rss, s3-us-gov-west-1.rss
+REGION_PATTERN = re.compile(r'-([a-z]{2}(?:-gov|-iso[a-z]?)?-[a-z]+-\d+)\.rss$')
+# Bumped when the layout of the compiled index changes
+INDEX_VERSION = 1
+
+_manifests = {}
+_manifests_lock = threading.Lock()
+
+log = statusLog.getLogger('feedManifest')
+
+
+class FeedManifest:
+
+    def __init__(self, manifest_file, cache_file=None):
+        self.manifest_file = os.path.expanduser(manifest_file)
+        self.cache_file = cache_file
+        self.services = {}
+        self.signature = None
+        self.refresh()
+
+    def refresh(self):
+        # Parse the manifest again if it changed since it was last read, from the disk cache when that
+        # was compiled from the same file
+        stat = os.stat(self.manifest_file)
+        signature = [stat.st_size, stat.st_mtime]
+        if signature == self.signature:
+            return
+
+        if self.cache_file:
+            cached = jsonStore.load(self.cache_file, {})
+            if cached.get('version') == INDEX_VERSION and cached.get('manifest') == self.manifest_file and cached.get('signature') == signature:
+                self.services = cached['services']
+                self.signature = signature
+                return
+
+        log.info("Compiling feed manifest", extra=statusLog.fields(manifest=self.manifest_file))
+        self.services = parseManifest(self.manifest_file)
+        self.signature = signature
+        if self.cache_file:
+            jsonStore.save(self.cache_file, {'version': INDEX_VERSION, 'manifest': self.manifest_file,
+                                             'signature': signature, 'services': self.services})
+        return
+
+    def select(self, regions=None, exclude_regions=None, services=None, exclude_services=None):
+        # Returns (service, region, feed url) for every feed that passes the filters, in manifest order.
+        # An empty or missing include filter lets everything through.
+        selected = []
+        for service, service_regions in self.services.items():
+            if not matches(service, services, True) or matches(service, exclude_services, False):
+                continue
+            for region, feed_urls in service_regions.items():
+                if not matches(region, regions, True) or matches(region, exclude_regions, False):
+                    continue
+                for feed_url in feed_urls:
+                    selected.append((service, region, feed_url))
+        return selected
+
+    def feedCount(self):
+        return sum(len(feed_urls) for service_regions in self.services.values() for feed_urls in service_regions.values())
+
+
+def parseManifest(manifest_file):
+    # [Service] lines start a service, the feed urls below it are indexed under the region in their name
+    services = {}
+    service = 'Other'
+    with open(manifest_file) as feed_list:
+        for line in feed_list:
+            line = line.strip()
+            if not line or line.startswith('#') or line.startswith(';'):
+                continue
+            if line.startswith('['):
+                service = line.strip('[]').strip()
+                services.setdefault(service, {})
+                continue
+            services.setdefault(service, {}).setdefault(regionOf(line), []).append(line)
+    return services
+
+
+def regionOf(feed_url):
+    match = REGION_PATTERN.search(feed_url)
+    return match.group(1) if match else GLOBAL_REGION
+
+
+def matches(value, prefixes, default):
+    if not prefixes:
+        return default
+    value = value.lower()
+    return any(value.startswith(prefix.lower()) for prefix in prefixes)
+
+
+def splitList(value):
+    return [item.strip() for item in (value or '').split(',') if item.strip()]
+
+
+def fromConfig(section):
+    # The manifest named by aws_rss_feeds, compiled once per process and refreshed when the file changes
+    manifest_file = os.path.expanduser(section['aws_rss_feeds'])
+    cache_file = section.get('feed_manifest_cache_file')
+    with _manifests_lock:
+        manifest = _manifests.get((manifest_file, cache_file))
+        if manifest:
+            manifest.refresh()
+        else:
+            manifest = _manifests[(manifest_file, cache_file)] = FeedManifest(manifest_file, cache_file)
+    return manifest
+
+
+def filtersFromConfig(section):
+    # select() keyword arguments from the aws_regions / aws_services include and exclude keys.  The older
+    # aws_region key (a single prefix such as "us-") still works and always keeps the global feeds.
+    regions = splitList(section.get('aws_regions'))
+    if not regions and section.get('aws_region'):
+        regions = splitList(section.get('aws_region')) + [GLOBAL_REGION]
+    return {'regions': regions,
+            'exclude_regions': splitList(section.get('aws_exclude_regions')),
+            'services': splitList(section.get('aws_services')),
+            'exclude_services': splitList(section.get('aws_exclude_services'))}
@@ -0,0 +1,125 @@
+# Description: Answers the usual high availability and technology questions from the SQLite entity
+# graph that processGroupExport.py writes when graph_db_file is set in its ini file.  Nothing is
+# fetched from Dynatrace, so a question takes milliseconds instead of thousands of API calls.
+#
+# Usage:
+#   python3 ~/graphQuery.py --dbFile ~/process_groups.db services-per-host
+#   python3 ~/graphQuery.py --dbFile ~/process_groups.db single-host
+#   python3 ~/graphQuery.py --dbFile ~/process_groups.db technology JAVA
+#   python3 ~/graphQuery.py --dbFile ~/process_groups.db host ip-10-0-0-12
+#   python3 ~/graphQuery.py --dbFile ~/process_groups.db sql "SELECT count(*) FROM entities"
+#
+# Edges point the way Dynatrace reports them: PROCESS_GROUP runsOn HOST, SERVICE runsOn
+# PROCESS_GROUP and PROCESS_GROUP_INSTANCE isInstanceOf PROCESS_GROUP.
+#
+import os, sys, sqlite3, argparse
+
+SCHEMA = """
+CREATE TABLE entities (entity_id TEXT PRIMARY KEY, type TEXT NOT NULL, name TEXT);
+CREATE TABLE edges (from_id TEXT NOT NULL, relationship TEXT NOT NULL, to_id TEXT NOT NULL);
+CREATE TABLE process_groups (entity_id TEXT PRIMARY KEY, monitoring_state TEXT, availability TEXT,
+                             pgi_count INTEGER, host_count INTEGER, service_count INTEGER, log_files TEXT);
+CREATE TABLE hosts (entity_id TEXT PRIMARY KEY, monitoring_mode TEXT);
+CREATE TABLE technologies (entity_id TEXT NOT NULL, technology TEXT NOT NULL, version TEXT);
+CREATE TABLE export_info (tenant_url TEXT, exported TEXT);
+CREATE INDEX entities_type_name ON entities (type, name);
+CREATE INDEX edges_from ON edges (from_id, relationship);
+CREATE INDEX edges_to ON edges (to_id, relationship);
+CREATE INDEX technologies_technology ON technologies (technology, entity_id);
+"""
+
+# name -> (help, sql, takes an argument)
+QUERIES = {
+    'services-per-host': ("Number of services running on each host, most first", """
+        SELECT h.name AS host, hosts.monitoring_mode AS mode, count(DISTINCT s.from_id) AS services,
+               count(DISTINCT p.from_id) AS process_groups
+        FROM edges p
+        JOIN entities h ON h.entity_id = p.to_id
+        JOIN hosts ON hosts.entity_id = p.to_id
+        LEFT JOIN edges s ON s.to_id = p.from_id AND s.relationship = 'runsOn'
+        WHERE p.relationship = 'runsOn' AND h.type = 'HOST'
+        GROUP BY p.to_id
+        ORDER BY services DESC, host""", False),
+    'single-host': ("Process groups with services that run on only one host", """
+        SELECT pg.name AS process_group, h.name AS host, pgs.service_count AS services
+        FROM process_groups pgs
+        JOIN entities pg ON pg.entity_id = pgs.entity_id
+        JOIN edges p ON p.from_id = pgs.entity_id AND p.relationship = 'runsOn'
+        JOIN entities h ON h.entity_id = p.to_id
+        WHERE pgs.host_count = 1 AND pgs.service_count > 0
+        ORDER BY pgs.service_count DESC, pg.name""", False),
+    'technology': ("Process groups using a technology (case insensitive, % wildcards allowed)", """
+        SELECT pg.name AS process_group, t.technology, t.version, pgs.host_count AS hosts, pgs.monitoring_state
+        FROM technologies t
+        JOIN entities pg ON pg.entity_id = t.entity_id
+        JOIN process_groups pgs ON pgs.entity_id = t.entity_id
+        WHERE t.technology LIKE ?
+        ORDER BY pg.name""", True),
+    'host': ("Process groups and services running on a host (% wildcards allowed)", """
+        SELECT h.name AS host, pg.name AS process_group, coalesce(s.name, '') AS service
+        FROM entities h
+        JOIN edges p ON p.to_id = h.entity_id AND p.relationship = 'runsOn'
+        JOIN entities pg ON pg.entity_id = p.from_id
+        LEFT JOIN edges se ON se.to_id = pg.entity_id AND se.relationship = 'runsOn'
+        LEFT JOIN entities s ON s.entity_id = se.from_id
+        WHERE h.type = 'HOST' AND h.name LIKE ?
+        ORDER BY h.name, pg.name, s.name""", True),
+}
+
+####
+#### Subroutine area
+####
+
+# Parse incoming arguments to python script
+def parseArguments(argv=None) :
+    parser = argparse.ArgumentParser('Query the entity graph written by processGroupExport.py')
+    parser.add_argument("--dbFile", required=True, help="Supply path to the graph_db_file written by the export")
+    queries = parser.add_subparsers(dest="query", metavar="query")
+    queries.required = True
+    for name, (description, sql, takes_argument) in QUERIES.items():
+        query = queries.add_parser(name, help=description)
+        if takes_argument:
+            query.add_argument("value")
+    query = queries.add_parser('sql', help="Run any SELECT against the entities, edges, process_groups, hosts and technologies tables")
+    query.add_argument("value")
+
+    global args
+    args = parser.parse_args(argv)
+    return args
+
+def runQuery(db, query, value=None) :
+    # Returns the column names and rows of one of the QUERIES, or of a SQL statement for 'sql'
+    if query == 'sql':
+        cursor = db.execute(value)
+    elif QUERIES[query][2]:
+        cursor = db.execute(QUERIES[query][1], (value,))
+    else:
+        cursor = db.execute(QUERIES[query][1])
+    return [column[0] for column in cursor.description], cursor.fetchall()
+
+###
+### End subroutine area
+###
+
+##############
+### Main logic
+##############
+
+if __name__ == '__main__':
+    parseArguments()
+
+    db_file = os.path.expanduser(args.dbFile)
+    if not os.path.exists(db_file):
+        print("Graph file " + db_file + " not found, set graph_db_file and run processGroupExport.py first")
+        sys.exit(1)
+
+    # Opened read only, the export replaces the file rather than changing it
+    db = sqlite3.connect("file:" + db_file + "?mode=ro", uri=True)
+    exported = db.execute("SELECT tenant_url, exported FROM export_info").fetchone()
+    columns, rows = runQuery(db, args.query, getattr(args, 'value', None))
+
+    print("\t".join(columns))
+    for row in rows:
+        print("\t".join("" if value is None else str(value) for value in row))
+    print("\n" + str(len(rows)) + " rows from the export of " + str(exported[0]) + " at " + str(exported[1]), file=sys.stderr)
+    db.close()
@@ -0,0 +1,441 @@
+# Description: Python version of processGroupDetailsPublic.sh.  Exports the same process group
+# information to the same tab separated columns, but instead of one curl per process group, host,
+# service and process group instance (and one jq per field) the related entities are fetched in bulk
+# with multi id entityId(...) selectors, by several workers at once, and every row is written to the
+# output file as soon as its batch is done.  The monitoring state and availability settings of all
+# process groups are read up front in one paginated pass instead of two settings calls per row.
+#
+# When snapshot_file is set in the ini file the details of every process group are kept between runs.
+# The next run lists the process groups with their relationships and only fetches the ones that are
+# new, whose hosts, services or instances changed, or whose details are older than
+# snapshot_max_age_days.  Besides the full tsv file a diff_file with just the added, changed and
+# removed rows is written.  --full fetches everything again.
+#
+# When graph_db_file is set the process groups, hosts, services and instances and the relationships
+# between them are also written to a SQLite file for graphQuery.py.
+#
+# Usage: python3 ~/processGroupExport.py --customer RFD --environment PRD --iniFile ~/env.ini
+#
+# An API token with the "entities.read" & "settings.read" permissions
+#
+# The output file is in tab-separated format (.tsv).  Open with something like Excel. The following
+# columns are present and in order below.
+# - Process Group Display Name - name as you will see in the Dynatrace Screen and it is also a hyperlinked cell that will take you directly to the process group to make any needed changes.
+# - Monitoring State - Is the process group currently configured for deep monitoring (transaction level monitoring)
+# - Process Availability - Is process group availability monitoring ON or OFF. If it's off then you will never see an alert if the identified process crashes for any reason.
+# - Process group instances count - Each process group can have one or more instances, typically running on different hosts.
+# - Technologies used by the process group
+# - Host count - The number of hosts that this process group is seen running on
+# - Host Names - The host names where the process group is running as well as the mode of the agent (FULL or INFRA).
+# - Service count - The number of identified services discovered automatically
+# - Service Names - The list of service names discovered automatically
+# - Log files monitored - A list of log files that are configured to be monitored
+#
+import os, sys, time, json, hashlib, sqlite3, requests, configparser, datetime, argparse, threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Shared modules are kept in the lib directory at the root of this repository.  If the files were
+# copied into one directory instead they are found next to this script.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+import dynatraceClient, jsonStore
+import graphQuery
+
+DEFAULT_WORKERS = 8
+# Process groups per worker batch, and entity ids per entityId(...) selector
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_SNAPSHOT_MAX_AGE_DAYS = 7
+# Bumped when the details kept per process group change, older snapshot entries are fetched again
+SNAPSHOT_VERSION = 2
+
+TSV_HEADER = ["Process_Group", "Monitoring_State", "Process_Availability", "Process_Group_Instance_Count", "Technologies",
+              "Host_Count", "Hosts", "Service_Count", "Services", "Logs_Monitored"]
+
+# Process groups that may not be worth the analysis
+SKIPPED_NAMES = ("OneAgent", "Linux System", "Windows System", "IGNORE", "Short-lived")
+
+SETTINGS_SCHEMAS = ["builtin:process-group.monitoring.state", "builtin:availability.process-group-alerting"]
+
+# Listed with the process groups in incremental mode to tell which ones changed since the snapshot
+LIST_FIELDS = "+fromRelationships.runsOn,+toRelationships.runsOn,+toRelationships.isInstanceOf"
+
+PG_FIELDS = "+properties.softwareTechnologies,+fromRelationships.runsOn,+toRelationships.runsOn,+toRelationships.isInstanceOf"
+
+####
+#### Subroutine area
+####
+
+# Parse incoming arguments to python script
+def parseArguments(argv=None) :
+    parser = argparse.ArgumentParser('Export process group details from Dynatrace to a tsv file')
+    parser.add_argument("--customer", help="Supply a customer acronym, like RFD")
+    parser.add_argument("--environment", help="Supply either LAB, DR, TST, or PRD for example.")
+    parser.add_argument("--iniFile", help="Supply path to ini file that contains necessary environment links")
+    parser.add_argument("--outputFile", help="Where to write the tsv file, overrides output_file in the ini file")
+    parser.add_argument("--full", action="store_true", help="Fetch every process group again even when snapshot_file is set")
+
+    global args
+    args = parser.parse_args(argv)
+    return args
+
+def entitySelector(entity_ids) :
+    return 'entityId(' + ','.join('"' + entity_id + '"' for entity_id in entity_ids) + ')'
+
+def fetchEntities(entity_ids, fields=None, time_from='now-7d') :
+    # Fetch entities batch_size at a time with entityId(...) selectors.  Returns a dict of entity id ->
+    # entity, an entity that could not be retrieved is left out.
+    entity_ids = list(dict.fromkeys(entity_ids))
+    entities = {}
+    for start in range(0, len(entity_ids), batch_size):
+        selector = entitySelector(entity_ids[start:start + batch_size])
+        for entity in dynatrace.iterEntities(tenant_url, selector, fields=fields, time_from=time_from):
+            entities[entity['entityId']] = entity
+    return entities
+
+def fetchHosts(host_ids) :
+    # Hosts are shared by many process groups, each one is only fetched once per export
+    with hosts_lock:
+        missing = [host_id for host_id in host_ids if host_id not in hosts]
+    if missing:
+        fetched = fetchEntities(missing, fields="+properties.monitoringMode")
+        with hosts_lock:
+            hosts.update(fetched)
+    with hosts_lock:
+        return {host_id: hosts[host_id] for host_id in host_ids if host_id in hosts}
+
+def relationshipIds(entity, direction, relationship, entity_type) :
+    ids = []
+    for related in entity.get(direction, {}).get(relationship, []):
+        if related.get('type') == entity_type:
+            ids.append(related['id'])
+        else:
+            print("Something other than " + entity_type.lower() + " type: " + str(related.get('type')))
+    return ids
+
+def softwareTechnologies(pg) :
+    software = []
+    for technology in pg.get('properties', {}).get('softwareTechnologies', []):
+        if technology.get('type'):
+            software.append(str(technology['type']) + "(" + str(technology.get('version') or 'n/a') + ")")
+    return ", ".join(software)
+
+def prefetchSettings() :
+    # Every monitoring state and availability settings object in one paginated pass, indexed by schema
+    # and scope, so no row needs a settings call of its own
+    global settings, settings_status
+    settings = {schema_id: {} for schema_id in SETTINGS_SCHEMAS}
+    settings_status = 200
+    try:
+        for item in dynatrace.iterSettings(tenant_url, SETTINGS_SCHEMAS, fields='schemaId,scope,value'):
+            settings[item['schemaId']][item['scope']] = item['value']
+    except requests.exceptions.HTTPError as e:
+        settings_status = e.response.status_code
+    except requests.exceptions.RequestException as e:
+        print("Error retrieving settings: " + str(e))
+        settings_status = 0
+
+    print("Settings objects loaded: " + ", ".join(schema_id + "=" + str(len(settings[schema_id])) for schema_id in SETTINGS_SCHEMAS) + " (response code " + str(settings_status) + ")")
+    return
+
+def getSetting(schema_id, entity_id) :
+    # Returns (response code, value of the single settings object for the scope or None)
+    if settings_status != 200:
+        return settings_status, None
+    return 200, settings[schema_id].get(entity_id)
+
+def unknownState(response_code) :
+    if response_code == 403:
+        return "UNKNOWN (token needs settings.read permission)"
+    return "UNKNOWN (" + str(response_code) + ")"
+
+def getMonitoringState(pg, software) :
+    response_code, value = getSetting("builtin:process-group.monitoring.state", pg['entityId'])
+    if response_code != 200:
+        print("Failed response from retrieving the monitoring state value.  Response Code: " + str(response_code))
+        return unknownState(response_code)
+
+    monitoring_state = value.get('MonitoringState') if value else "DEFAULT"
+    if monitoring_state == "DEFAULT" and ("DOTNET" in software or "GO" in software):
+        monitoring_state = "MONITORING_ON" if "IIS app pool" in pg['displayName'] else "MONITORING_OFF"
+    if monitoring_state == "DEFAULT":
+        monitoring_state = "MONITORING_ON"
+    return monitoring_state
+
+def getProcessAvailabilityState(pg) :
+    response_code, value = getSetting("builtin:availability.process-group-alerting", pg['entityId'])
+    if value and value.get('enabled') is True:
+        return "ON"
+    if response_code == 200:
+        return "OFF"
+    print("Failed response from retrieving the availability state value.  Response Code: " + str(response_code))
+    return unknownState(response_code)
+
+def exportBatch(pg_list) :
+    # Fetch a batch of process groups and their related entities.  Returns a dict of entity id -> the
+    # facts a row is built from, None for a process group without software technologies.  A process
+    # group that could not be retrieved is left out.
+    try:
+        pgs = fetchEntities([pg['entityId'] for pg in pg_list], fields=PG_FIELDS, time_from='now-30d')
+
+        host_ids, service_ids, pgi_ids = [], [], []
+        for pg in pgs.values():
+            host_ids.extend(relationshipIds(pg, 'fromRelationships', 'runsOn', 'HOST'))
+            service_ids.extend(relationshipIds(pg, 'toRelationships', 'runsOn', 'SERVICE'))
+            pgi_ids.extend(relationshipIds(pg, 'toRelationships', 'isInstanceOf', 'PROCESS_GROUP_INSTANCE'))
+
+        batch_hosts = fetchHosts(host_ids)
+        services = fetchEntities(service_ids)
+        pgis = fetchEntities(pgi_ids, fields="+properties.logPathLastUpdate")
+    except requests.exceptions.RequestException as e:
+        print("Error retrieving process group batch starting at " + pg_list[0]['entityId'] + ": " + str(e))
+        return {}
+
+    batch_facts = {}
+    for listed in pg_list:
+        pg = pgs.get(listed['entityId'])
+        if not pg:
+            print("Process group " + listed['entityId'] + " could not be retrieved")
+            continue
+        software = softwareTechnologies(pg)
+        batch_facts[listed['entityId']] = buildFacts(pg, software, batch_hosts, services, pgis) if software else None
+    return batch_facts
+
+def buildFacts(pg, software, batch_hosts, services, pgis) :
+    # Everything in a row that comes from the entities, the settings are applied by buildRow
+    host_ids = relationshipIds(pg, 'fromRelationships', 'runsOn', 'HOST')
+    host_names = []
+    host_list = []
+    for host_id in host_ids:
+        host = batch_hosts.get(host_id)
+        if host:
+            monitoring_mode = "INFRA" if "INFRA" in str(host.get('properties', {}).get('monitoringMode')) else "FULL"
+            host_names.append(host['displayName'] + " (" + monitoring_mode + ")")
+            host_list.append({'id': host_id, 'name': host['displayName'], 'mode': monitoring_mode})
+
+    service_ids = relationshipIds(pg, 'toRelationships', 'runsOn', 'SERVICE')
+    service_name = ", ".join(services[service_id]['displayName'] for service_id in service_ids if service_id in services)
+    service_list = [{'id': service_id, 'name': services[service_id]['displayName']} for service_id in service_ids if service_id in services]
+
+    pgi_ids = relationshipIds(pg, 'toRelationships', 'isInstanceOf', 'PROCESS_GROUP_INSTANCE')
+    log_files = ''
+    for pgi_id in pgi_ids:
+        for log_path in pgis.get(pgi_id, {}).get('properties', {}).get('logPathLastUpdate', []):
+            log_file = str(log_path.get('key')).replace('\\', '/')
+            if not log_files:
+                log_files = log_file
+            elif log_file not in log_files:
+                log_files = log_files + ", " + log_file
+    if not log_files:
+        log_files = "No log files monitored"
+
+    technologies = [{'type': technology['type'], 'version': technology.get('version')}
+                    for technology in pg.get('properties', {}).get('softwareTechnologies', []) if technology.get('type')]
+
+    return {'software': software, 'pgiCnt': len(pgi_ids), 'hostCnt': len(host_ids), 'hostName': ", ".join(host_names),
+            'serviceCnt': len(service_ids), 'serviceName': service_name, 'logFiles': log_files,
+            'hosts': host_list, 'services': service_list, 'pgiIds': pgi_ids, 'technologies': technologies}
+
+def buildRow(pg, facts) :
+    host_name = facts['hostName']
+    monitoring_state = getMonitoringState(pg, facts['software'])
+    availability_state = getProcessAvailabilityState(pg)
+
+    # Make caveat mark if we see that monitoring appears to be on BUT there's a host in infra only mode
+    if monitoring_state == "MONITORING_ON" and "INFRA" in host_name and "FULL" in host_name:
+        monitoring_state = "MONITORING_ON (*)" # Hosts identified in this PG are running in both modes
+    if "FULL" not in host_name and monitoring_state == "MONITORING_ON":
+        monitoring_state = "MONITORING_OFF" # if we don't see reference to FULL in hostName make sure mon off
+
+    pg_url = console_url + "/#processgroupdetails;id=" + pg['entityId'] + ";gtf=-2h"
+    return ['=HYPERLINK("' + pg_url + '", "' + pg['displayName'] + '")', monitoring_state, availability_state,
+            str(facts['pgiCnt']), facts['software'], str(facts['hostCnt']), host_name, str(facts['serviceCnt']),
+            facts['serviceName'], facts['logFiles']]
+
+def relationshipFingerprint(pg) :
+    # Hash of the name and the hosts, services and instances of a process group as listed.  The
+    # lastSeenTms of a running process group moves on every time it reports, so it can't tell us
+    # whether anything changed.
+    relationships = [pg['displayName']]
+    for direction, relationship in (('fromRelationships', 'runsOn'), ('toRelationships', 'runsOn'), ('toRelationships', 'isInstanceOf')):
+        relationships.append(sorted(related['id'] for related in pg.get(direction, {}).get(relationship, [])))
+    return hashlib.sha256(json.dumps(relationships).encode('utf-8')).hexdigest()
+
+def listProcessGroups() :
+    # Every process group seen in the last 7 days by name, minus the ones not worth the analysis
+    global pg_cnt
+    pg_list = []
+    fields = LIST_FIELDS if snapshot_file else None
+    for pg in dynatrace.iterEntities(tenant_url, 'type("PROCESS_GROUP")', fields=fields, time_from='now-7d', sort='name'):
+        pg_cnt +=1
+        if any(name in pg['displayName'] for name in SKIPPED_NAMES):
+            continue
+        pg_list.append({'entityId': pg['entityId'], 'displayName': pg['displayName'],
+                        'fingerprint': relationshipFingerprint(pg) if snapshot_file else None})
+    return pg_list
+
+def isUnchanged(pg) :
+    # A process group from the last snapshot is reused when its relationships are the same and its
+    # details are not older than snapshot_max_age_days
+    previous = snapshot.get(pg['entityId'])
+    if not previous or args.full or previous.get('version') != SNAPSHOT_VERSION:
+        return False
+    return previous['fingerprint'] == pg['fingerprint'] and time.time() - previous['fetched'] < snapshot_max_age
+
+def writeDiff(diff_file, previous_snapshot, new_snapshot) :
+    # Rows that were added, removed or changed since the previous export
+    changes = 0
+    with open(diff_file, 'w') as diff:
+        diff.write("\t".join(["Change"] + TSV_HEADER) + "\n")
+        for entity_id, entry in new_snapshot.items():
+            previous_row = previous_snapshot.get(entity_id, {}).get('row')
+            if entry['row'] and not previous_row:
+                diff.write("\t".join(["ADDED"] + entry['row']) + "\n")
+                changes +=1
+            elif entry['row'] and entry['row'] != previous_row:
+                diff.write("\t".join(["CHANGED"] + entry['row']) + "\n")
+                changes +=1
+        for entity_id, entry in previous_snapshot.items():
+            if entry.get('row') and not new_snapshot.get(entity_id, {}).get('row'):
+                diff.write("\t".join(["REMOVED"] + entry['row']) + "\n")
+                changes +=1
+    return changes
+
+def writeGraph(db_file, pg_list, new_snapshot) :
+    # Write the process groups and their hosts, services and instances to a SQLite file that
+    # graphQuery.py answers questions from without calling the tenant.  Built in a new file and moved
+    # over the old one so a query never sees half an export.
+    work_file = db_file + ".tmp"
+    if os.path.exists(work_file):
+        os.remove(work_file)
+
+    db = sqlite3.connect(work_file)
+    db.executescript(graphQuery.SCHEMA)
+    for pg in pg_list:
+        entry = new_snapshot.get(pg['entityId'])
+        if not entry or not entry['facts']:
+            continue
+        facts = entry['facts']
+        row = entry['row']
+        db.execute("INSERT OR REPLACE INTO entities VALUES (?, 'PROCESS_GROUP', ?)", (pg['entityId'], pg['displayName']))
+        db.execute("INSERT OR REPLACE INTO process_groups VALUES (?, ?, ?, ?, ?, ?, ?)",
+                   (pg['entityId'], row[1], row[2], facts['pgiCnt'], facts['hostCnt'], facts['serviceCnt'], facts['logFiles']))
+        for host in facts.get('hosts', []):
+            db.execute("INSERT OR REPLACE INTO entities VALUES (?, 'HOST', ?)", (host['id'], host['name']))
+            db.execute("INSERT OR REPLACE INTO hosts VALUES (?, ?)", (host['id'], host['mode']))
+            db.execute("INSERT INTO edges VALUES (?, 'runsOn', ?)", (pg['entityId'], host['id']))
+        for service in facts.get('services', []):
+            db.execute("INSERT OR REPLACE INTO entities VALUES (?, 'SERVICE', ?)", (service['id'], service['name']))
+            db.execute("INSERT INTO edges VALUES (?, 'runsOn', ?)", (service['id'], pg['entityId']))
+        for pgi_id in facts.get('pgiIds', []):
+            db.execute("INSERT OR REPLACE INTO entities VALUES (?, 'PROCESS_GROUP_INSTANCE', ?)", (pgi_id, pgi_id))
+            db.execute("INSERT INTO edges VALUES (?, 'isInstanceOf', ?)", (pgi_id, pg['entityId']))
+        for technology in facts.get('technologies', []):
+            db.execute("INSERT INTO technologies VALUES (?, ?, ?)", (pg['entityId'], technology['type'], technology['version']))
+    db.execute("INSERT INTO export_info VALUES (?, ?)", (tenant_url, datetime.datetime.now().isoformat()))
+    db.commit()
+    db.close()
+
+    os.replace(work_file, db_file)
+    return
+
+def runExport(run_config) :
+    global config, dynatrace, tenant_url, console_url, batch_size, hosts, hosts_lock, pg_cnt
+    global snapshot_file, snapshot, snapshot_max_age
+    config = run_config
+    section = config[args.customer + "_" + args.environment]
+
+    tenant_url = section['tenant_url'].rstrip('/')
+    console_url = section.get('console_url', tenant_url).rstrip('/')
+    output_file = os.path.expanduser(args.outputFile or section.get('output_file', '~/process_groups.tsv'))
+    workers = max(1, section.getint('export_workers', DEFAULT_WORKERS))
+    batch_size = max(1, section.getint('export_batch_size', DEFAULT_BATCH_SIZE))
+
+    # Incremental export, only process groups that are new or changed since the snapshot are fetched
+    snapshot_file = section.get('snapshot_file')
+    snapshot = jsonStore.load(snapshot_file, {}) if snapshot_file else {}
+    snapshot_max_age = section.getfloat('snapshot_max_age_days', DEFAULT_SNAPSHOT_MAX_AGE_DAYS) * 86400
+    graph_db_file = os.path.expanduser(section['graph_db_file']) if section.get('graph_db_file') else None
+    diff_file = os.path.expanduser(section.get('diff_file', os.path.splitext(output_file)[0] + "_changes.tsv"))
+
+    dynatrace = dynatraceClient.DynatraceClient(section['api_token'],
+                                                timeout=section.getfloat('http_timeout', dynatraceClient.DEFAULT_TIMEOUT),
+                                                retries=section.getint('http_retries', dynatraceClient.DEFAULT_RETRIES),
+                                                pool_size=workers)
+    hosts = {}
+    hosts_lock = threading.Lock()
+    pg_cnt = 0
+    row_cnt = 0
+    reused_cnt = 0
+
+    print("Exporting process groups from " + tenant_url + " at " + str(datetime.datetime.now()))
+    try:
+        pg_list = listProcessGroups()
+    except requests.exceptions.RequestException as e:
+        print("Error retrieving the process group list: " + str(e))
+        sys.exit(1)
+
+    prefetchSettings()
+
+    to_fetch = [pg for pg in pg_list if not isUnchanged(pg)]
+    batches = [to_fetch[start:start + batch_size] for start in range(0, len(to_fetch), batch_size)]
+    print("Process groups to export: " + str(len(pg_list)) + ", fetching " + str(len(to_fetch)) + " in " + str(len(batches)) + " batches")
+
+    new_snapshot = {}
+    with open(output_file, 'w') as output:
+        output.write("\t".join(TSV_HEADER) + "\n")
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = {}
+            for batch in batches:
+                future = executor.submit(exportBatch, batch)
+                for pg in batch:
+                    pending[pg['entityId']] = future
+
+            # Rows are written in name order, each one as soon as its batch is done
+            for pg in pg_list:
+                entry = None
+                if pg['entityId'] in pending:
+                    batch_facts = pending[pg['entityId']].result()
+                    if pg['entityId'] in batch_facts:
+                        entry = {'version': SNAPSHOT_VERSION, 'fingerprint': pg['fingerprint'], 'fetched': time.time(),
+                                 'facts': batch_facts[pg['entityId']]}
+                if entry is None and pg['entityId'] in snapshot:
+                    # Unchanged, or could not be retrieved this time, so the last details are used
+                    entry = dict(snapshot[pg['entityId']])
+                    reused_cnt +=1
+                if entry is None:
+                    continue
+
+                entry['row'] = buildRow(pg, entry['facts']) if entry['facts'] else None
+                new_snapshot[pg['entityId']] = entry
+                if entry['row']:
+                    output.write("\t".join(entry['row']) + "\n")
+                    row_cnt +=1
+            output.flush()
+
+    if graph_db_file:
+        writeGraph(graph_db_file, pg_list, new_snapshot)
+        print("Entity graph written to " + graph_db_file)
+
+    if snapshot_file:
+        if snapshot:
+            print("Changes since the last export: " + str(writeDiff(diff_file, snapshot, new_snapshot)) + " (" + diff_file + ")")
+        jsonStore.save(snapshot_file, new_snapshot)
+
+    dynatrace.close()
+    print("\nProcess complete.  " + str(datetime.datetime.now()) + "\nProcess Group Entities: " + str(pg_cnt) + "\nReused from snapshot: " + str(reused_cnt) + "\nRows written: " + str(row_cnt) + "\nOutput file located here: " + output_file)
+    return
+
+###
+### End subroutine area
+###
+
+##############
+### Main logic
+##############
+
+if __name__ == '__main__':
+    parseArguments()
+
+    config = configparser.ConfigParser()
+    config.read(os.path.expanduser(args.iniFile))
+
+    runExport(config)
@@ -0,0 +1,226 @@
+# Description: Offline benchmark for the AWS, Okta and Salesforce status extensions and the AWS pending
+# maintenance and DMS task error scanners.  Starts the local
+# stand-in servers from standIns.py, writes an ini file (and AWS feed manifest) per extension that
+# points at them, runs each extension as its own process and reports the wall time, the requests each
+# stand-in served and the peak memory of the extension process.
+#
+# Scenarios:
+#   quiet        every feed normal, no Salesforce incident on our instances, no pending maintenance,
+#                a fast tenant
+#   outage       a third of the AWS feeds, the newest Okta entries and 40 Salesforce incidents report
+#                issues, half the RDS instances have pending maintenance, 20 DMS tasks have validation
+#                errors, the tenant throttles some of the events
+#   slow-tenant  a few issues, but every tenant call takes over a second and some fail or are throttled
+#
+# With --stateful the caches, journal and event spool of the extensions are kept in the work directory
+# and every run after the first shows the steady state cost of a scheduled run.
+#
+# Usage:
+#   python3 ./runBenchmark.py
+#   python3 ./runBenchmark.py --scenario outage --extension sf --runs 3 --stateful
+#   python3 ./runBenchmark.py --json results.json
+#
+import os, sys, json, time, shutil, argparse, tempfile, subprocess, configparser
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import standIns
+
+try:
+    import resource
+except ImportError:
+    # Windows, peak memory is not reported there
+    resource = None
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+EXTENSIONS = {
+    'aws': os.path.join(REPO_ROOT, 'AWS', 'StatusFeed', 'awsStatusFeed.py'),
+    'okta': os.path.join(REPO_ROOT, 'Okta', 'StatusFeed', 'statusFeed.py'),
+    'sf': os.path.join(REPO_ROOT, 'Salesforce', 'StatusFeed', 'sfStatusFeed.py'),
+    'maint': os.path.join(REPO_ROOT, 'AWS', 'PendingMaintenance', 'pendingMaintenance.py'),
+    'dms': os.path.join(REPO_ROOT, 'AWS', 'DMSTaskErrors', 'dmsTaskErrors.py'),
+}
+# Regions the AWS scanners are pointed at, the AWS stand-in answers for each of them
+AWS_REGIONS = 'us-east-1,us-east-2,us-west-2,eu-west-1'
+
+SCENARIOS = {
+    'quiet': {'aws_feeds': 120, 'aws_abnormal': 0, 'feed_latency': 0.05,
+              'okta_history': 2000, 'okta_open': 0,
+              'sf_active': 5, 'sf_matching': 0, 'sf_latency': 0.05,
+              'rds_instances': 200, 'rds_pending': 0, 'dms_instances': 20, 'dms_pending': 0, 'aws_latency': 0.05,
+              'dms_tasks': 150, 'dms_task_errors': 0,
+              'tenant_latency': 0.02, 'tenant_error_rate': 0.0, 'tenant_throttle_rate': 0.0},
+    'outage': {'aws_feeds': 120, 'aws_abnormal': 40, 'feed_latency': 0.2,
+               'okta_history': 2000, 'okta_open': 3,
+               'sf_active': 60, 'sf_matching': 40, 'sf_latency': 0.2,
+               'rds_instances': 200, 'rds_pending': 100, 'dms_instances': 20, 'dms_pending': 5, 'aws_latency': 0.2,
+               'dms_tasks': 150, 'dms_task_errors': 20,
+               'tenant_latency': 0.05, 'tenant_error_rate': 0.0, 'tenant_throttle_rate': 0.05},
+    'slow-tenant': {'aws_feeds': 120, 'aws_abnormal': 5, 'feed_latency': 0.05,
+                    'okta_history': 2000, 'okta_open': 1,
+                    'sf_active': 10, 'sf_matching': 5, 'sf_latency': 0.05,
+                    'rds_instances': 200, 'rds_pending': 5, 'dms_instances': 20, 'dms_pending': 1, 'aws_latency': 0.05,
+                    'dms_tasks': 150, 'dms_task_errors': 2,
+                    'tenant_latency': 1.2, 'tenant_error_rate': 0.1, 'tenant_throttle_rate': 0.1},
+}
+
+####
+#### Subroutine area
+####
+
+# Parse incoming arguments to python script
+def parseArguments(argv=None) :
+    parser = argparse.ArgumentParser('Benchmark the status extensions against local stand-in servers')
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="Scenario to run, repeat for several (default all)")
+    parser.add_argument("--extension", action="append", choices=sorted(EXTENSIONS), help="Extension to run, repeat for several (default all)")
+    parser.add_argument("--runs", type=int, default=1, help="Runs of each extension per scenario")
+    parser.add_argument("--stateful", action="store_true", help="Keep caches, journal and event spool between the runs")
+    parser.add_argument("--seed", type=int, default=42, help="Seed for the injected errors and 429s")
+    parser.add_argument("--workDir", help="Keep the ini files and extension output here instead of a temporary directory")
+    parser.add_argument("--json", help="Also write the results to this json file")
+
+    global args
+    args = parser.parse_args(argv)
+    return args
+
+def startStandIns(scenario) :
+    aws_feeds = ['service' + str(number) + '-us-east-1' for number in range(scenario['aws_feeds'])]
+    stand_ins = {
+        'feeds': standIns.FeedStandIn(abnormal_feeds=aws_feeds[:scenario['aws_abnormal']],
+                                      okta_history=scenario['okta_history'], okta_open=scenario['okta_open'],
+                                      latency=scenario['feed_latency'], seed=args.seed),
+        'salesforce': standIns.SalesforceStandIn(active=scenario['sf_active'], matching=scenario['sf_matching'],
+                                                 latency=scenario['sf_latency'], seed=args.seed),
+        'aws': standIns.AwsStandIn(rds_instances=scenario['rds_instances'], rds_pending=scenario['rds_pending'],
+                                   dms_instances=scenario['dms_instances'], dms_pending=scenario['dms_pending'],
+                                   dms_tasks=scenario['dms_tasks'], dms_task_errors=scenario['dms_task_errors'],
+                                   latency=scenario['aws_latency'], seed=args.seed),
+        'tenant': standIns.TenantStandIn(latency=scenario['tenant_latency'], error_rate=scenario['tenant_error_rate'],
+                                         throttle_rate=scenario['tenant_throttle_rate'], seed=args.seed),
+    }
+    for stand_in in stand_ins.values():
+        stand_in.start()
+    return stand_ins, aws_feeds
+
+def writeIniFiles(work_dir, stand_ins, aws_feeds) :
+    # One ini file per extension for customer BENCH / environment RUN, all pointing at the stand-ins
+    feeds, salesforce, tenant, aws = stand_ins['feeds'].url, stand_ins['salesforce'].url, stand_ins['tenant'].url, stand_ins['aws'].url
+
+    manifest_file = os.path.join(work_dir, 'aws-feeds.txt')
+    with open(manifest_file, 'w') as manifest:
+        for number, feed in enumerate(aws_feeds):
+            if number % 10 == 0:
+                manifest.write("[Service " + str(number // 10) + "]\n")
+            manifest.write(feeds + "/rss/" + feed + ".rss\n")
+
+    # The optional state files of the extensions, each extension ignores the keys it doesn't use
+    state_keys = []
+    if args.stateful:
+        state_keys = ['feed_cache_file', 'entity_cache_file', 'incident_journal_file', 'event_spool_file',
+                      'feed_state_file', 'incident_detail_cache_file', 'feed_manifest_cache_file', 'name_cache_file']
+
+    common = {'api_token': 'dt0c01.BENCHMARK', 'http_timeout': '10', 'http_retries': '3', 'http_backoff': '0.5',
+              'status_metrics_url': tenant + "/api/v2/metrics/ingest"}
+    sections = {
+        'aws': {'BENCH_RUN': dict(common, entity_application_feed_url=tenant + "/api/v1/entity/applications?tag=AWS_STATUS",
+                                  event_feed_url=tenant + "/api/v1/events", aws_region='us-', aws_rss_feeds=manifest_file)},
+        'okta': {'OKTA': {'rss_feed': feeds + "/okta"},
+                 'BENCH_RUN': dict(common, entity_application_feed_url=tenant + "/api/v1/entity/applications?tag=OKTA_STATUS",
+                                   event_feed_url=tenant + "/api/v1/events")},
+        'sf': {'SALESFORCE': {'active_incident_feed': salesforce + "/v1/incidents/active",
+                              'incident_detail_feed': salesforce + "/v1/incidents/_INCIDENT_NUMBER_?locale=en"},
+               'BENCH_RUN': dict(common, tenant_url=tenant, sf_instances='NA100,NA101')},
+        'maint': {'BENCH_RUN': dict(common, tenant_url=tenant, aws_regions=AWS_REGIONS, aws_endpoint_url=aws)},
+        'dms': {'BENCH_RUN': dict(common, tenant_url=tenant, aws_regions=AWS_REGIONS, aws_endpoint_url=aws)},
+    }
+
+    ini_files = {}
+    for extension, extension_sections in sections.items():
+        config = configparser.ConfigParser()
+        for name, values in extension_sections.items():
+            config[name] = values
+        for key in state_keys:
+            config['BENCH_RUN'][key] = os.path.join(work_dir, extension + "_" + key[:-len('_file')] + ('.jsonl' if key == 'event_spool_file' else '.json'))
+        ini_files[extension] = os.path.join(work_dir, extension + '.ini')
+        with open(ini_files[extension], 'w') as ini_file:
+            config.write(ini_file)
+    return ini_files
+
+def runExtension(extension, ini_file, log_file) :
+    # Run one extension as its own process.  Returns (exit code, wall seconds, peak rss in MB or None).
+    with open(log_file, 'w') as log:
+        started = time.monotonic()
+        # The AWS stand-in takes any signed request, boto3 just needs some credentials to sign with
+        env = dict(os.environ, AWS_ACCESS_KEY_ID='BENCHMARK', AWS_SECRET_ACCESS_KEY='BENCHMARK')
+        process = subprocess.Popen([sys.executable, EXTENSIONS[extension], "--customer", "BENCH", "--environment", "RUN",
+                                    "--iniFile", ini_file], stdout=log, stderr=subprocess.STDOUT, env=env)
+        if resource and hasattr(os, 'wait4'):
+            pid, status, usage = os.wait4(process.pid, 0)
+            wall = time.monotonic() - started
+            exit_code = os.waitstatus_to_exitcode(status) if hasattr(os, 'waitstatus_to_exitcode') else status >> 8
+            # ru_maxrss is in KB on Linux and in bytes on macOS
+            peak = usage.ru_maxrss / (1024.0 * 1024.0) if sys.platform == 'darwin' else usage.ru_maxrss / 1024.0
+            process.returncode = exit_code
+            return exit_code, wall, peak
+        exit_code = process.wait()
+        return exit_code, time.monotonic() - started, None
+
+def printResults(results) :
+    print("")
+    print("%-12s %-5s %4s %5s %9s %9s %10s %9s %8s %8s %8s %9s" % ("Scenario", "Ext", "Run", "Exit", "Wall s", "Feed req", "Feed KB", "SF req", "AWS req", "DT req", "DT 429", "Peak MB"))
+    for result in results:
+        print("%-12s %-5s %4d %5d %9.2f %9d %10.1f %9d %8d %8d %8d %9s" % (
+            result['scenario'], result['extension'], result['run'], result['exitCode'], result['wallSeconds'],
+            result['feeds']['requests'], result['feeds']['bytes'] / 1024.0, result['salesforce']['requests'],
+            result['aws']['requests'], result['tenant']['requests'], result['tenant']['throttled'],
+            "%.1f" % result['peakMB'] if result['peakMB'] is not None else "n/a"))
+    return
+
+###
+### End subroutine area
+###
+
+##############
+### Main logic
+##############
+
+if __name__ == '__main__':
+    parseArguments()
+
+    work_root = args.workDir or tempfile.mkdtemp(prefix='status_benchmark_')
+    os.makedirs(work_root, exist_ok=True)
+    results = []
+
+    for scenario_name in args.scenario or sorted(SCENARIOS):
+        scenario = SCENARIOS[scenario_name]
+        work_dir = os.path.join(work_root, scenario_name)
+        shutil.rmtree(work_dir, ignore_errors=True)
+        os.makedirs(work_dir)
+
+        stand_ins, aws_feeds = startStandIns(scenario)
+        ini_files = writeIniFiles(work_dir, stand_ins, aws_feeds)
+        try:
+            for extension in args.extension or sorted(EXTENSIONS):
+                for run in range(1, args.runs + 1):
+                    for stand_in in stand_ins.values():
+                        stand_in.reset()
+                    log_file = os.path.join(work_dir, extension + "_run" + str(run) + ".log")
+                    print("Running " + extension + " (" + scenario_name + ", run " + str(run) + "), output in " + log_file)
+                    exit_code, wall, peak = runExtension(extension, ini_files[extension], log_file)
+                    result = {'scenario': scenario_name, 'extension': extension, 'run': run, 'exitCode': exit_code,
+                              'wallSeconds': round(wall, 3), 'peakMB': round(peak, 1) if peak is not None else None}
+                    for name, stand_in in stand_ins.items():
+                        result[name] = stand_in.stats()
+                    results.append(result)
+        finally:
+            for stand_in in stand_ins.values():
+                stand_in.stop()
+
+    printResults(results)
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump({'scenarios': {name: SCENARIOS[name] for name in args.scenario or sorted(SCENARIOS)},
+                       'stateful': args.stateful, 'results': results}, json_file, indent=2)
+        print("\nResults written to " + args.json)
+    if not args.workDir:
+        shutil.rmtree(work_root, ignore_errors=True)
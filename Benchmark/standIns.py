@@ -0,0 +1,351 @@
+# Description: Local stand-in http servers for the services the status extensions call, used by
+# runBenchmark.py so the extensions can be measured without touching AWS, Okta, Salesforce or a real
+# Dynatrace tenant.
+#
+#   FeedStandIn        AWS status RSS feeds (/rss/<name>.rss) and the Okta trust feed (/okta)
+#   SalesforceStandIn  /v1/incidents/active and /v1/incidents/<id>
+#   TenantStandIn      Dynatrace v1 applications / events and v2 entities / custom device / event and metric ingest API
+#   AwsStandIn         the RDS (query protocol) and DMS (json protocol) calls of the AWS scanners, for any region
+#
+# Every stand-in waits `latency` seconds per request and answers a share of the requests with a 5xx
+# (error_rate) or a 429 with a Retry-After header (throttle_rate).  Requests, bytes and the injected
+# failures are counted per stand-in.
+#
+import re, json, time, random, threading, collections, http.server
+from urllib.parse import urlparse, parse_qs
+
+
+class StandIn:
+
+    def __init__(self, latency=0.0, error_rate=0.0, throttle_rate=0.0, retry_after=1, seed=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.reset()
+
+        stand_in = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                return
+
+            def do_GET(self):
+                stand_in._handle(self, 'GET')
+
+            def do_POST(self):
+                stand_in._handle(self, 'POST')
+
+            def do_PUT(self):
+                stand_in._handle(self, 'PUT')
+
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = "http://127.0.0.1:" + str(self.server.server_address[1])
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        return
+
+    def reset(self):
+        with self._lock:
+            self.requests = collections.Counter()
+            self.bytes_sent = 0
+            self.errors = 0
+            self.throttled = 0
+        return
+
+    def stats(self):
+        with self._lock:
+            return {'requests': sum(self.requests.values()), 'byPath': dict(self.requests),
+                    'bytes': self.bytes_sent, 'errors': self.errors, 'throttled': self.throttled}
+
+    def route(self, method, path, query, body, headers):
+        # Returns (status code, content type, body, extra headers).  Each stand-in answers its own paths
+        # and falls back to this 404 for the rest.
+        return 404, 'application/json', '{}', {}
+
+    def requestKey(self, method, path, body, headers):
+        # What the request is counted under in stats()
+        return method + " " + pathKey(path)
+
+    def _handle(self, handler, method):
+        url = urlparse(handler.path)
+        length = int(handler.headers.get('Content-Length') or 0)
+        body = handler.rfile.read(length) if length else b''
+        if self.latency:
+            time.sleep(self.latency)
+
+        with self._lock:
+            self.requests[self.requestKey(method, url.path, body, handler.headers)] +=1
+            roll = self.random.random()
+            if roll < self.throttle_rate:
+                self.throttled +=1
+                outcome = 'throttle'
+            elif roll < self.throttle_rate + self.error_rate:
+                self.errors +=1
+                outcome = 'error'
+            else:
+                outcome = None
+
+        if outcome == 'throttle':
+            reply = (429, 'application/json', '{"error": "too many requests"}', {'Retry-After': str(self.retry_after)})
+        elif outcome == 'error':
+            reply = (503, 'application/json', '{"error": "unavailable"}', {})
+        else:
+            reply = self.route(method, url.path, parse_qs(url.query), body, handler.headers)
+
+        status, content_type, content, headers = reply
+        content = content.encode('utf-8') if isinstance(content, str) else content
+        handler.send_response(status)
+        handler.send_header('Content-Type', content_type)
+        handler.send_header('Content-Length', str(len(content)))
+        for name, value in headers.items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        try:
+            handler.wfile.write(content)
+        except (BrokenPipeError, ConnectionResetError):
+            # The streaming Okta reader hangs up once it has read enough entries
+            pass
+        with self._lock:
+            self.bytes_sent += len(content)
+        return
+
+
+def pathKey(path):
+    # Group the requests per endpoint rather than per feed / incident / entity
+    parts = [part for part in path.split('/') if part]
+    if len(parts) > 1 and parts[0] in ('rss',):
+        return "/rss/*"
+    if len(parts) > 2 and parts[0] == 'v1' and parts[1] == 'incidents' and parts[2] != 'active':
+        return "/v1/incidents/*"
+    return path
+
+
+class FeedStandIn(StandIn):
+    # abnormal_feeds: names of the AWS feeds that report an issue.  okta_history: number of entries in the
+    # Okta feed, okta_open: how many of the newest ones are open disruptions.
+
+    def __init__(self, abnormal_feeds=(), okta_history=2000, okta_open=0, **kwargs):
+        self.abnormal_feeds = set(abnormal_feeds)
+        self.okta_history = okta_history
+        self.okta_open = okta_open
+        self._okta_feed = None
+        StandIn.__init__(self, **kwargs)
+
+    def route(self, method, path, query, body, headers):
+        if path.startswith('/rss/') and path.endswith('.rss'):
+            name = path[len('/rss/'):-len('.rss')]
+            etag = '"' + name + ('-issue' if name in self.abnormal_feeds else '-ok') + '"'
+            if headers.get('If-None-Match') == etag:
+                return 304, 'application/rss+xml', b'', {'ETag': etag}
+            return 200, 'application/rss+xml', awsFeed(name, name in self.abnormal_feeds), {'ETag': etag}
+        if path == '/okta':
+            etag = '"okta-' + str(self.okta_open) + '"'
+            if headers.get('If-None-Match') == etag:
+                return 304, 'application/rss+xml', b'', {'ETag': etag}
+            if self._okta_feed is None:
+                self._okta_feed = oktaFeed(self.okta_history, self.okta_open)
+            return 200, 'application/rss+xml', self._okta_feed, {'ETag': etag}
+        return StandIn.route(self, method, path, query, body, headers)
+
+
+class SalesforceStandIn(StandIn):
+    # active: number of active incidents, matching: how many of them list one of the benchmark instances
+
+    def __init__(self, active=0, matching=0, instance='NA100', **kwargs):
+        self.active = active
+        self.matching = matching
+        self.instance = instance
+        StandIn.__init__(self, **kwargs)
+
+    def route(self, method, path, query, body, headers):
+        if path == '/v1/incidents/active':
+            incidents = []
+            for number in range(self.active):
+                instance = self.instance if number < self.matching else 'EU' + str(number)
+                incidents.append({'id': 1000 + number, 'instanceKeys': [instance], 'updatedAt': '2024-01-01T00:00:00Z'})
+            return 200, 'application/json', json.dumps(incidents), {}
+        if path.startswith('/v1/incidents/'):
+            number = path.rsplit('/', 1)[-1]
+            detail = {'id': number, 'instanceKeys': [self.instance], 'serviceKeys': ['core', 'api'],
+                      'IncidentImpacts': [{'label': 'Performance Degradation', 'text': 'Incident ' + number + ' is being investigated.'},
+                                          {'label': 'Performance Degradation', 'text': 'Users may see slow page loads.'}]}
+            return 200, 'application/json', json.dumps(detail), {}
+        return StandIn.route(self, method, path, query, body, headers)
+
+
+class TenantStandIn(StandIn):
+
+    def __init__(self, applications=3, custom_devices=0, **kwargs):
+        self.applications = applications
+        self.custom_devices = custom_devices
+        StandIn.__init__(self, **kwargs)
+
+    def route(self, method, path, query, body, headers):
+        if path == '/api/v1/entity/applications':
+            applications = [{'entityId': 'APPLICATION-' + str(number), 'displayName': 'App ' + str(number)} for number in range(self.applications)]
+            return 200, 'application/json', json.dumps(applications), {}
+        if path == '/api/v1/events' and method == 'POST':
+            return 200, 'application/json', '{"storedEventIds": [1], "storedIds": ["1"]}', {}
+        if path == '/api/v2/entities' and method == 'GET':
+            selector = query.get('entitySelector', [''])[0]
+            devices = [{'entityId': 'CUSTOM_DEVICE-' + str(number), 'displayName': 'Device ' + str(number)} for number in range(self.custom_devices)]
+            devices.append({'entityId': 'CUSTOM_DEVICE-SF', 'displayName': 'Salesforce'})
+            if 'salesforce' in selector.lower():
+                devices = [device for device in devices if 'salesforce' in device['displayName'].lower()]
+            return 200, 'application/json', json.dumps({'totalCount': len(devices), 'pageSize': len(devices), 'entities': devices}), {}
+        if path == '/api/v2/events/ingest' and method == 'POST':
+            return 201, 'application/json', '{"reportCount": 1, "eventIngestResults": [{"correlationId": "1", "status": "OK"}]}', {}
+        if path == '/api/v2/metrics/ingest' and method == 'POST':
+            lines = len([line for line in body.decode('utf-8').split('\n') if line.strip()])
+            return 202, 'application/json', json.dumps({'linesOk': lines, 'linesInvalid': 0, 'error': None}), {}
+        if path == '/api/v2/entities/custom' and method == 'POST':
+            return 201, 'application/json', '{"entityId": "CUSTOM_DEVICE-SF", "groupId": "CUSTOM_DEVICE_GROUP-SF"}', {}
+        return StandIn.route(self, method, path, query, body, headers)
+
+
+class AwsStandIn(StandIn):
+    # Answers every region the client signs for (the region is read from the Authorization header).
+    # rds_instances / dms_instances: instances per region, rds_pending / dms_pending: how many of them
+    # have pending maintenance.  dms_tasks: replication tasks per region with dms_task_tables tables
+    # each, dms_task_errors: how many of the tasks have tables in a validation error state.  Listings
+    # are paged page_size items at a time.
+
+    ACCOUNT = '123456789012'
+    RDS_NAMESPACE = 'http://rds.amazonaws.com/doc/2014-10-31/'
+
+    def __init__(self, rds_instances=0, rds_pending=0, dms_instances=0, dms_pending=0, dms_tasks=0, dms_task_errors=0,
+                 dms_task_tables=20, page_size=100, **kwargs):
+        self.rds_instances = rds_instances
+        self.rds_pending = rds_pending
+        self.dms_instances = dms_instances
+        self.dms_pending = dms_pending
+        self.dms_tasks = dms_tasks
+        self.dms_task_errors = dms_task_errors
+        self.dms_task_tables = dms_task_tables
+        self.page_size = page_size
+        StandIn.__init__(self, **kwargs)
+
+    def requestKey(self, method, path, body, headers):
+        service, region = awsScope(headers)
+        return service + " " + awsAction(service, body, headers)
+
+    def route(self, method, path, query, body, headers):
+        service, region = awsScope(headers)
+        action = awsAction(service, body, headers)
+        if service == 'rds':
+            params = parse_qs(body.decode('utf-8'))
+            return self.rds(action, region, {name: values[0] for name, values in params.items()})
+        if service == 'dms':
+            return self.dms(action, region, json.loads(body or b'{}'))
+        return 400, 'application/json', '{"__type": "UnknownOperationException"}', {}
+
+    def rds(self, action, region, params):
+        instances = ['db-' + str(number) for number in range(self.rds_instances)]
+        arn = 'arn:aws:rds:' + region + ':' + self.ACCOUNT + ':db:'
+        if action == 'DescribeDBInstances':
+            page, marker = self.page(instances, params.get('Marker'), params.get('MaxRecords'))
+            members = ''.join('<DBInstance><DBInstanceIdentifier>' + name + '</DBInstanceIdentifier><DBInstanceArn>' + arn + name +
+                              '</DBInstanceArn><DBInstanceStatus>available</DBInstanceStatus></DBInstance>' for name in page)
+            return self.rdsReply(action, '<DBInstances>' + members + '</DBInstances>', marker)
+        if action == 'DescribePendingMaintenanceActions':
+            page, marker = self.page(instances[:self.rds_pending], params.get('Marker'), params.get('MaxRecords'))
+            members = ''.join('<ResourcePendingMaintenanceActions><ResourceIdentifier>' + arn + name + '</ResourceIdentifier>'
+                              '<PendingMaintenanceActionDetails><PendingMaintenanceAction><Action>system-update</Action>'
+                              '<Description>New Operating System update is available</Description>'
+                              '<AutoAppliedAfterDate>2024-03-01T00:00:00Z</AutoAppliedAfterDate></PendingMaintenanceAction>'
+                              '</PendingMaintenanceActionDetails></ResourcePendingMaintenanceActions>' for name in page)
+            return self.rdsReply(action, '<PendingMaintenanceActions>' + members + '</PendingMaintenanceActions>', marker)
+        return 400, 'text/xml', '<ErrorResponse><Error><Code>InvalidAction</Code></Error></ErrorResponse>', {}
+
+    def dms(self, action, region, params):
+        instances = ['REP' + str(number) for number in range(self.dms_instances)]
+        arn = 'arn:aws:dms:' + region + ':' + self.ACCOUNT + ':rep:'
+        if action == 'DescribeReplicationInstances':
+            page, marker = self.page(instances, params.get('Marker'), params.get('MaxRecords'))
+            items = [{'ReplicationInstanceArn': arn + name, 'ReplicationInstanceIdentifier': 'replication-' + name.lower()} for name in page]
+            return self.dmsReply({'ReplicationInstances': items}, marker)
+        if action == 'DescribePendingMaintenanceActions':
+            page, marker = self.page(instances[:self.dms_pending], params.get('Marker'), params.get('MaxRecords'))
+            items = [{'ResourceIdentifier': arn + name,
+                      'PendingMaintenanceActionDetails': [{'Action': 'os-upgrade', 'Description': 'Operating system upgrade', 'AutoAppliedAfterDate': 1709251200}]}
+                     for name in page]
+            return self.dmsReply({'PendingMaintenanceActions': items}, marker)
+        if action == 'DescribeReplicationTasks':
+            tasks = ['TASK' + str(number) for number in range(self.dms_tasks)]
+            page, marker = self.page(tasks, params.get('Marker'), params.get('MaxRecords'))
+            items = [{'ReplicationTaskArn': 'arn:aws:dms:' + region + ':' + self.ACCOUNT + ':task:' + name,
+                      'ReplicationTaskIdentifier': 'migrate-' + name.lower(), 'Status': 'running'} for name in page]
+            return self.dmsReply({'ReplicationTasks': items}, marker)
+        if action == 'DescribeTableStatistics':
+            task_arn = params.get('ReplicationTaskArn', '')
+            failing = task_arn.rsplit(':TASK', 1)[-1].isdigit() and int(task_arn.rsplit(':TASK', 1)[-1]) < self.dms_task_errors
+            # A failing task has one table of each of these states, the rest are validated
+            states = ['Mismatched records', 'Suspended records', 'Table error'] if failing else []
+            tables = [{'SchemaName': 'app', 'TableName': 'table' + str(number), 'TableState': 'Table completed',
+                       'ValidationState': states[number] if number < len(states) else 'Validated'} for number in range(self.dms_task_tables)]
+            page, marker = self.page(tables, params.get('Marker'), params.get('MaxRecords'))
+            return self.dmsReply({'ReplicationTaskArn': task_arn, 'TableStatistics': page}, marker)
+        return 400, 'application/x-amz-json-1.1', '{"__type": "InvalidActionException"}', {}
+
+    def page(self, items, marker, max_records):
+        start = int(marker or 0)
+        end = start + int(max_records or self.page_size)
+        return items[start:end], str(end) if end < len(items) else None
+
+    def rdsReply(self, action, result, marker):
+        if marker:
+            result += '<Marker>' + marker + '</Marker>'
+        return (200, 'text/xml', '<' + action + 'Response xmlns="' + self.RDS_NAMESPACE + '"><' + action + 'Result>' + result +
+                '</' + action + 'Result><ResponseMetadata><RequestId>standin</RequestId></ResponseMetadata></' + action + 'Response>', {})
+
+    def dmsReply(self, result, marker):
+        if marker:
+            result['Marker'] = marker
+        return 200, 'application/x-amz-json-1.1', json.dumps(result), {}
+
+
+def awsFeed(name, abnormal):
+    title = "Increased error rates" if abnormal else "Service is operating normally"
+    return ('<?xml version="1.0" encoding="UTF-8"?><rss version="2.0"><channel><title>Amazon ' + name + ' Service Status</title>'
+            '<link>https://status.aws.amazon.com/</link><description>' + name + ' Service Status</description>'
+            '<item><title>' + title + '</title><link>https://status.aws.amazon.com/</link>'
+            '<description>' + title + ' for ' + name + '.</description><guid>' + name + '-1</guid>'
+            '<pubDate>Mon, 01 Jan 2024 00:00:00 PST</pubDate></item></channel></rss>')
+
+
+def oktaFeed(history, open_issues):
+    items = []
+    for number in range(history):
+        title = "Service Disruption: Okta sign in " + str(number) if number < open_issues else "Resolved: Service Degradation " + str(number)
+        items.append('<item><title>' + title + '</title><link>https://status.okta.com/' + str(number) + '</link>'
+                     '<description>' + ('Okta is investigating reports of issues. ' * 8) + '</description>'
+                     '<guid>okta-' + str(number) + '</guid><pubDate>Mon, 01 Jan 2024 00:00:00 PST</pubDate></item>')
+    return ('<?xml version="1.0" encoding="UTF-8"?><rss version="2.0"><channel><title>Okta Trust</title>'
+            '<link>https://status.okta.com/</link><description>Okta Trust</description>' + ''.join(items) + '</channel></rss>')
+
+
+def awsScope(headers):
+    # (service, region) from the credential scope of a SigV4 Authorization header
+    match = re.search(r'Credential=[^/]+/[^/]+/([^/]+)/([^/]+)/', headers.get('Authorization', ''))
+    if not match:
+        return 'unknown', 'us-east-1'
+    return match.group(2), match.group(1)
+
+
+def awsAction(service, body, headers):
+    # json protocol services name the action in X-Amz-Target, query protocol ones in the form body
+    if headers.get('X-Amz-Target'):
+        return headers['X-Amz-Target'].rsplit('.', 1)[-1]
+    return parse_qs(body.decode('utf-8')).get('Action', ['Unknown'])[0]
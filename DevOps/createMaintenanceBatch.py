@@ -0,0 +1,317 @@
+# Description: Batch version of createMaintenanceV2.sh.  Creates every maintenance window of a plan file
+# (CSV or JSON) in one run instead of one window per invocation.  The whole plan is checked before
+# anything is sent, the windows that already exist in the environment are left alone so running the
+# same plan again creates nothing twice, and the missing windows are created create_batch_size per
+# settings request, create_workers requests at a time.  Throttled (429) and failed (5xx) requests are
+# retried by the shared Dynatrace client.
+#
+# Plan columns (CSV header or JSON keys, one window per row / object):
+#   name                required, the window name
+#   start               required, local start time like 2024-03-01T22:00 or "2024-03-01 22:00:00"
+#   end or minutes      required, local end time or the length of the window
+#   description         optional, defaults to the name
+#   time_zone           optional, like America/Chicago, defaults to time_zone in the ini file (UTC)
+#   management_zones    optional, ";" separated management zone ids or names, the window only applies to them
+#   suppression         optional, DETECT_PROBLEMS_DONT_ALERT (default), DETECT_PROBLEMS_AND_ALERT or DONT_DETECT_PROBLEMS
+#   disable_synthetics  optional, true (default) or false
+#
+# A window already exists when one with the same name, start, end and time zone is there.
+#
+# Usage: python3 ./createMaintenanceBatch.py --customer RFD --environment PRD --iniFile ./env.ini --plan ./patch-night.csv
+#        python3 ./createMaintenanceBatch.py --customer RFD --environment PRD --iniFile ./env.ini --plan ./patch-night.json --dryRun
+#
+# An API token with the "settings.read" & "settings.write" permissions, and "ReadConfig" when
+# management zones are given by name
+#
+import os, sys, csv, json, datetime, configparser, argparse, requests
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+except ImportError:
+    # Python before 3.9, time zones are then left for Dynatrace to check
+    ZoneInfo = None
+
+# Shared modules are kept in the lib directory at the root of this repository.  If the files were
+# copied into one directory instead they are found next to this script.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+import dynatraceClient
+
+MAINTENANCE_SCHEMA = 'builtin:alerting.maintenance-window'
+SUPPRESSIONS = ('DETECT_PROBLEMS_DONT_ALERT', 'DETECT_PROBLEMS_AND_ALERT', 'DONT_DETECT_PROBLEMS')
+TIME_FORMATS = ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M')
+DEFAULT_TIME_ZONE = 'UTC'
+DEFAULT_BATCH_SIZE = 20
+DEFAULT_WORKERS = 4
+
+####
+#### Subroutine area
+####
+
+# Parse incoming arguments to python script
+def parseArguments(argv=None) :
+    parser = argparse.ArgumentParser('Create the maintenance windows of a plan file in Dynatrace')
+    parser.add_argument("--customer", help="Supply a customer value")
+    parser.add_argument("--environment", help="Supply something like LAB, DR, TST, or PRD")
+    parser.add_argument("--iniFile", help="Supply path to ini file")
+    parser.add_argument("--plan", help="Supply path to the plan file (.csv or .json)")
+    parser.add_argument("--dryRun", action="store_true", help="Check the plan and list the windows that would be created")
+
+    global args
+    args = parser.parse_args(argv)
+    return args
+
+def readPlan(plan_file) :
+    # The rows of a CSV plan or the objects of a JSON plan (a list, or {"windows": [...]})
+    with open(os.path.expanduser(plan_file), newline='') as plan:
+        if plan_file.lower().endswith('.json'):
+            rows = json.load(plan)
+            return rows.get('windows', []) if isinstance(rows, dict) else rows
+        return list(csv.DictReader(plan))
+
+def parseTime(text) :
+    for time_format in TIME_FORMATS:
+        try:
+            return datetime.datetime.strptime(str(text).strip(), time_format)
+        except ValueError:
+            continue
+    return None
+
+def isTrue(value, default) :
+    if value is None or str(value).strip() == '':
+        return default
+    return str(value).strip().lower() in ('true', 'yes', 'y', '1')
+
+def isKnownTimeZone(time_zone) :
+    # Checked against the local time zone database.  Without one (no zoneinfo, or neither the system
+    # zones nor the tzdata package, so not even UTC is found) the zone is left for Dynatrace to check.
+    if not ZoneInfo:
+        return True
+    try:
+        ZoneInfo(time_zone)
+    except ValueError:
+        return False
+    except ZoneInfoNotFoundError:
+        try:
+            ZoneInfo('UTC')
+        except ZoneInfoNotFoundError:
+            return True
+        return False
+    return True
+
+def validatePlan(rows, default_time_zone) :
+    # Every problem of the plan at once, so it can be fixed in one go.  Returns (windows, errors).
+    windows = []
+    errors = []
+    seen = {}
+    for number, row in enumerate(rows, start=1):
+        row = {str(key).strip().lower(): value for key, value in row.items() if key is not None}
+        label = "Row " + str(number)
+        problems = []
+
+        name = str(row.get('name') or '').strip()
+        if not name:
+            problems.append("name is missing")
+        start = parseTime(row.get('start') or '')
+        if not start:
+            problems.append("start '" + str(row.get('start') or '') + "' is not a time like 2024-03-01T22:00")
+
+        end = None
+        if str(row.get('end') or '').strip():
+            end = parseTime(row['end'])
+            if not end:
+                problems.append("end '" + str(row['end']) + "' is not a time like 2024-03-01T23:00")
+        elif str(row.get('minutes') or '').strip():
+            try:
+                minutes = int(str(row['minutes']).strip())
+            except ValueError:
+                minutes = 0
+            if minutes <= 0:
+                problems.append("minutes '" + str(row['minutes']) + "' is not a positive number")
+            elif start:
+                end = start + datetime.timedelta(minutes=minutes)
+        else:
+            problems.append("end or minutes is missing")
+        if start and end and end <= start:
+            problems.append("end is not after start")
+
+        time_zone = str(row.get('time_zone') or '').strip() or default_time_zone
+        if not isKnownTimeZone(time_zone):
+            problems.append("time_zone '" + time_zone + "' is not known")
+
+        suppression = str(row.get('suppression') or '').strip().upper() or SUPPRESSIONS[0]
+        if suppression not in SUPPRESSIONS:
+            problems.append("suppression '" + suppression + "' is not one of " + ", ".join(SUPPRESSIONS))
+
+        if problems:
+            errors.append(label + (" (" + name + ")" if name else "") + ": " + "; ".join(problems))
+            continue
+
+        window = {'name': name,
+                  'description': str(row.get('description') or '').strip() or name,
+                  'start': start.strftime(TIME_FORMATS[0]),
+                  'end': end.strftime(TIME_FORMATS[0]),
+                  'time_zone': time_zone,
+                  'management_zones': [zone.strip() for zone in str(row.get('management_zones') or '').split(';') if zone.strip()],
+                  'suppression': suppression,
+                  'disable_synthetics': isTrue(row.get('disable_synthetics'), True)}
+        key = windowKey(window)
+        if key in seen:
+            errors.append(label + " (" + name + "): same window as row " + str(seen[key]))
+            continue
+        seen[key] = number
+        windows.append(window)
+    return windows, errors
+
+def windowKey(window) :
+    return (window['name'], window['start'], window['end'], window['time_zone'])
+
+def existingWindows(dynatrace, tenant_url) :
+    # The keys of the one time windows already in the environment, in one paginated settings listing
+    keys = set()
+    for item in dynatrace.iterSettings(tenant_url, [MAINTENANCE_SCHEMA], fields='objectId,value'):
+        value = item.get('value', {})
+        once = value.get('schedule', {}).get('onceRecurrence')
+        if value.get('schedule', {}).get('scheduleType') != 'ONCE' or not once:
+            continue
+        start, end = parseTime(once.get('startTime', '')), parseTime(once.get('endTime', ''))
+        if start and end:
+            keys.add((value.get('generalProperties', {}).get('name'), start.strftime(TIME_FORMATS[0]),
+                      end.strftime(TIME_FORMATS[0]), once.get('timeZone')))
+    return keys
+
+def resolveManagementZones(dynatrace, tenant_url, windows) :
+    # Management zones given by name are looked up once, ids are passed on as they are.  Returns the
+    # names that could not be found.
+    names = set(zone for window in windows for zone in window['management_zones'] if not zone.lstrip('-').isdigit())
+    if not names:
+        return []
+    response = dynatrace.get(tenant_url + "/api/config/v1/managementZones")
+    response.raise_for_status()
+    ids = {zone['name']: zone['id'] for zone in response.json().get('values', [])}
+    for window in windows:
+        window['management_zones'] = [ids.get(zone, zone) for zone in window['management_zones']]
+    return sorted(name for name in names if name not in ids)
+
+def settingsObject(window) :
+    # The same settings object createMaintenanceV2.sh sends, with the filters of the management zones
+    return {'schemaId': MAINTENANCE_SCHEMA,
+            'scope': 'environment',
+            'value': {'enabled': True,
+                      'generalProperties': {'name': window['name'],
+                                            'description': window['description'],
+                                            'maintenanceType': 'PLANNED',
+                                            'suppression': window['suppression'],
+                                            'disableSyntheticMonitorExecution': window['disable_synthetics']},
+                      'schedule': {'scheduleType': 'ONCE',
+                                   'onceRecurrence': {'startTime': window['start'],
+                                                      'endTime': window['end'],
+                                                      'timeZone': window['time_zone']}},
+                      'filters': [{'entityTags': [], 'managementZones': [zone]} for zone in window['management_zones']]}}
+
+def createBatch(dynatrace, settings_url, batch) :
+    # POST one batch of windows.  Returns the names of the ones that were not created.
+    try:
+        response = dynatrace.post(settings_url, params={'validateOnly': 'false'}, data=json.dumps([settingsObject(window) for window in batch]))
+    except requests.exceptions.RequestException as e:
+        print("Error creating " + str(len(batch)) + " maintenance windows: " + str(e))
+        return [window['name'] for window in batch]
+
+    try:
+        results = response.json()
+    except ValueError:
+        results = None
+    if not isinstance(results, list) or len(results) != len(batch):
+        # Not a result per window, the whole batch was rejected
+        print("Error creating " + str(len(batch)) + " maintenance windows, response code: " + str(response.status_code) + ", body: " + response.text)
+        return [window['name'] for window in batch]
+
+    failed = []
+    for window, result in zip(batch, results):
+        if 200 <= result.get('code', response.status_code) < 300:
+            print("Created maintenance window " + window['name'] + " (" + window['start'] + " - " + window['end'] + " " + window['time_zone'] + ")")
+        else:
+            print("Error creating maintenance window " + window['name'] + ": " + json.dumps(result.get('error', result)))
+            failed.append(window['name'])
+    return failed
+
+def runSchedule(run_config) :
+    global config
+    config = run_config
+
+    section_name = str(args.customer) + "_" + str(args.environment)
+    if not config.has_section(section_name):
+        print("Section " + section_name + " not found in the ini file...exiting")
+        sys.exit(1)
+    section = config[section_name]
+    tenant_url = section['tenant_url'].rstrip('/')
+
+    # Check the whole plan before anything is sent
+    try:
+        rows = readPlan(args.plan)
+    except (OSError, ValueError, csv.Error) as e:
+        print("Unable to read the plan " + str(args.plan) + ": " + str(e) + "...exiting")
+        sys.exit(1)
+    windows, errors = validatePlan(rows, section.get('time_zone', DEFAULT_TIME_ZONE))
+    if errors:
+        print("The plan has " + str(len(errors)) + " problem(s), nothing was created:")
+        for error in errors:
+            print("  " + error)
+        sys.exit(1)
+    print("Windows in the plan: " + str(len(windows)))
+
+    dynatrace = dynatraceClient.fromConfig(section)
+    try:
+        missing_zones = resolveManagementZones(dynatrace, tenant_url, windows)
+        existing = existingWindows(dynatrace, tenant_url)
+    except requests.exceptions.RequestException as e:
+        print("Unable to read the current maintenance windows: " + str(e) + "...exiting")
+        dynatrace.close()
+        sys.exit(1)
+    if missing_zones:
+        print("Management zones not found, nothing was created: " + ", ".join(missing_zones))
+        dynatrace.close()
+        sys.exit(1)
+
+    # Only what isn't there yet, so the same plan can be run again after a partial failure
+    to_create = [window for window in windows if windowKey(window) not in existing]
+    print("Windows that already exist: " + str(len(windows) - len(to_create)) + ", to create: " + str(len(to_create)))
+
+    failed = []
+    if args.dryRun:
+        for window in to_create:
+            print("Would create: " + json.dumps(settingsObject(window)))
+    elif to_create:
+        batch_size = max(1, section.getint('create_batch_size', DEFAULT_BATCH_SIZE))
+        batches = [to_create[index:index + batch_size] for index in range(0, len(to_create), batch_size)]
+        settings_url = tenant_url + "/api/v2/settings/objects"
+        with ThreadPoolExecutor(max_workers=max(1, section.getint('create_workers', DEFAULT_WORKERS))) as executor:
+            for batch_failed in executor.map(lambda batch: createBatch(dynatrace, settings_url, batch), batches):
+                failed.extend(batch_failed)
+    dynatrace.close()
+
+    print("")
+    print("##### Summary #####")
+    print("Created: " + str(0 if args.dryRun else len(to_create) - len(failed)) + ", already there: " + str(len(windows) - len(to_create)) + ", failed: " + str(len(failed)))
+    if failed:
+        print("Run the same plan again to retry: " + ", ".join(failed))
+        sys.exit(1)
+    return
+
+###
+### End subroutine area
+###
+
+##############
+### Main logic
+##############
+
+if __name__ == '__main__':
+    # Parse arguments passed into program
+    parseArguments()
+
+    # Load configuration file supplied
+    config = configparser.ConfigParser()
+    config.read(args.iniFile)
+
+    runSchedule(config)
@@ -1,43 +1,166 @@
 # This Python script will modify the json payload provided to make suitable
 # for use by Dynatrace to update the state of a custom event
-import json, configparser, argparse, traceback, sys
+#
+# Bulk mode: instead of one payload file per custom event (written, cleaned up here and PUT by
+# updateCustomEventState.sh), enable or disable every metric event matching a selector in one run.
+# The metric events are read in one paginated settings listing (builtin:anomaly-detection.metric-events),
+# the ones already in the requested state are skipped, and the rest are updated update_workers at a
+# time over the pooled connections of the shared Dynatrace client.
+#
+# Selectors, combined when more than one is given:
+#   --ids     comma separated settings object ids or the v1 config ids (legacyId) updateCustomEventState.sh used
+#   --name    case insensitive regular expression (or plain substring) of the metric event name
+#   --tag     KEY or KEY:VALUE of the properties of the event template
+#
+# Usage:
+#   python3 ./CleanCustomEventStatePayload.py --json /tmp/custom_event_state_current_XXXXXXXX.json --action DISABLE
+#   python3 ./CleanCustomEventStatePayload.py --customer RFD --environment PRD --iniFile ../env.ini --name "release" --action DISABLE
+#   python3 ./CleanCustomEventStatePayload.py --customer RFD --environment PRD --iniFile ../env.ini --tag team:checkout --action ENABLE --dryRun
+#
+# An API token with the "settings.read" & "settings.write" permissions is needed for bulk mode
+#
+import os, re, sys, json, configparser, argparse, traceback
+
+# Shared modules are kept in the lib directory at the root of this repository.  If the files were
+# copied into one directory instead they are found next to this script.  Only bulk mode imports them
+# (and requests), cleaning up a payload file works on a host that has neither.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'lib'))
+
+METRIC_EVENTS_SCHEMA = 'builtin:anomaly-detection.metric-events'
+DEFAULT_WORKERS = 8
 
 # begin functions
 
-def parseArguments() :
+def parseArguments(argv=None) :
     parser = argparse.ArgumentParser('Cleanup payload for Metric Anomaly update ')
     parser.add_argument("--json", help="Supply the json file to add the attributes to")
     parser.add_argument("--action", help="ENABLE or DISABLE")
+    parser.add_argument("--customer", help="Bulk mode: supply a customer value")
+    parser.add_argument("--environment", help="Bulk mode: supply something like LAB, DR, TST, or PRD")
+    parser.add_argument("--iniFile", help="Bulk mode: supply path to ini file")
+    parser.add_argument("--ids", help="Bulk mode: comma separated metric event ids (settings object id or v1 config id)")
+    parser.add_argument("--name", help="Bulk mode: case insensitive regular expression of the metric event name")
+    parser.add_argument("--tag", help="Bulk mode: KEY or KEY:VALUE of an event template property")
+    parser.add_argument("--workers", type=int, help="Bulk mode: number of metric events updated at the same time (default 8)")
+    parser.add_argument("--dryRun", action="store_true", help="Bulk mode: list what would change without updating anything")
 
     global args
-    args = parser.parse_args()
-    return
-
-# end functions
-
-# Main logic area
-
-# Parse arguments passed into program
-parseArguments()
-
-# Open the provided file and look for elements to remove and change the status of "enabled" 
-# based on parameter provided to script (--action)
-with open(args.json, "r") as read_file:
-    dynatrace_json = json.load(read_file)
+    args = parser.parse_args(argv)
+    return args
 
+def cleanPayload(dynatrace_json, action) :
+    # Look for elements to remove and change the status of "enabled" based on the action
     if "metadata" in dynatrace_json.keys():
         dynatrace_json.pop("metadata")
         print("Removed metadata element")
 
     dynatrace_json.pop("enabled")
-    if "ENABLE" in args.action:
+    if "ENABLE" in action:
         dynatrace_json['enabled'] = 'true'
     else:
         dynatrace_json['enabled'] = 'false'
+    return dynatrace_json
+
+def cleanFile(json_file, action) :
+    # Open the provided file, clean it up and write the file back out with its new values
+    with open(json_file, "r") as read_file:
+        dynatrace_json = cleanPayload(json.load(read_file), action)
+
+    with open(json_file, 'w') as new_json:
+        new_json.write(json.dumps(dynatrace_json))
+    return
+
+def eventName(value) :
+    return value.get('summary') or value.get('eventTemplate', {}).get('title', '')
 
-read_file.close()
+def isSelected(item, ids, name_pattern, tag) :
+    value = item.get('value', {})
+    if ids and item.get('objectId') not in ids and value.get('legacyId') not in ids:
+        return False
+    if name_pattern and not name_pattern.search(eventName(value)):
+        return False
+    if tag:
+        key, separator, tag_value = tag.partition(':')
+        properties = value.get('eventTemplate', {}).get('metadata', [])
+        if not any(prop.get('metadataKey') == key and (not separator or prop.get('metadataValue') == tag_value) for prop in properties):
+            return False
+    return True
 
-# Now, write the file back out with its new values
-new_json = open(args.json,'w')
-new_json.write(json.dumps(dynatrace_json))
-new_json.close()
+def updateState(dynatrace, settings_url, item, enabled) :
+    # PUT the metric event back with just "enabled" changed.  Returns True when the tenant took it.
+    value = dict(item['value'], enabled=enabled)
+    try:
+        response = dynatrace.put(settings_url + "/" + item['objectId'], data=json.dumps({'value': value}))
+    except requests.exceptions.RequestException as e:
+        print("Update failed for " + eventName(item['value']) + ": " + str(e))
+        return False
+    if not response.ok:
+        print("Update failed for " + eventName(item['value']) + ", response code: " + str(response.status_code) + ", body: " + response.text)
+        return False
+    print("Updated " + eventName(item['value']) + " (" + item['objectId'] + "), enabled: " + str(enabled).lower())
+    return True
+
+def bulkUpdate(config) :
+    section_name = str(args.customer) + "_" + str(args.environment)
+    if not config.has_section(section_name):
+        print("Section " + section_name + " not found in the ini file...exiting")
+        sys.exit(1)
+    if not (args.ids or args.name or args.tag) or not args.action:
+        print("Bulk mode needs --action and --ids, --name or --tag to select the metric events...exiting")
+        sys.exit(1)
+    global requests, dynatraceClient, ThreadPoolExecutor
+    try:
+        import requests, dynatraceClient
+        from concurrent.futures import ThreadPoolExecutor
+    except ImportError as e:
+        print("Bulk mode needs requests and dynatraceClient.py from the lib directory at the root of this repository (" + str(e) + ")...exiting")
+        sys.exit(1)
+    section = config[section_name]
+    tenant_url = section['tenant_url'].rstrip('/')
+    enabled = "ENABLE" in args.action.upper()
+    ids = set(item.strip() for item in args.ids.split(',') if item.strip()) if args.ids else None
+    name_pattern = re.compile(args.name, re.IGNORECASE) if args.name else None
+
+    dynatrace = dynatraceClient.fromConfig(section)
+    try:
+        # One paginated listing with the full value of every metric event
+        selected = [item for item in dynatrace.iterSettings(tenant_url, [METRIC_EVENTS_SCHEMA], fields='objectId,value')
+                    if isSelected(item, ids, name_pattern, args.tag)]
+    except requests.exceptions.RequestException as e:
+        print("Unable to list the metric events: " + str(e))
+        dynatrace.close()
+        sys.exit(1)
+
+    changes = [item for item in selected if item['value'].get('enabled') != enabled]
+    print("Metric events selected: " + str(len(selected)) + ", already " + ("enabled" if enabled else "disabled") + ": " + str(len(selected) - len(changes)))
+
+    if args.dryRun:
+        for item in changes:
+            print("Would " + ("enable" if enabled else "disable") + ": " + eventName(item['value']) + " (" + item['objectId'] + ")")
+        dynatrace.close()
+        return 0
+
+    settings_url = tenant_url + "/api/v2/settings/objects"
+    workers = args.workers or section.getint('update_workers', DEFAULT_WORKERS)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        results = list(executor.map(lambda item: updateState(dynatrace, settings_url, item, enabled), changes))
+    dynatrace.close()
+
+    print("Metric events updated: " + str(results.count(True)) + ", failed: " + str(results.count(False)))
+    return results.count(False)
+
+# end functions
+
+# Main logic area
+
+if __name__ == '__main__':
+    # Parse arguments passed into program
+    parseArguments()
+
+    if args.iniFile:
+        config = configparser.ConfigParser()
+        config.read(args.iniFile)
+        if bulkUpdate(config):
+            sys.exit(1)
+    else:
+        cleanFile(args.json, args.action)
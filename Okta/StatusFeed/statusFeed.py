@@ -9,70 +9,306 @@
 #
 # Usage: You must supply a valid customer ID, Environment, and path to ini file
 #
-import os, sys, requests, feedparser, json, math, configparser, datetime, argparse, pprint
+# The feed is parsed while it downloads and only as far as the newest feed_max_entries entries (default
+# 5).  When feed_state_file is set in the ini file those entries are kept between runs: an unchanged
+# feed is answered with a 304, and otherwise the download stops at the first entry the last run read.
+#
+# When incident_journal_file is set in the ini file an open issue is only sent to Dynatrace when it is
+# new, its text changed, or its event is about to time out.  Issues Okta has since resolved are
+# closed out explicitly.
+#
+# One run can report to several Dynatrace environments: --sections RFD_PRD,ABC_TST (or --allSections)
+# reads and classifies the feed once and then sends the events of every section, tenant_workers
+# sections at a time.
+#
+# With self_metrics=true in the ini file the run reports its phase timings, http requests, bytes,
+# errors and cache hit rates to the local OneAgent metric ingest endpoint (see lib/selfMetrics.py).
+#
+# Output is logged as json lines (log_format=text for plain lines) at log_level INFO by default, see
+# lib/statusLog.py.  The feed entries, event payloads and response bodies are only written at DEBUG.
+#
+import os, sys, time, requests, json, math, configparser, datetime, argparse
+
+# Shared modules are kept in the lib directory at the root of this repository.  If the files were
+# copied into one directory instead they are found next to this script.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'lib'))
+import feedStream, dynatraceClient, incidentJournal, selfMetrics, tenantFanout, statusLog
 
+log = statusLog.getLogger('okta')
 
-def parseArguments() :
+
+def parseArguments(argv=None) :
     parser = argparse.ArgumentParser('Evaluate status of Okta Services')
     parser.add_argument("--customer", help="Supply a customer value")
     parser.add_argument("--environment", help="Supply something like LAB, DR, TST, or PRD")
     parser.add_argument("--iniFile", help="Supply path to ini file")
+    parser.add_argument("--sections", help="Comma separated ini sections (like RFD_PRD,ABC_TST) to report to in one run, instead of --customer/--environment")
+    parser.add_argument("--allSections", action="store_true", help="Report to every ini section that has an event_feed_url")
+    parser.add_argument("--tenantWorkers", type=int, help="Number of sections sent their events at the same time (default 4)")
+    parser.add_argument("--refreshEntities", action="store_true", help="Ignore the cached application entity ids and look them up again")
 
     global args
-    args = parser.parse_args()
-    return
+    args = parser.parse_args(argv)
+    return args
+
+def isTenantSection(section) :
+    return bool(section.get('event_feed_url') and section.get('entity_application_feed_url'))
 
-def getEntityIds() :
-    print("Retrieving Applications from Dynatrace for: " + str(args.customer) + "/" + str(args.environment) + " at "+ str(datetime.datetime.now()))
+def getEntityIds(tenant) :
+    # Resolved the first time an event is about to be sent, so a run with no open issues never calls
+    # the tenant.  A fresh lookup from the entity cache is used when there is one.
+    if tenant.entity_ids:
+        return tenant.entity_ids
+
+    lookup_url = tenant.section['entity_application_feed_url']
+    if tenant.entity_cache:
+        cached_ids = tenant.entity_cache.get(lookup_url)
+        if cached_ids is not None:
+            tenant.metrics.cache('entity', hits=1)
+            tenant.entity_ids.extend(cached_ids)
+            log.debug("Using cached application entity ids", extra=statusLog.fields(section=tenant.name, entity_ids=tenant.entity_ids))
+            return tenant.entity_ids
+        tenant.metrics.cache('entity', misses=1)
+
+    log.info("Retrieving applications from Dynatrace", extra=statusLog.fields(section=tenant.name))
 
     try:
-        print("Applications URL: " + str(config[args.customer + "_" + args.environment]['entity_application_feed_url']))
-        response = requests.get(config[args.customer + "_" + args.environment]['entity_application_feed_url'], headers=headers)
-        print("Response Code: " + str(response.status_code))
-        print("Response Body: " + response.text)
+        log.debug("Applications URL", extra=statusLog.fields(url=lookup_url))
+        with tenant.metrics.timer('entity_lookup'):
+            response = tenant.dynatrace.get(lookup_url)
+        log.debug("Applications response %s: %s", response.status_code, statusLog.lazy(lambda: response.text))
         dynatraceAppData = json.loads(response.text)
 
         if not dynatraceAppData:
-            print("Dynatrace Returned no Applications having OKTA_STATUS as a tag ...exiting")
+            log.error("Dynatrace returned no applications having OKTA_STATUS as a tag...exiting", extra=statusLog.fields(section=tenant.name))
             sys.exit(1)
 
         for i, val in enumerate(dynatraceAppData):
-            entity_ids.append(str(dynatraceAppData[i]['entityId']))
-            #print("Entity ID:" + str(dynatraceAppData[i]['entityId']))
+            tenant.entity_ids.append(str(dynatraceAppData[i]['entityId']))
 
     except requests.exceptions.RequestException as e:
-        print("Error retrieving data from Dynatrace: " + e)
-        print("Response Code: " + str(response.status_code))
+        log.error("Error retrieving data from Dynatrace: %s", e, extra=statusLog.fields(section=tenant.name))
         sys.exit(1)
 
-    return
+    if tenant.entity_cache:
+        tenant.entity_cache.put(lookup_url, tenant.entity_ids)
 
-def buildDynatraceEventPayload():
+    return tenant.entity_ids
+
+def buildDynatraceEventPayload(tenant, entry):
     payload = {}
     payload['title'] = str(entry.title)
     payload['description']  =  str("\n"+entry.summary) + '\n\n' + str(entry.link) + "\n\nThi is a message retrieved from the Okta Trust RSS Feed (http://feeds.feedburner.com/OktaTrustRSS)\n\n"
     payload['eventType'] = "AVAILABILITY_EVENT"
-    payload['timeoutMinutes'] = 10
+    payload['timeoutMinutes'] = incidentJournal.eventTimeoutMinutes(tenant.section)
     payload['source'] = 'OKTA Status Extension (from RFD)'
     # payload['annotationType'] = 'defect'
     # payload['annotationDescription'] = 'Extended Description text here....'
     payload['attachRules'] = { }
-    payload['attachRules']['entityIds'] = entity_ids
+    if tenant.section.get('event_entity_selector'):
+        # Events v2, the tenant attaches the event to whatever the selector matches so the applications
+        # are never looked up here
+        payload = dynatraceClient.toEventsV2(payload, tenant.section['event_entity_selector'])
+    else:
+        payload['attachRules']['entityIds'] = getEntityIds(tenant)
     # payload['attachRules'][1]['tagRule'] = [ { "meTypes": [ "APPLICATION" ], "tags": [ { "context": "CONTEXTLESS", "key": "PRD" } ] } ]
-    # print(payload)
-    print(json.dumps(payload))
+    log.debug("Event payload: %s", statusLog.lazyJson(payload))
     return payload
 
-def sendEvent2Dynatrace(event):
+def sendEvent2Dynatrace(tenant, event, issue=None):
+    with tenant.metrics.timer('event_send'):
+        return postEvent(tenant, event, issue)
+
+def eventUrl(tenant) :
+    # The v2 ingest url when events are attached by entity selector, next to the v1 url unless set
+    if tenant.section.get('event_entity_selector'):
+        return tenant.section.get('event_ingest_url') or tenant.section['event_feed_url'].replace('/api/v1/events', '/api/v2/events/ingest')
+    return tenant.section['event_feed_url']
+
+def postEvent(tenant, event, issue=None):
+    # issue is (issue id, content) of an open issue.  Returns whether the tenant accepted the event, or
+    # None when it was queued: spoolResult() then handles the answer once the event is delivered.
+    if tenant.event_spool:
+      # Written to the outbox on disk and delivered at the end of the run
+      tenant.event_spool.enqueue(eventUrl(tenant), event, key=[tenant.journal_source, issue[0]] if issue else None,
+                                 context=issue[1] if issue else None)
+      return None
+
+    try:
+      response = tenant.dynatrace.post(eventUrl(tenant), data=json.dumps(event))
+      log.info("Sent event to Dynatrace", extra=statusLog.fields(section=tenant.name, title=event.get('title'), status_code=response.status_code))
+      log.debug("Event response body: %s", statusLog.lazy(lambda: response.text))
+      if response.status_code == 400 and tenant.entity_cache:
+          # Most likely one of the cached applications no longer exists, look them up again next run
+          tenant.entity_cache.invalidate(tenant.section['entity_application_feed_url'])
+    except requests.exceptions.RequestException as e:
+      log.error("Error sending event to Dynatrace: %s", e, extra=statusLog.fields(section=tenant.name, title=event.get('title')))
+      return False
+
+    return response.ok
+
+def spoolResult(tenant, key, content, payload, status) :
+    # The tenant's final answer to a spooled event, handled the way postEvent() handles a direct send
+    if status == 400 and tenant.entity_cache:
+        # Most likely one of the cached applications no longer exists, look them up again next run
+        tenant.entity_cache.invalidate(tenant.section['entity_application_feed_url'])
+    if key is None or not 200 <= status < 300:
+        return
+    tenant.counts['sent'] +=1
+    if tenant.journal:
+        tenant.journal.markSent(key[0], key[1], content, payload)
+    return
+
+def closeResolvedIssues(tenant, open_issue_ids) :
+    # Issues that were open on an earlier run and are no longer open in the feed
+    for issue in tenant.journal.resolve(tenant.journal_source, open_issue_ids):
+        log.info("Closing resolved issue", extra=statusLog.fields(section=tenant.name, title=issue['payload'].get('title')))
+        sendEvent2Dynatrace(tenant, incidentJournal.closingPayload(issue, "RESOLVED - Okta no longer reports this issue as open."))
+        tenant.counts['closed'] +=1
+    tenant.journal.save()
+    return
+
+def notifyTenant(tenant) :
+    # Send the open issues found in the feed to one section's tenant.  Runs next to the other sections
+    # on worker threads, so only the tenant and the (by now read only) open issues are used.
+    for issue_id, entry in open_issues:
+        issue_content = [entry.title, entry.summary]
+        if tenant.journal and not tenant.journal.check(tenant.journal_source, issue_id, issue_content):
+            log.info("Already reported and not due for a refresh yet", extra=statusLog.fields(section=tenant.name, title=entry.title))
+            tenant.counts['skipped'] +=1
+            continue
+
+        payload = buildDynatraceEventPayload(tenant, entry)
+
+        # Send event to Dynatrace
+        if sendEvent2Dynatrace(tenant, payload, (issue_id, issue_content)):
+            tenant.counts['sent'] +=1
+            if tenant.journal:
+                tenant.journal.markSent(tenant.journal_source, issue_id, issue_content, payload)
+
+    if tenant.journal:
+        closeResolvedIssues(tenant, [issue_id for issue_id, entry in open_issues])
+
+    if tenant.event_spool:
+        with tenant.metrics.timer('event_delivery'):
+            tenant.event_spool.deliver(tenant.dynatrace, onResult=lambda key, content, payload, status: spoolResult(tenant, key, content, payload, status))
+        if tenant.journal:
+            # The issues delivered just now were only recorded as sent by spoolResult()
+            tenant.journal.save()
+
+    if tenant.section.get('status_metrics_url'):
+        # 0 while Okta reports no open disruption or degradation, 1 while it does
+        prefix = tenant.section.get('self_metrics_prefix', selfMetrics.DEFAULT_PREFIX)
+        lines = [selfMetrics.metricLine(prefix + ".service.status", [('provider', 'okta'), ('service', 'okta')], 1 if open_issues else 0),
+                 selfMetrics.metricLine(prefix + ".service.open_issues", [('provider', 'okta'), ('service', 'okta')], len(open_issues))]
+        with tenant.metrics.timer('status_metrics'):
+            selfMetrics.postLines(tenant.dynatrace, tenant.section['status_metrics_url'], lines, label="Service status metrics")
+
+    tenant.metrics.gauge('issues.open', len(open_issues))
+    return
+
+def runStatusCheck(run_config, tenant_pool=None) :
+    # One complete pass over the Okta feed for the ini sections selected in args.  Called once by the
+    # main logic below, or on every cycle by the status daemon which keeps the process running.
+    # The daemon passes a tenantFanout.TenantPool so the tenants are reused from one cycle to the next.
+    global config, metrics, open_issues
+
+    config = run_config
+    run_started = time.monotonic()
+
+    # Every selected section is a tenant with its own pooled Dynatrace client, entity ids, journal and
+    # spool.  The feed settings come from the first section.
+    try:
+        section_names = tenantFanout.selectSections(config, args, isTenantSection)
+    except ValueError as e:
+        log.error("%s...exiting", e)
+        sys.exit(1)
+    statusLog.fromConfig(config[section_names[0]])
+    tenants = tenantFanout.openTenants(config, section_names, 'okta', 'OKTA', pool=tenant_pool)
+    source = tenants[0].section
+
+    # Timings, request counts and cache hit rates of this run, only sent when self_metrics is set.  With
+    # several sections the feed work is shared, so it is reported once for all of them.
+    if len(tenants) == 1:
+        metrics = tenants[0].metrics
+    else:
+        metrics = selfMetrics.fromConfig(source, 'okta', customer='all', environment='all')
+
+    # Application Entity ID's (tag "OKTA_STATUS") are only retrieved from Dynatrace, or the entity cache,
+    # once an event needs to be sent
+    for tenant in tenants:
+        if tenant.entity_cache and args.refreshEntities:
+            tenant.entity_cache.invalidate(tenant.section['entity_application_feed_url'])
+
+    # The feed keeps around a 2 year history, only the newest entries are downloaded and parsed
+    feed_reader = feedStream.fromConfig(source)
+    feed_session = metrics.watch(requests.Session(), 'okta_status')
+
+    # However the run ends (an exit included) the connections are closed and the self monitoring sent,
+    # the status daemon runs the next cycle in this same process
     try:
-      response = requests.post(config[args.customer + "_" + args.environment]['event_feed_url'], data=json.dumps(event), headers=headers)
-      print("Succesfully sent data to Dynatrace, response code: " + str(response.status_code))
-      print("Response Body: " + str(response.text))
-    except:
-      e = sys.exc_info()[0]
-      print("Error sending data to Dynatrace: " + str(e))
-      print("Response Code: " + str(response.status_code))
+        log.debug("OKTA RSS Feed", extra=statusLog.fields(feed=config['OKTA']['rss_feed']))
+        try:
+            with metrics.timer('feed_fetch'):
+                entries = feed_reader.fetch(str(config['OKTA']['rss_feed']), timeout=source.getfloat('feed_timeout', feedStream.DEFAULT_TIMEOUT), session=feed_session)
+        except requests.exceptions.RequestException as e:
+            log.error("Error retrieving the Okta feed: %s", e)
+            if e.response is None:
+                metrics.error('okta_status', e)
+            return
+        feed_reader.save()
+        feed_session.close()
+        log.info("Feed read", extra=statusLog.fields(entries_parsed=feed_reader.entries_read, entries_reused=feed_reader.entries_reused,
+                                                     not_modified=feed_reader.not_modified))
+        metrics.cache('feed', hits=feed_reader.not_modified, misses=1 - feed_reader.not_modified)
+        metrics.cache('feed_entries', hits=feed_reader.entries_reused, misses=feed_reader.entries_read)
 
+        #service_name=NewsFeed.feed.subtitle.replace(' Service Status', '')
+        service_name="Okta Status"
+        #if len(NewsFeed.entries) >= 1:
+        resolvedIssueCnt = 0
+        openIssueCnt = 0
+        otherCnt = 0
+        open_issues = []
+
+        entry = None
+        for entry in entries:
+            #entryTitle=entry.title
+            #link=entry.title_detail.link
+            log.debug("Feed entry", extra=statusLog.fields(service=service_name, title=entry.title, link=entry.link,
+                                                           summary=entry.summary, updated=entry.updated))
+            # Finding either of these strings means AWS sees no issues with their services
+            with metrics.timer('classification'):
+                title_text = entry.title.lower()
+                is_issue = "degradation" in title_text or "disruption" in title_text
+                is_resolved = "resolve" in title_text
+            if is_issue:
+                if is_resolved:
+                    log.debug("Issue is resolved", extra=statusLog.fields(title=entry.title))
+                    resolvedIssueCnt +=1
+                else:
+                    log.warning("Open issue", extra=statusLog.fields(service=service_name, title=entry.title, link=entry.link))
+                    openIssueCnt +=1
+                    open_issues.append((entry.get('id', entry.link), entry))
+            else:
+                otherCnt +=1
+
+        # Then the events, sent to each section's own tenant
+        failed = tenantFanout.dispatch(tenants, notifyTenant, workers=tenantFanout.workersFromConfig(source, args.tenantWorkers))
+
+        log.info("Summary", extra=statusLog.fields(items_checked=len(entries), oldest=entry.updated if entry else None,
+                                                   open_issues=openIssueCnt, resolved_issues=resolvedIssueCnt, other=otherCnt))
+        for tenant in tenants:
+            log.info("Section summary", extra=statusLog.fields(section=tenant.name, sent=tenant.counts['sent'],
+                                                               skipped=tenant.counts['skipped'], closed=tenant.counts['closed']))
+        if failed:
+            log.error("Sections that could not be reported to", extra=statusLog.fields(sections=failed))
+        log.info("Complete")
+
+        metrics.observe('phase.duration', (time.monotonic() - run_started) * 1000.0, phase='run')
+    finally:
+        feed_session.close()
+        tenantFanout.close(tenants, metrics, pool=tenant_pool)
     return
 ###
 ### End function area
@@ -82,83 +318,13 @@ def sendEvent2Dynatrace(event):
 ### Main logic
 ##############
 
-# create summary variables
-servicesChecked = 0
-serviceRegionCheck = 0
-serviceNormal = 0
-serviceNotNormal = 0
-serviceNoStatus = 0
-
-# Other values declared
-entity_ids = []
-
-# Parse arguments passed into program
-parseArguments()
-
-# Load configuration file supplied
-config = configparser.ConfigParser()
-config.read(args.iniFile)
-config.sections()
-
-token = "Api-Token " + config[args.customer + "_" + args.environment]['api_token']
-headers = {'Accept': 'application/json','Content-Type': 'application/json', 'Authorization': token}
-
-# Retrieve Application Entity ID's from Dynatrace
-# looking specifically for entities with tag "OKTA_STATUS"
-getEntityIds()
-print("Entity Ids: " + str(entity_ids))
-
-NewsFeed = feedparser.parse(str(config['OKTA']['rss_feed']))
-# print("NewsFeed:" + str(NewsFeed))
-print("OKTA RSS Feed: " + str(config['OKTA']['rss_feed'])+'\n')
-
-#service_name=NewsFeed.feed.subtitle.replace(' Service Status', '')
-service_name="Okta Status"
-print("Service Name: " + service_name)
-# print('Number of RSS posts :', len(NewsFeed.entries))
-print("First entry\n" + str(json.dumps(NewsFeed.entries[0],indent=4)))
-#if len(NewsFeed.entries) >= 1:
-resolvedIssueCnt = 0
-openIssueCnt = 0
-otherCnt = 0
-
-for x in range(len(NewsFeed.entries)):
-
-    # Break out after certain amount.  They keep around a 2 year history.
-    if x > 4:
-        break
-
-    entry = NewsFeed.entries[x]
-    #print("First NewsFeed entry: " + str(entry))
-    #entryTitle=entry.title
-    #link=entry.title_detail.link
-    #print("Link to issue: " + link)
-    print("Title: " + entry.title)
-    print("Link: " + str(entry.link))
-    print("Summary: " + str(entry.summary))
-    print("Updated: " + str(entry.updated))
-    # Finding either of these strings means AWS sees no issues with their services
-    if "degradation" in entry.title.lower() or "disruption" in entry.title.lower():
-        if "resolve" in entry.title.lower():
-            print("Issue is resolved...\n")
-            resolvedIssueCnt +=1
-        else:
-            print("Open issue....\n")
-            payload = buildDynatraceEventPayload()
-
-            # Send event to Dynatrace
-            sendEvent2Dynatrace(payload)
-            openIssueCnt +=1
+if __name__ == '__main__':
+    # Parse arguments passed into program
+    parseArguments()
 
-    else:
-        otherCnt +=1
-
-print("")
-print("##### Summary #####")
-print("Feed Content Items Checked: " + str(x))
-print("Going back as far as: " + str(entry.updated))
-print("Open Issues: " + str(openIssueCnt))
-print("Resolved Issues: " + str(resolvedIssueCnt))
-print("Count of non Disruption/Degradation: " + str(otherCnt))
-print("")
-print("Complete")
+    # Load configuration file supplied
+    config = configparser.ConfigParser()
+    config.read(args.iniFile)
+    config.sections()
+
+    runStatusCheck(config)
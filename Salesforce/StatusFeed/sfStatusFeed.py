@@ -12,56 +12,108 @@
 #
 # Usage: You must supply a valid customer ID, Environment, and path to ini file
 #
-import os, sys, requests, json, math, configparser, datetime, argparse, pprint
+# When incident_journal_file is set in the ini file an incident is only sent to Dynatrace when it is
+# new, its details changed, or its event is about to time out.  Incidents Salesforce no longer lists
+# as active are closed out explicitly.
+#
+# Incident details are fetched concurrently (incident_detail_workers at a time).  When
+# incident_detail_cache_file is set a detail is only fetched again once Salesforce updates the incident.
+#
+# One run can report to several Dynatrace environments: --sections RFD_PRD,ABC_TST (or --allSections)
+# reads the active incidents and their details once, matches them against the sf_instances of each
+# section and sends the events of every section, tenant_workers sections at a time.
+#
+# With self_metrics=true in the ini file the run reports its phase timings, http requests, bytes,
+# errors and cache hit rates to the local OneAgent metric ingest endpoint (see lib/selfMetrics.py).
+#
+# Output is logged as json lines (log_format=text for plain lines) at log_level INFO by default, see
+# lib/statusLog.py.  The incidents, event payloads and response bodies are only written at DEBUG.
+#
+import os, sys, time, requests, json, math, configparser, datetime, argparse
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+
+# Shared modules are kept in the lib directory at the root of this repository.  If the files were
+# copied into one directory instead they are found next to this script.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'lib'))
+import dynatraceClient, incidentJournal, jsonStore, selfMetrics, tenantFanout, statusLog
+
+log = statusLog.getLogger('salesforce')
 
 ####
 #### Subroutine area
 ####
 
 # Parse incoming arguments to python script
-def parseArguments() :
+def parseArguments(argv=None) :
     parser = argparse.ArgumentParser('Evaluate status of AWS Services')
     parser.add_argument("--customer", help="Supply a customer acronym, like RFD")
     parser.add_argument("--environment", help="Supply either LAB, DR, TST, or PRD for example.")
     parser.add_argument("--iniFile", help="Supply path to ini file that contains necessary environment links")
+    parser.add_argument("--sections", help="Comma separated ini sections (like RFD_PRD,ABC_TST) to report to in one run, instead of --customer/--environment")
+    parser.add_argument("--allSections", action="store_true", help="Report to every ini section that has a tenant_url and sf_instances")
+    parser.add_argument("--tenantWorkers", type=int, help="Number of sections sent their events at the same time (default 4)")
+    parser.add_argument("--refreshEntities", action="store_true", help="Ignore the cached Salesforce custom device id and look it up again")
 
     global args
-    args = parser.parse_args()
-    return
+    args = parser.parse_args(argv)
+    return args
+
+def isTenantSection(section) :
+    return bool(section.get('tenant_url') and section.get('sf_instances'))
+
+# The tenant the custom device lives on identifies it in the entity cache
+def entityCacheKey(tenant) :
+    return tenant.section['tenant_url'] + " SALESFORCE_CUSTOM_DEVICE"
+
+def getEntityIds(tenant) :
+    # Resolved the first time an event is about to be sent, so a run with no matching incidents never
+    # calls the tenant.  A fresh lookup from the entity cache is used when there is one.
+    if tenant.entity_ids:
+        return tenant.entity_ids
+
+    if tenant.entity_cache:
+        cached_ids = tenant.entity_cache.get(entityCacheKey(tenant))
+        if cached_ids is not None:
+            tenant.metrics.cache('entity', hits=1)
+            tenant.entity_ids.extend(cached_ids)
+            log.debug("Using cached Salesforce custom device id", extra=statusLog.fields(section=tenant.name, entity_ids=tenant.entity_ids))
+            return tenant.entity_ids
+        tenant.metrics.cache('entity', misses=1)
 
-def getEntityIds() :
-    print("Retrieving Salesforce Custom Device from Dynatrace for: " + str(args.customer) + "/" + str(args.environment) + " at "+ str(datetime.datetime.now()))
+    log.info("Retrieving Salesforce custom device from Dynatrace", extra=statusLog.fields(section=tenant.name))
 
     try:
         # response = requests.get(config[args.customer + "_" + args.environment]['monitored_entities_url'], headers=headers)
-        response = requests.get(config[args.customer + "_" + args.environment]['tenant_url']+"/api/v2/entities?pageSize=25&entitySelector=type(\"CUSTOM_DEVICE\")&from=now-7d&to=now", headers=headers)
-        dynatraceDeviceData = json.loads(response.text)
+        # The tenant matches the name for us and every page is followed, so the device is found however
+        # many custom devices the tenant has
         found = False
-        entities = dynatraceDeviceData['entities']
-        for entity in entities:
-            if "salesforce" in str(entity['displayName']).lower():
+        with tenant.metrics.timer('entity_lookup'):
+            for entity in tenant.dynatrace.iterEntities(tenant.section['tenant_url'],
+                                                        'type("CUSTOM_DEVICE"),entityName.contains("salesforce")', time_from='now-7d'):
                 found = True
-                entity_ids.append(entity['entityId'])
+                tenant.entity_ids.append(entity['entityId'])
                 break
 
 
         # If we didn't find the salesforce custom device, then let's create it.
         if found:
-            print("Display Name: " + str(entity['displayName']))
-            print("Entity Id: " + str(entity_ids))
+            log.info("Found Salesforce custom device", extra=statusLog.fields(section=tenant.name, display_name=entity['displayName'],
+                                                                              entity_ids=tenant.entity_ids))
         else:
-            createCustomDevice()
+            createCustomDevice(tenant)
 
     except requests.exceptions.RequestException as e:
-        print("Error retrieving custom device data from Dynatrace: " + e)
-        print("Response Code: " + str(response.status_code))
-        quit()
+        log.error("Error retrieving custom device data from Dynatrace: %s", e, extra=statusLog.fields(section=tenant.name))
+        sys.exit()
 
-    return
+    if tenant.entity_cache and tenant.entity_ids:
+        tenant.entity_cache.put(entityCacheKey(tenant), tenant.entity_ids)
+
+    return tenant.entity_ids
 
-def createCustomDevice() :
-    print("Creating Salesforce Custom Device in Dynatrace: " + str(args.customer) + "/" + str(args.environment) + " at "+ str(datetime.datetime.now()))
-    global entityId
+def createCustomDevice(tenant) :
+    log.info("Creating Salesforce custom device in Dynatrace", extra=statusLog.fields(section=tenant.name))
 
     # Build json payload for custom device
     payload = {}
@@ -77,75 +129,107 @@ def createCustomDevice() :
     payload['dnsNames'] = [ "trust.salesforce.com" ]
 
     try:
-        response = requests.post(config[args.customer + "_" + args.environment]['tenant_url']+"/api/v2/entities/custom", data=json.dumps(payload), headers=headers)
-        # print("Response Code: " + str(response.status_code))
-        # print("Response Body: " + response.text)
+        response = tenant.dynatrace.post(tenant.section['tenant_url']+"/api/v2/entities/custom", data=json.dumps(payload),
+                                         retry_post=True)
+        log.debug("Custom device response %s: %s", response.status_code, statusLog.lazy(lambda: response.text))
         dynatraceDeviceData = json.loads(response.text)
 
         if response.status_code == 201:
             entityId = dynatraceDeviceData['entityId']
             groupId = dynatraceDeviceData['groupId']
+            tenant.entity_ids.append(entityId)
         else:
-            print("Failed to add device...")
+            log.error("Failed to add device", extra=statusLog.fields(section=tenant.name, status_code=response.status_code))
 
     except requests.exceptions.RequestException as e:
-        print("Error creating device in Dynatrace: " + e)
-        print("Response Code: " + str(response.status_code))
-        quit()
+        log.error("Error creating device in Dynatrace: %s", e, extra=statusLog.fields(section=tenant.name))
+        sys.exit()
 
     return
 
-def buildDynatraceEventPayload(incident):
-
-    # create a concatenated string list of impacted instances for this incident
-    impacted_instances = ''
-    for x in range(len(sfIncidentDetail['instanceKeys'])):
-        if not impacted_instances:
-            impacted_instances=sfIncidentDetail['instanceKeys'][x]
-        else:
-            impacted_instances=impacted_instances + ", " + sfIncidentDetail['instanceKeys'][x]
-
-    print("Impacted Instances: " + str(impacted_instances))
-    # create a concatenated string list of impacted services for this incident
-    impacted_services = ''
-    for x in range(len(sfIncidentDetail['serviceKeys'])):
-        if not impacted_services:
-            impacted_services=sfIncidentDetail['serviceKeys'][x]
-        else:
-            impacted_services=impacted_services + ", " + sfIncidentDetail['serviceKeys'][x]
-    print("Impacted Services: " + str(impacted_services))
+def buildDynatraceEventPayload(tenant, incident, detail):
 
-    pp.pprint(incident)
+    # create a concatenated string list of impacted instances and services for this incident
+    impacted_instances = ", ".join(detail['instanceKeys'])
+    impacted_services = ", ".join(detail['serviceKeys'])
+    log.debug("Incident: %s", statusLog.lazyJson(incident), extra=statusLog.fields(instances=detail['instanceKeys'], services=detail['serviceKeys']))
 
     payload = {}
-    payload['title'] = label
-    payload['description']  = description + "\n\nImpacted Services: " + impacted_services + "\nImpacted Instances: " + impacted_instances + "\n\nhttps://status.salesforce.com/"
+    payload['title'] = detail['label']
+    payload['description']  = detail['description'] + "\n\nImpacted Services: " + impacted_services + "\nImpacted Instances: " + impacted_instances + "\n\nhttps://status.salesforce.com/"
     payload['eventType'] = "AVAILABILITY_EVENT"
-    payload['timeoutMinutes'] = 10
+    payload['timeoutMinutes'] = incidentJournal.eventTimeoutMinutes(tenant.section)
     payload['source'] = 'Salesforce Status Extension (from RFD)'
     payload['attachRules'] = { }
-    payload['attachRules']['entityIds'] = entity_ids
-    print("Payload sending to Dynatrace\n\n"+json.dumps(payload, indent=4))
+    if tenant.section.get('event_entity_selector'):
+        # Events v2, the tenant attaches the event to whatever the selector matches so the custom device
+        # is never looked up (or created) here
+        payload = dynatraceClient.toEventsV2(payload, tenant.section['event_entity_selector'])
+    else:
+        payload['attachRules']['entityIds'] = getEntityIds(tenant)
+    log.debug("Event payload: %s", statusLog.lazyJson(payload))
     return payload
 
-def sendEvent2Dynatrace(event):
+def sendEvent2Dynatrace(tenant, event, issue=None):
+    with tenant.metrics.timer('event_send'):
+        return postEvent(tenant, event, issue)
+
+def eventUrl(tenant) :
+    if tenant.section.get('event_entity_selector'):
+        return tenant.section['tenant_url']+"/api/v2/events/ingest"
+    return tenant.section['tenant_url']+"/api/v1/events"
+
+def postEvent(tenant, event, issue=None):
+    # issue is (issue id, content) of an open issue.  Returns whether the tenant accepted the event, or
+    # None when it was queued: spoolResult() then handles the answer once the event is delivered.
+    if tenant.event_spool:
+      # Written to the outbox on disk and delivered at the end of the run
+      tenant.event_spool.enqueue(eventUrl(tenant), event, key=[tenant.journal_source, issue[0]] if issue else None,
+                                 context=issue[1] if issue else None)
+      return None
+
     try:
       # response = requests.post(config[args.customer + "_" + args.environment]['event_feed_url'], data=json.dumps(event), headers=headers)
-      response = requests.post(config[args.customer + "_" + args.environment]['tenant_url']+"/api/v1/events", data=json.dumps(event), headers=headers)
-      print("Succesfully sent data to Dynatrace, response code: " + str(response.status_code))
-      print("Response Body: " + str(response.text))
-    except:
-      e = sys.exc_info()[0]
-      print("Error sending data to Dynatrace: " + str(e))
-      print("Response Code: " + str(response.status_code))
+      response = tenant.dynatrace.post(eventUrl(tenant), data=json.dumps(event))
+      log.info("Sent event to Dynatrace", extra=statusLog.fields(section=tenant.name, title=event.get('title'), status_code=response.status_code))
+      log.debug("Event response body: %s", statusLog.lazy(lambda: response.text))
+      if response.status_code == 400 and tenant.entity_cache:
+          # Most likely the cached custom device no longer exists, look it up again next run
+          tenant.entity_cache.invalidate(entityCacheKey(tenant))
+    except requests.exceptions.RequestException as e:
+      log.error("Error sending event to Dynatrace: %s", e, extra=statusLog.fields(section=tenant.name, title=event.get('title')))
+      return False
+
+    return response.ok
+
+def spoolResult(tenant, key, content, payload, status) :
+    # The tenant's final answer to a spooled event, handled the way postEvent() handles a direct send
+    if status == 400 and tenant.entity_cache:
+        # Most likely the cached custom device no longer exists, look it up again next run
+        tenant.entity_cache.invalidate(entityCacheKey(tenant))
+    if key is None or not 200 <= status < 300:
+        return
+    tenant.counts['sent'] +=1
+    if tenant.journal:
+        tenant.journal.markSent(key[0], key[1], content, payload)
+    return
 
+# Incidents that were open on an earlier run and are no longer active for any of our instances
+def closeResolvedIssues(tenant, open_incident_ids) :
+    for issue in tenant.journal.resolve(tenant.journal_source, open_incident_ids):
+        log.info("Closing resolved incident", extra=statusLog.fields(section=tenant.name, incident=issue['issueId']))
+        sendEvent2Dynatrace(tenant, incidentJournal.closingPayload(issue, "RESOLVED - Salesforce no longer lists this incident as active."))
+        tenant.counts['closed'] +=1
+    tenant.journal.save()
     return
 
-# Routine to build a python list object out of SF instances listed in a text file.
-def loadSFInstances():
-    global sf_instances
-    sf_instances = []
-    sf_instances = str(config[args.customer + "_" + args.environment]['sf_instances']).split(',')
+# Routine to build a python set object out of SF instances listed in the ini file.  A set so every
+# incident is matched against our instances with one lookup per reported instance.
+def loadSFInstances(tenant):
+    sf_instances = set()
+    for instance_name in str(tenant.section['sf_instances']).split(','):
+        if instance_name.strip():
+            sf_instances.add(instance_name.strip())
     # with open(config[args.customer + "_" + args.environment]['instance_file']) as instance_list:
     #    idx=0
     #    for x, instance_name in enumerate(instance_list):
@@ -155,97 +239,189 @@ def loadSFInstances():
     #        else:
     #            sf_instances.append(instance_name.replace('\n',''))
 
-    print("Loaded Instances: " + str(sf_instances))
+    log.info("Loaded instances", extra=statusLog.fields(section=tenant.name, instances=sorted(sf_instances)))
+    return sf_instances
 
-    if len(sf_instances) == 0:
-        print("No Salesforce instances loaded from file....exiting.")
-        quit()
-
-    return
+# Salesforce bumps updatedAt whenever an incident changes, so a detail fetched for the same id and
+# updatedAt is still current.  Incidents without updatedAt are never served from the cache.
+def detailCacheKey(incident) :
+    if not incident.get('updatedAt'):
+        return None
+    return str(incident['id']) + "|" + str(incident['updatedAt'])
 
 def retrieveActiveIncidents() :
-    print("Retrieving Active Incidents from Salesforce at: "+ str(datetime.datetime.now()))
+    log.info("Retrieving active incidents from Salesforce")
 
     try:
-        response = requests.get(config['SALESFORCE']['active_incident_feed'], headers=headers)
-        global sfActiveIncidentData
-        sfActiveIncidentData = json.loads(response.text)
-        ###################################################
-        # Temporarily assign test data
-        # sfActiveIncidentData = test_active_events
-        ###################################################
-
-        if not sfActiveIncidentData:
-            print("Salesforce returned no active incidents...exiting")
-            quit()
+        with metrics.timer('feed_fetch'):
+            response = sf_session.get(config['SALESFORCE']['active_incident_feed'], timeout=sf_timeout)
+            response.raise_for_status()
+            sfActiveIncidentData = json.loads(response.text)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        log.error("Error retrieving active incident data from Salesforce: %s", e)
+        if isinstance(e, requests.exceptions.RequestException) and e.response is None:
+            metrics.error('salesforce_status', e)
+        sys.exit()
+
+    ###################################################
+    # Temporarily assign test data
+    # sfActiveIncidentData = test_active_events
+    ###################################################
+
+    if not sfActiveIncidentData:
+        log.info("Salesforce returned no active incidents")
+        sfActiveIncidentData = []
+
+    return sfActiveIncidentData
+
+def matchIncidents(active_incidents, instances) :
+    # Checking here if any instances in our defined instance list is within the reported instance keys
+    # list returned, once per section
+    matching = {}
+    with metrics.timer('classification'):
+        for incident in active_incidents:
+            found = False
+            for tenant_name, sf_instances in instances.items():
+                if sf_instances.isdisjoint(incident.get('instanceKeys') or []):
+                    continue
+                log.warning("Incident impacts one of the instances", extra=statusLog.fields(section=tenant_name, incident=incident['id']))
+                matching.setdefault(tenant_name, []).append(incident)
+                found = True
+            if not found:
+                log.debug("None of our instances are impacted by the incident", extra=statusLog.fields(incident=incident['id']))
+    return matching
+
+def retrieveIncidentDetails(incidents) :
+    # Details of the matching incidents, from the cache when the incident hasn't been updated since,
+    # the rest fetched from Salesforce concurrently.  Every incident is fetched once however many
+    # sections it matched.
+    details = {}
+    to_fetch = []
+    for incident in incidents:
+        key = detailCacheKey(incident)
+        if key and key in detail_cache:
+            details[incident['id']] = detail_cache[key]
         else:
-            for incident in sfActiveIncidentData:
-                print("incident id: " + str(incident['id']))
-                # Checking here if any instances in our defined instance list is within the reported instance keys list returned
-                if any(x in sf_instances for x in incident['instanceKeys']):
-                    print("Found one of our instances in the reported incident...")
-                    retrieveIncidentDetail(incident['id'])
-                    # Let's send an event to Dynatrace
-                    payload = buildDynatraceEventPayload(incident)
-                    sendEvent2Dynatrace(payload)
-                else:
-                    print("None of our instances found in the list of returned from open incident...")
-
-    except requests.exceptions.RequestException as e:
-        print("Error retrieving active incident data from Salesforce: " + e)
-        print("Response Code: " + str(response.status_code))
-        quit()
+            to_fetch.append(incident)
+    log.info("Incident details", extra=statusLog.fields(cached=len(details), fetching=len(to_fetch)))
+    if detail_cache_file:
+        metrics.cache('incident_detail', hits=len(details), misses=len(to_fetch))
+
+    with ThreadPoolExecutor(max_workers=detail_workers) as executor:
+        for incident, detail in zip(to_fetch, executor.map(lambda incident: retrieveIncidentDetail(incident['id']), to_fetch)):
+            if detail is None:
+                continue
+            details[incident['id']] = detail
+
+    if detail_cache_file:
+        # Only the incidents that are still active are kept
+        fresh_cache = {}
+        for incident in incidents:
+            if detailCacheKey(incident) and incident['id'] in details:
+                fresh_cache[detailCacheKey(incident)] = details[incident['id']]
+        jsonStore.save(detail_cache_file, fresh_cache)
+
+    return details
+
+def notifyTenant(tenant) :
+    # Send the incidents that matched this section's instances to its tenant.  Runs next to the other
+    # sections on worker threads, so only the tenant and the (by now read only) details are used.
+    open_incident_ids = []
+    for incident in tenant_incidents.get(tenant.name, []):
+        # Incidents we couldn't read the detail of stay open, the next run tries them again
+        open_incident_ids.append(incident['id'])
+        detail = incident_details.get(incident['id'])
+        if detail is None:
+            continue
+
+        tenant.counts['impacts'] += detail['impactCount']
+        incident_content = [detail['label'], detail['description'], detail['instanceKeys'], detail['serviceKeys']]
+        if tenant.journal and not tenant.journal.check(tenant.journal_source, incident['id'], incident_content):
+            log.info("Already reported and not due for a refresh yet", extra=statusLog.fields(section=tenant.name, incident=incident['id']))
+            tenant.counts['skipped'] +=1
+            continue
+
+        # Let's send an event to Dynatrace
+        payload = buildDynatraceEventPayload(tenant, incident, detail)
+        if sendEvent2Dynatrace(tenant, payload, (incident['id'], incident_content)):
+            tenant.counts['sent'] +=1
+            if tenant.journal:
+                tenant.journal.markSent(tenant.journal_source, incident['id'], incident_content, payload)
+
+    if tenant.journal:
+        closeResolvedIssues(tenant, open_incident_ids)
+
+    if tenant.event_spool:
+        with tenant.metrics.timer('event_delivery'):
+            tenant.event_spool.deliver(tenant.dynatrace, onResult=lambda key, content, payload, status: spoolResult(tenant, key, content, payload, status))
+        if tenant.journal:
+            # The issues delivered just now were only recorded as sent by spoolResult()
+            tenant.journal.save()
+
+    if tenant.section.get('status_metrics_url'):
+        sendInstanceStatus(tenant)
+
+    tenant.metrics.gauge('impacts', tenant.counts['impacts'])
+    return
 
+def sendInstanceStatus(tenant) :
+    # A 0 (no active incident) / 1 (listed on an active incident) gauge for every instance in this
+    # section's sf_instances, all of them in one metric ingest request
+    key = tenant.section.get('self_metrics_prefix', selfMetrics.DEFAULT_PREFIX) + ".service.status"
+    impacted = set()
+    for incident in tenant_incidents.get(tenant.name, []):
+        impacted.update(incident.get('instanceKeys') or [])
+
+    lines = [selfMetrics.metricLine(key, [('provider', 'salesforce'), ('instance', instance)], 1 if instance in impacted else 0)
+             for instance in sorted(instances[tenant.name])]
+    with tenant.metrics.timer('status_metrics'):
+        selfMetrics.postLines(tenant.dynatrace, tenant.section['status_metrics_url'], lines, label="Instance status metrics")
     return
 
+# Returns the parts of the incident detail the event is built from, or None when Salesforce could not
+# be reached.  Called from several worker threads at once so it only touches its own variables.
 def retrieveIncidentDetail(id) :
 
-    print("Retrieving Incident details from Salesforce for at: "+ str(datetime.datetime.now()))
+    log.debug("Retrieving incident details from Salesforce", extra=statusLog.fields(incident=id))
 
     try:
         detail_feed = str(config['SALESFORCE']['incident_detail_feed']).replace('_INCIDENT_NUMBER_',str(id))
 
-        response = requests.get(detail_feed, headers=headers)
-        global sfIncidentDetail
-        sfIncidentDetail = json.loads(response.text)
-
-        ###################################################
-        # Temporarily assign test data
-        # sfIncidentDetail = test_active_event_detail
-        ###################################################
-        # pp.pprint(sfIncidentDetail)
-        global description
-        description = ''
-        if not sfIncidentDetail:
-            print("Salesforce returned no incident details...exiting")
-            quit()
+        with metrics.timer('incident_detail_fetch'):
+            response = sf_session.get(detail_feed, timeout=sf_timeout)
+            response.raise_for_status()
+            sfIncidentDetail = json.loads(response.text)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        log.error("Error retrieving incident detail from Salesforce: %s", e, extra=statusLog.fields(incident=id))
+        if isinstance(e, requests.exceptions.RequestException) and e.response is None:
+            metrics.error('salesforce_status', e)
+        return None
+
+    ###################################################
+    # Temporarily assign test data
+    # sfIncidentDetail = test_active_event_detail
+    ###################################################
+    if not sfIncidentDetail or not sfIncidentDetail.get('IncidentImpacts'):
+        log.warning("Salesforce returned no incident details", extra=statusLog.fields(incident=id))
+        return None
+
+    description = ''
+    for item in sfIncidentDetail['IncidentImpacts']:
+        if description:
+            description = description + "\n\n" + "( " + str(item.get('label')) + ") : " + str(item.get('text'))
         else:
-            print("\n\nRight before incidentimpacts loop" + str(type(sfIncidentDetail['IncidentImpacts'])))
-            for item in sfIncidentDetail['IncidentImpacts']:
-                pp.pprint(item)
-                print("What type is item: " + str(type(item)))
-                print("Item: " + str(item.get('text')))
-
-                if description:
-                    description = description + "\n\n" + "( " + str(item.get('label')) + ") : " + str(item.get('text'))
-                else:
-                    description = str(item.get('text'))
-            global impact_cnt
-            impact_cnt=impact_cnt + len(sfIncidentDetail['IncidentImpacts'])
-            print("Impact Cnt: " + str(impact_cnt))
-            description = description.replace("'","\'")
-            print("Right after incidentimpacts loop\n\n" + description + "\n\n")
-            # Grabbing the label from the first entry
-            global label
-            label = sfIncidentDetail['IncidentImpacts'][0].get('label')
-            print("Label: " + label)
+            description = str(item.get('text'))
+    description = description.replace("'","\'")
 
-    except requests.exceptions.RequestException as e:
-        print("Error retrieving incident detail from Salesforce: " + e)
-        print("Response Code: " + str(response.status_code))
-        quit()
+    # Grabbing the label from the first entry
+    label = str(sfIncidentDetail['IncidentImpacts'][0].get('label'))
+    log.info("Incident detail", extra=statusLog.fields(incident=id, label=label, impacts=len(sfIncidentDetail['IncidentImpacts'])))
 
-    return
+    return {'label': label,
+            'description': description,
+            'instanceKeys': sfIncidentDetail.get('instanceKeys') or [],
+            'serviceKeys': sfIncidentDetail.get('serviceKeys') or [],
+            'impactCount': len(sfIncidentDetail['IncidentImpacts'])}
 
 def loadTestFile(filename) :
     # JSON file
@@ -253,6 +429,101 @@ def loadTestFile(filename) :
     # Return dictionary
     return json.loads(f.read())
 
+# One complete pass over the Salesforce incidents for the ini sections selected in args.  Called once
+# by the main logic below, or on every cycle by the status daemon which keeps the process running.
+# The daemon passes a tenantFanout.TenantPool so the tenants are reused from one cycle to the next.
+def runStatusCheck(run_config, tenant_pool=None) :
+    global config, instancesChecked, metrics, tenant_incidents, incident_details, instances
+    global sf_session, sf_timeout, detail_workers, detail_cache, detail_cache_file
+
+    config = run_config
+    run_started = time.monotonic()
+
+    # create variables
+    instancesChecked = 0
+
+    # Every selected section is a tenant with its own pooled Dynatrace client, custom device, journal
+    # and spool.  The Salesforce settings (workers, timeout, detail cache) come from the first section.
+    try:
+        section_names = tenantFanout.selectSections(config, args, isTenantSection)
+    except ValueError as e:
+        log.error("%s...exiting", e)
+        sys.exit(1)
+    statusLog.fromConfig(config[section_names[0]])
+    tenants = tenantFanout.openTenants(config, section_names, 'salesforce', 'SALESFORCE', pool=tenant_pool)
+    source = tenants[0].section
+
+    # Timings, request counts and cache hit rates of this run, only sent when self_metrics is set.  With
+    # several sections the Salesforce work is shared, so it is reported once for all of them.
+    if len(tenants) == 1:
+        metrics = tenants[0].metrics
+    else:
+        metrics = selfMetrics.fromConfig(source, 'salesforce', customer='all', environment='all')
+
+    # Salesforce calls get a session of their own, the Dynatrace api token is never sent to Salesforce
+    detail_workers = max(1, source.getint('incident_detail_workers', 8))
+    sf_timeout = source.getfloat('http_timeout', 30)
+    sf_session = requests.Session()
+    sf_session.headers.update({'Accept': 'application/json'})
+    sf_adapter = HTTPAdapter(pool_connections=detail_workers, pool_maxsize=detail_workers)
+    sf_session.mount('https://', sf_adapter)
+    sf_session.mount('http://', sf_adapter)
+    metrics.watch(sf_session, 'salesforce_status')
+
+    # However the run ends (an exit included) the connections are closed and the self monitoring sent,
+    # the status daemon runs the next cycle in this same process
+    try:
+        # Incident details already fetched, keyed by incident id and updatedAt
+        detail_cache_file = source.get('incident_detail_cache_file')
+        detail_cache = jsonStore.load(detail_cache_file, {}) if detail_cache_file else {}
+
+        # The Salesforce custom device is only retrieved from Dynatrace, or the entity cache, once an
+        # event needs to be sent
+        for tenant in tenants:
+            if tenant.entity_cache and args.refreshEntities:
+                tenant.entity_cache.invalidate(entityCacheKey(tenant))
+
+        # Read the Salesforce instances from file that are of concern.  We build a list and then compare those
+        # to any instances that may be impacted by actively identified issues from Salesforce Trust status.
+        instances = {}
+        for tenant in tenants:
+            sf_instances = loadSFInstances(tenant)
+            if sf_instances:
+                instances[tenant.name] = sf_instances
+            else:
+                log.warning("No Salesforce instances loaded....skipping it.", extra=statusLog.fields(section=tenant.name))
+        if not instances:
+            log.error("No Salesforce instances loaded from file....exiting.")
+            sys.exit()
+
+        # Call Salesforce API to retrieve open incidents, then the details of every incident that matched
+        # one of the sections
+        active_incidents = retrieveActiveIncidents()
+        tenant_incidents = matchIncidents(active_incidents, instances)
+        matched_ids = set(incident['id'] for incidents in tenant_incidents.values() for incident in incidents)
+        matched = [incident for incident in active_incidents if incident['id'] in matched_ids]
+        incident_details = retrieveIncidentDetails(matched)
+        sf_session.close()
+
+        # Then the events, sent to each section's own tenant
+        failed = tenantFanout.dispatch([tenant for tenant in tenants if tenant.name in instances], notifyTenant,
+                                       workers=tenantFanout.workersFromConfig(source, args.tenantWorkers))
+
+        log.info("Summary", extra=statusLog.fields(instances_checked=instancesChecked, active_incidents=len(active_incidents),
+                                                   matched_incidents=len(matched)))
+        for tenant in tenants:
+            log.info("Section summary", extra=statusLog.fields(section=tenant.name, impacts=tenant.counts['impacts'], sent=tenant.counts['sent'],
+                                                               skipped=tenant.counts['skipped'], closed=tenant.counts['closed']))
+        if failed:
+            log.error("Sections that could not be reported to", extra=statusLog.fields(sections=failed))
+        log.info("Complete")
+
+        metrics.observe('phase.duration', (time.monotonic() - run_started) * 1000.0, phase='run')
+    finally:
+        sf_session.close()
+        tenantFanout.close(tenants, metrics, pool=tenant_pool)
+    return
+
 ###
 ### End subroutine area
 ###
@@ -261,43 +532,13 @@ def loadTestFile(filename) :
 ### Main logic
 ##############
 
-# create variables
-instancesChecked = 0
-global description
-global impact_cnt
-impact_cnt=0
-global label
-
-# Other values declared
-entity_ids = []
-
-# Setup a pretty print object
-pp = pprint.PrettyPrinter(indent=4)
-
-# Parse arguments passed into script
-parseArguments()
-
-# Load configuration file supplied
-config = configparser.ConfigParser()
-config.read(args.iniFile)
-config.sections()
-
-token = "Api-Token " + config[args.customer + "_" + args.environment]['api_token']
-headers = {'Accept': 'application/json','Content-Type': 'application/json', 'Authorization': token}
-
-# Retrieve Application Entity ID's from Dynatrace
-# looking specifically for entities with tag "SALESFORCE_STATUS"
-getEntityIds()
-
-# Read the Salesforce instances from file that are of concern.  We build a list and then compare those
-# to any instances that may be impacted by actively identified issues from Salesforce Trust status.
-loadSFInstances()
+if __name__ == '__main__':
+    # Parse arguments passed into script
+    parseArguments()
 
-# Call Salesforce API to retrieve open incidents
-retrieveActiveIncidents()
+    # Load configuration file supplied
+    config = configparser.ConfigParser()
+    config.read(args.iniFile)
+    config.sections()
 
-print("")
-print("##### Summary #####")
-print("SF Instances Checked:" + str(instancesChecked))
-print("SF Impacted Count:" + str(impact_cnt))
-print("Complete")
+    runStatusCheck(config)
@@ -0,0 +1,155 @@
+# Description: Long running alternative to scheduling awsStatusFeed.py, statusFeed.py (Okta) and
+# sfStatusFeed.py from cron.  The daemon reads its ini file and the ini file of every status source
+# once, then polls each source on its own interval from a single python process.  Python start up,
+# the imports and the ini parsing are only paid once instead of on every run.
+#
+#   - SIGHUP reloads the ini files.  Sources finish the cycle they are in and restart with the new values.
+#
+# Every source keeps its tenants (the Dynatrace connections, entity cache, incident journal and event
+# spool of each ini section) from one cycle to the next, they are only built again on a reload.
+#   - SIGTERM / SIGINT (Ctrl-C) stop the daemon once the cycles in flight have finished.
+#
+# A source section with sections=RFD_PRD,ABC_TST (or sections=all) reports to those ini sections of its
+# ini file in one cycle, fetching the source once for all of them, instead of [DAEMON] customer/environment.
+#
+# All the sources log through lib/statusLog.py with the log_level, log_format and log_file of [DAEMON],
+# the log_* keys of the source ini files are not used under the daemon.
+#
+# Usage: python3 ~/statusDaemon.py --iniFile ~/daemon.ini
+#
+import os, sys, time, signal, threading, configparser, argparse
+
+# The status extensions and the shared modules are imported from their folders in this repository.
+# If the files were copied into one directory instead they are found next to this script.
+repo_root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+for folder in ('lib', 'AWS/StatusFeed', 'Okta/StatusFeed', 'Salesforce/StatusFeed'):
+    sys.path.append(os.path.join(repo_root, folder))
+import awsStatusFeed, statusFeed, sfStatusFeed, statusLog, tenantFanout
+
+log = statusLog.getLogger('daemon')
+
+# ini section of the daemon file -> status extension that it runs
+SOURCES = {
+    'AWS_STATUS': awsStatusFeed,
+    'OKTA_STATUS': statusFeed,
+    'SALESFORCE_STATUS': sfStatusFeed
+}
+DEFAULT_INTERVAL_SECONDS = 300
+
+
+def parseArguments() :
+    parser = argparse.ArgumentParser('Poll the AWS, Okta and Salesforce status sources from one process')
+    parser.add_argument("--iniFile", help="Supply path to the daemon ini file")
+
+    global args
+    args = parser.parse_args()
+    return
+
+def loadConfig() :
+    # Read the daemon ini and the ini file of each enabled source.  Returns a list of
+    # (section name, module, source config, interval seconds, arguments) for the sources to poll.
+    daemon_config = configparser.ConfigParser()
+    daemon_config.read(os.path.expanduser(args.iniFile))
+
+    global customer, environment
+    customer = daemon_config['DAEMON']['customer']
+    environment = daemon_config['DAEMON']['environment']
+    statusLog.fromConfig(daemon_config['DAEMON'], override=True)
+
+    sources = []
+    for name, module in SOURCES.items():
+        if name not in daemon_config or not daemon_config[name].getboolean('enabled', True):
+            continue
+
+        source_config = configparser.ConfigParser()
+        source_config.read(os.path.expanduser(daemon_config[name]['ini_file']))
+        interval = daemon_config[name].getfloat('interval_seconds', DEFAULT_INTERVAL_SECONDS)
+        sections = daemon_config[name].get('sections', '').strip()
+        if sections.lower() == 'all':
+            source_args = ["--allSections"]
+        elif sections:
+            source_args = ["--sections", sections]
+        else:
+            source_args = ["--customer", customer, "--environment", environment]
+        sources.append((name, module, source_config, interval, source_args))
+        log.info("Source loaded", extra=statusLog.fields(source=name, interval_seconds=interval))
+
+    return sources
+
+def runSource(name, module, source_config, source_args, tenant_pool) :
+    log.info("Cycle started", extra=statusLog.fields(source=name))
+    try:
+        module.parseArguments(source_args)
+        module.runStatusCheck(source_config, tenant_pool=tenant_pool)
+    except SystemExit:
+        # The extensions exit when there is nothing to do (no tagged applications for example),
+        # that only ends this cycle.
+        log.warning("Cycle ended early", extra=statusLog.fields(source=name))
+    except Exception:
+        log.exception("Cycle failed", extra=statusLog.fields(source=name))
+
+    return
+
+def pollSource(name, module, source_config, interval, source_args) :
+    # The tenants are built on the first cycle and closed once the source stops for a reload or shutdown
+    tenant_pool = tenantFanout.TenantPool()
+    try:
+        while not cycle_stop.is_set():
+            started = time.monotonic()
+            runSource(name, module, source_config, source_args, tenant_pool)
+            # Wait out the rest of the interval, waking straight away on reload or shutdown
+            cycle_stop.wait(max(0, interval - (time.monotonic() - started)))
+    finally:
+        tenant_pool.close()
+
+    return
+
+def requestReload(signum, frame) :
+    log.info("SIGHUP received, reloading configuration after the current cycles finish")
+    cycle_stop.set()
+    return
+
+def requestShutdown(signum, frame) :
+    log.info("Signal received, shutting down after the current cycles finish", extra=statusLog.fields(signal=signum))
+    shutdown.set()
+    cycle_stop.set()
+    return
+
+###
+### End function area
+###
+
+##############
+### Main logic
+##############
+
+shutdown = threading.Event()
+cycle_stop = threading.Event()
+
+parseArguments()
+
+signal.signal(signal.SIGTERM, requestShutdown)
+signal.signal(signal.SIGINT, requestShutdown)
+if hasattr(signal, 'SIGHUP'):
+    signal.signal(signal.SIGHUP, requestReload)
+
+while not shutdown.is_set():
+    cycle_stop.clear()
+    pollers = []
+    for name, module, source_config, interval, source_args in loadConfig():
+        poller = threading.Thread(target=pollSource, name=name, args=(name, module, source_config, interval, source_args))
+        poller.start()
+        pollers.append(poller)
+
+    if not pollers:
+        log.error("No status sources enabled...exiting", extra=statusLog.fields(ini_file=args.iniFile))
+        break
+
+    # Signal handlers only run on the main thread, so wait here with a timeout rather than on join()
+    while not cycle_stop.wait(1):
+        pass
+
+    for poller in pollers:
+        poller.join()
+
+log.info("Status daemon stopped")
@@ -0,0 +1,186 @@
+# Description: Shared pieces of the AWS scanners (PendingMaintenance, DMSTaskErrors).  A run makes one
+# boto3 session, assuming the role Dynatrace uses once when assume_role_arn is set, and builds a client
+# per service and region.  The clients retry throttling and 5xx with the standard botocore retry mode
+# and every list call is paginated, so one call per region replaces a CLI process per resource.
+#
+# The name of a resource (RDS or DMS replication instance) is looked up in a listing
+# of the region made once and kept in name_cache_file for name_cache_ttl_minutes, so reporting a
+# finding never lists the region again.  An ARN the listing doesn't know yet refreshes it once.
+#
+# Findings are sent as the CUSTOM_ALERT events the shell scripts sent, to /api/v2/events/ingest.
+# Setting aws_endpoint_url points every AWS call at a local stand-in (Benchmark/standIns.py) so the
+# scanners can be run without an AWS account.
+#
+# Usage:
+#   session = awsScan.sessionFromConfig(config['RFD_PRD'])
+#   rds = awsScan.client(session, config['RFD_PRD'], 'rds', 'us-east-2')
+#   for action in awsScan.paginate(rds, 'describe_pending_maintenance_actions', 'PendingMaintenanceActions'):
+#       ...
+#   names = awsScan.NameIndex(config['RFD_PRD'].get('name_cache_file'))
+#   name = names.lookup('rds/us-east-2', arn, listRdsInstances)
+#   alert = awsScan.customAlert(arn, message, name, 'Maintenance Pending', 35)
+#   awsScan.sendAlerts(dynatrace, awsScan.eventUrl(config['RFD_PRD']), [alert])
+#
+import os, json, time, datetime, threading, requests, jsonStore, statusLog
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.config import Config
+
+DEFAULT_REGIONS = 'us-east-2'
+DEFAULT_AWS_RETRIES = 5
+DEFAULT_AWS_TIMEOUT = 30
+DEFAULT_SCAN_WORKERS = 8
+DEFAULT_EVENT_TIMEOUT_MINUTES = 35
+DEFAULT_NAME_CACHE_TTL_MINUTES = 60
+DEFAULT_SEND_WORKERS = 4
+EVENT_TYPE = 'CUSTOM_ALERT'
+
+log = statusLog.getLogger('awsScan')
+
+
+class NameIndex:
+    # ARN -> name per listing (like "rds/us-east-2"), filled by the caller's list function
+
+    def __init__(self, cache_file=None, ttl_minutes=DEFAULT_NAME_CACHE_TTL_MINUTES):
+        self.cache_file = cache_file
+        self.ttl_seconds = ttl_minutes * 60
+        self.listings = 0
+        self.hits = 0
+        self._lock = threading.Lock()
+        self._entries = jsonStore.load(cache_file, {}) if cache_file else {}
+        self._refreshed = set()
+
+    def lookup(self, listing, arn, listNames):
+        # listNames() returns {arn: name} for the whole listing.  It is called at most once per run for a
+        # listing, when there is no fresh copy or the copy doesn't know the arn yet.
+        with self._lock:
+            entry = self._entries.get(listing)
+            fresh = entry and time.time() - entry['fetched'] < self.ttl_seconds
+            if fresh and (arn in entry['names'] or listing in self._refreshed):
+                self.hits +=1
+                return entry['names'].get(arn)
+
+        names = listNames()
+        with self._lock:
+            self.listings +=1
+            self._refreshed.add(listing)
+            self._entries[listing] = {'names': names, 'fetched': time.time()}
+        return names.get(arn)
+
+    def save(self):
+        if not self.cache_file:
+            return
+        now = time.time()
+        with self._lock:
+            entries = {listing: entry for listing, entry in self._entries.items() if now - entry['fetched'] < self.ttl_seconds}
+        jsonStore.save(self.cache_file, entries)
+        return
+
+
+def regionsFromConfig(section, override=None):
+    regions = override or section.get('aws_regions', DEFAULT_REGIONS)
+    return [region.strip() for region in regions.split(',') if region.strip()]
+
+
+def sessionFromConfig(section):
+    # The default credential chain (instance profile, environment, aws_profile), switched to the role
+    # in assume_role_arn when one is set
+    session = boto3.Session(profile_name=section.get('aws_profile') or None)
+    if not section.get('assume_role_arn'):
+        return session
+
+    sts = client(session, section, 'sts', regionsFromConfig(section)[0])
+    params = {'RoleArn': section['assume_role_arn'],
+              'RoleSessionName': section.get('assume_role_session_name', 'dynatrace-aws-scan')}
+    if section.get('external_id'):
+        params['ExternalId'] = section['external_id']
+    credentials = sts.assume_role(**params)['Credentials']
+    return boto3.Session(aws_access_key_id=credentials['AccessKeyId'],
+                         aws_secret_access_key=credentials['SecretAccessKey'],
+                         aws_session_token=credentials['SessionToken'])
+
+
+def client(session, section, service, region, pool_size=None):
+    # botocore clients are thread safe, make them up front and share them with the scan workers.  The
+    # pool should have a connection for each worker that uses the client.
+    config = Config(retries={'mode': 'standard', 'max_attempts': section.getint('aws_retries', DEFAULT_AWS_RETRIES)},
+                    connect_timeout=section.getfloat('aws_timeout', DEFAULT_AWS_TIMEOUT),
+                    read_timeout=section.getfloat('aws_timeout', DEFAULT_AWS_TIMEOUT),
+                    max_pool_connections=pool_size or section.getint('scan_workers', DEFAULT_SCAN_WORKERS))
+    return session.client(service, region_name=region, endpoint_url=section.get('aws_endpoint_url') or None, config=config)
+
+
+def paginate(aws_client, operation, result_key, **params):
+    # Generator over the items of every page of a describe call.  Operations botocore has no paginator
+    # for (dms describe_pending_maintenance_actions) follow Marker by hand.
+    if aws_client.can_paginate(operation):
+        for page in aws_client.get_paginator(operation).paginate(**params):
+            for item in page.get(result_key, []):
+                yield item
+        return
+
+    method = getattr(aws_client, operation)
+    while True:
+        page = method(**params)
+        for item in page.get(result_key, []):
+            yield item
+        if not page.get('Marker'):
+            return
+        params = dict(params, Marker=page['Marker'])
+
+
+def compactJson(value):
+    # jq -c style, with the datetimes boto3 hands back written the way the AWS CLI prints them
+    return json.dumps(value, separators=(',', ':'), default=lambda item: item.isoformat() if isinstance(item, (datetime.date, datetime.datetime)) else str(item))
+
+
+def arnName(arn):
+    # Last part of an ARN, what a resource without a listed name is reported as
+    return arn.rsplit(':', 1)[-1].rsplit('/', 1)[-1]
+
+
+def customAlert(resource_id, message, resource_name, subject, timeout_minutes=DEFAULT_EVENT_TIMEOUT_MINUTES):
+    return {'eventType': EVENT_TYPE,
+            'title': subject + " - " + str(resource_name),
+            'timeout': timeout_minutes,
+            'properties': {'message': message, 'resource_id': resource_id}}
+
+
+def errorAlert(script, what, exception, timeout_minutes=DEFAULT_EVENT_TIMEOUT_MINUTES):
+    # What the error trap of the shell scripts sent when a command failed
+    pid = "PID: " + str(os.getpid())
+    return customAlert(pid, os.path.basename(script) + " - [ERROR] - " + what + ": " + repr(exception), script,
+                       "Error - " + what + " - " + pid, timeout_minutes)
+
+
+def eventUrl(section):
+    if section.get('event_ingest_url'):
+        return section['event_ingest_url']
+    return section['tenant_url'].rstrip('/') + "/api/v2/events/ingest"
+
+
+def sendAlerts(dynatrace, url, alerts, spool=None, workers=DEFAULT_SEND_WORKERS):
+    # Send the alerts over the pooled client, `workers` at a time, or through the event spool when
+    # there is one.  Returns the number of alerts the tenant did not take (still queued with a spool).
+    if not alerts:
+        return 0
+    if spool:
+        for alert in alerts:
+            spool.enqueue(url, alert)
+        return spool.deliver(dynatrace)
+
+    def send(alert):
+        try:
+            response = dynatrace.post(url, data=json.dumps(alert))
+        except requests.exceptions.RequestException as e:
+            log.warning("Error sending event to Dynatrace: %s", e, extra=statusLog.fields(title=alert['title']))
+            return False
+        log.info("Sent event to Dynatrace", extra=statusLog.fields(title=alert['title'], status=response.status_code))
+        if not response.ok:
+            log.warning("Event rejected", extra=statusLog.fields(title=alert['title'], status=response.status_code))
+            log.debug("Response body: %s", statusLog.lazy(lambda: response.text))
+        return response.ok
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        return list(executor.map(send, alerts)).count(False)
@@ -0,0 +1,200 @@
+# Description: Shared http client for the calls the extensions make to the Dynatrace API.  One client
+# keeps a pool of keep-alive connections to the tenant so the TLS handshake is paid once per run
+# rather than once per call.  Every request gets a timeout, connection errors and 5xx responses are
+# retried with exponential backoff, and 429 (too many requests) responses wait for the Retry-After
+# time the tenant asks for before trying again.
+#
+# A POST is not idempotent: a 5xx or a read timeout may come after the tenant already stored the event
+# or object, and sending it again would store it twice.  So a POST is only retried on a 429 (the tenant
+# took nothing) or a failed connection, unless the call passes retry_post=True because posting the
+# same body twice does no harm (like the create or update of a custom device).
+#
+# Usage:
+#   dynatrace = dynatraceClient.fromConfig(config['RFD_PRD'])
+#   response = dynatrace.get(entity_url)
+#   response = dynatrace.post(event_url, data=json.dumps(payload))
+#   response = dynatrace.post(custom_device_url, data=json.dumps(device), retry_post=True)
+#   for entity in dynatrace.iterEntities(tenant_url, 'type("CUSTOM_DEVICE")', fields='properties'):
+#       ...
+#   for setting in dynatrace.iterSettings(tenant_url, ['builtin:process-group.monitoring.state']):
+#       ...
+#
+# Given a selfMetrics recorder the client counts its requests, bytes, retries and errors there.
+#
+# toEventsV2() turns a v1 event payload into one for /api/v2/events/ingest that is attached by
+# entity selector, so the tenant finds the entities and nothing has to be looked up first.
+#
+# Non retryable responses (2xx, 4xx other than 429) are returned as is for the caller to check.  Once
+# the retries are used up the last response is returned, or the last requests exception is raised.
+#
+import time, random, email.utils, requests, statusLog
+from requests.adapters import HTTPAdapter
+
+DEFAULT_TIMEOUT = 30
+DEFAULT_RETRIES = 4
+DEFAULT_BACKOFF = 1.0
+MAX_BACKOFF = 60
+DEFAULT_POOL_SIZE = 20
+# Largest page the v2 entities API hands out, fewer pages means fewer round trips
+DEFAULT_ENTITY_PAGE_SIZE = 500
+DEFAULT_SETTINGS_PAGE_SIZE = 500
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+
+log = statusLog.getLogger('dynatraceClient')
+
+
+class DynatraceClient:
+
+    def __init__(self, api_token, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF,
+                 pool_size=DEFAULT_POOL_SIZE, verify=True, metrics=None):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.metrics = metrics
+
+        self.session = requests.Session()
+        self.session.verify = verify
+        self.session.headers.update({'Accept': 'application/json',
+                                     'Content-Type': 'application/json',
+                                     'Authorization': 'Api-Token ' + api_token})
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        if metrics:
+            metrics.watch(self.session, 'dynatrace')
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, retry_post=False, **kwargs):
+        return self.request('POST', url, retry_post=retry_post, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+    def request(self, method, url, retry_post=False, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        # Whether the tenant may have acted on a request that failed or answered 5xx is not known
+        idempotent = method.upper() in IDEMPOTENT_METHODS or retry_post
+
+        attempt = 0
+        while True:
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if self.metrics:
+                    self.metrics.error('dynatrace', e)
+                if attempt >= self.retries or (isinstance(e, requests.exceptions.ReadTimeout) and not idempotent):
+                    raise
+                wait = self._backoff(attempt)
+                log.warning("Dynatrace %s failed (%s), retrying in %.1fs", method, e, wait)
+            else:
+                if response.status_code not in RETRY_STATUS_CODES or attempt >= self.retries:
+                    return response
+                if response.status_code != 429 and not idempotent:
+                    return response
+                wait = self._retryAfter(response) if response.status_code == 429 else None
+                if wait is None:
+                    wait = self._backoff(attempt)
+                log.warning("Dynatrace %s returned %s, retrying in %.1fs", method, response.status_code, wait)
+
+            if self.metrics:
+                self.metrics.count('http.retries', target='dynatrace')
+            time.sleep(wait)
+            attempt +=1
+
+    def iterEntities(self, tenant_url, entity_selector, fields=None, page_size=DEFAULT_ENTITY_PAGE_SIZE,
+                     time_from='now-72h', time_to=None, sort=None):
+        # Generator over the entities matching a v2 entity selector, following nextPageKey until the last
+        # page.  Only one page is held at a time so memory stays flat however many entities match.  Put
+        # the filtering in the selector (entityName.equals, tag, ...) rather than scanning client side.
+        # An http error on any page is raised as requests.exceptions.HTTPError.
+        url = tenant_url.rstrip('/') + "/api/v2/entities"
+        params = {'entitySelector': entity_selector, 'pageSize': page_size, 'from': time_from}
+        if fields:
+            params['fields'] = fields
+        if time_to:
+            params['to'] = time_to
+        if sort:
+            params['sort'] = sort
+
+        while params:
+            response = self.get(url, params=params)
+            response.raise_for_status()
+            page = response.json()
+            for entity in page.get('entities', []):
+                yield entity
+
+            # The page key carries the selector and page size, the API rejects it combined with them
+            next_page_key = page.get('nextPageKey')
+            params = {'nextPageKey': next_page_key} if next_page_key else None
+        return
+
+    def iterSettings(self, tenant_url, schema_ids, scopes=None, fields='objectId,schemaId,scope,value',
+                     page_size=DEFAULT_SETTINGS_PAGE_SIZE):
+        # Generator over the settings v2 objects of one or more schemas, following nextPageKey the same
+        # way as iterEntities.  Leave scopes out to get the objects of every scope in one pass.
+        url = tenant_url.rstrip('/') + "/api/v2/settings/objects"
+        params = {'schemaIds': ','.join(schema_ids), 'fields': fields, 'pageSize': page_size}
+        if scopes:
+            params['scopes'] = ','.join(scopes)
+
+        while params:
+            response = self.get(url, params=params)
+            response.raise_for_status()
+            page = response.json()
+            for item in page.get('items', []):
+                yield item
+
+            next_page_key = page.get('nextPageKey')
+            params = {'nextPageKey': next_page_key} if next_page_key else None
+        return
+
+    def close(self):
+        self.session.close()
+        return
+
+    def _backoff(self, attempt):
+        # Exponential backoff with a little jitter so parallel workers don't retry in lock step
+        return min(MAX_BACKOFF, self.backoff * (2 ** attempt)) * random.uniform(0.8, 1.2)
+
+    def _retryAfter(self, response):
+        # Retry-After is either a number of seconds or an http date
+        retry_after = response.headers.get('Retry-After')
+        if not retry_after:
+            return None
+        try:
+            return min(MAX_BACKOFF, max(0, float(retry_after)))
+        except ValueError:
+            pass
+        try:
+            retry_date = email.utils.parsedate_to_datetime(retry_after)
+        except (TypeError, ValueError):
+            return None
+        return min(MAX_BACKOFF, max(0, retry_date.timestamp() - time.time()))
+
+
+def toEventsV2(payload, entity_selector):
+    # The v2 event carries the selector instead of entity ids, its timeout is in minutes and the
+    # description and source become event properties
+    event = {'eventType': payload['eventType'],
+             'title': payload['title'],
+             'entitySelector': entity_selector,
+             'timeout': payload.get('timeoutMinutes', 10),
+             'properties': {}}
+    if payload.get('description'):
+        event['properties']['dt.event.description'] = payload['description']
+    if payload.get('source'):
+        event['properties']['source'] = payload['source']
+    return event
+
+
+def fromConfig(section, metrics=None):
+    # Build a client from the api_token and the optional http_* keys of an ini section
+    return DynatraceClient(section['api_token'],
+                           timeout=section.getfloat('http_timeout', DEFAULT_TIMEOUT),
+                           retries=section.getint('http_retries', DEFAULT_RETRIES),
+                           backoff=section.getfloat('http_backoff', DEFAULT_BACKOFF),
+                           pool_size=section.getint('http_pool_size', DEFAULT_POOL_SIZE),
+                           metrics=metrics)
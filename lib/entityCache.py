@@ -0,0 +1,62 @@
+# Description: On disk cache of the Dynatrace entity ids that the status extensions attach their events
+# to (applications tagged AWS_STATUS / OKTA_STATUS, the Salesforce custom device).  Those ids rarely
+# change, so a lookup is reused until it is older than the configured ttl.  The extensions only ask
+# for the ids when an event is about to be sent, so a run with no open issues makes no lookup at all.
+#
+# Usage:
+#   cache = entityCache.fromConfig(config['RFD_PRD'])
+#   entity_ids = cache.get(lookup_url)        # None when missing or expired
+#   cache.put(lookup_url, entity_ids)
+#   cache.invalidate(lookup_url)              # force the next run to look the ids up again
+#
+import time, threading, jsonStore
+
+DEFAULT_TTL_MINUTES = 60
+
+
+class EntityCache:
+
+    def __init__(self, cache_file, ttl_minutes=DEFAULT_TTL_MINUTES):
+        self.cache_file = cache_file
+        self.ttl_seconds = ttl_minutes * 60
+        self._lock = threading.Lock()
+        self._entries = jsonStore.load(cache_file, {})
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry and time.time() - entry['fetched'] < self.ttl_seconds:
+            return list(entry['entityIds'])
+        return None
+
+    def put(self, key, entity_ids):
+        with self._lock:
+            self._entries[key] = {'entityIds': list(entity_ids), 'fetched': time.time()}
+            self._save()
+        return
+
+    def invalidate(self, key=None):
+        # Drop one lookup, or every lookup when no key is given
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+            self._save()
+        return
+
+    def _save(self):
+        # Expired entries are dropped on every write so the file only holds live lookups
+        now = time.time()
+        self._entries = {key: entry for key, entry in self._entries.items() if now - entry['fetched'] < self.ttl_seconds}
+        jsonStore.save(self.cache_file, self._entries)
+        return
+
+
+def fromConfig(section):
+    # Build a cache from the optional entity_cache_* keys of an ini section, None when not configured
+    if not section.get('entity_cache_file'):
+        return None
+
+    return EntityCache(section['entity_cache_file'],
+                       ttl_minutes=section.getfloat('entity_cache_ttl_minutes', DEFAULT_TTL_MINUTES))
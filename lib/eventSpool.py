@@ -0,0 +1,217 @@
+# Description: Durable outbox for the events the status extensions send to Dynatrace.  Events are
+# appended to a json lines file first, so classifying the feeds never waits on the tenant and an
+# event is not lost when the tenant is slow or down.  deliver() drains the outbox with a bounded
+# number of workers behind a token bucket rate limit.  Delivered events are marked done in the
+# same file, failed ones stay queued for the next run until they are older than max_age_minutes.
+#
+# The file only ever has lines appended to it while events are queued and is compacted down to the
+# events still pending at the end of each delivery.  File locks keep overlapping cron runs from
+# delivering the same event twice or losing each other's events.
+#
+# An event can be queued under a key (such as the journal source and issue id) with a context to hand
+# back.  Only the newest pending event of a key is sent, older ones are superseded.  deliver() calls
+# onResult(key, context, payload, status_code) for every event the tenant gave a final answer to
+# (accepted, or rejected with a 4xx), so what depends on the event arriving (the incident journal)
+# is only recorded once it did, on this run or a later one.
+#
+# Usage:
+#   spool = eventSpool.fromConfig(config['RFD_PRD'])
+#   spool.enqueue(event_url, payload, key=['aws', 'EC2'], context=content)
+#   spool.deliver(dynatrace, onResult=recordResult)
+#
+import os, json, time, uuid, threading, requests, statusLog
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import fcntl
+except ImportError:
+    # Windows, runs there can't overlap the way cron runs can so go without the lock
+    fcntl = None
+
+DEFAULT_WORKERS = 4
+DEFAULT_RATE_PER_SECOND = 5
+DEFAULT_MAX_AGE_MINUTES = 60
+
+log = statusLog.getLogger('eventSpool')
+
+
+class TokenBucket:
+    # Allows rate_per_second calls on average with bursts of up to burst calls
+
+    def __init__(self, rate_per_second, burst=None):
+        self.rate = float(rate_per_second)
+        self.capacity = float(burst or max(1, rate_per_second))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class EventSpool:
+
+    def __init__(self, spool_file, workers=DEFAULT_WORKERS, rate_per_second=DEFAULT_RATE_PER_SECOND,
+                 max_age_minutes=DEFAULT_MAX_AGE_MINUTES):
+        self.spool_file = os.path.expanduser(spool_file)
+        self.workers = workers
+        self.rate_per_second = rate_per_second
+        self.max_age_seconds = max_age_minutes * 60
+        self.delivered = 0
+        self.failed = 0
+        self.expired = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(self.spool_file) or '.', exist_ok=True)
+
+    def enqueue(self, url, payload, key=None, context=None):
+        record = {'op': 'event', 'id': str(uuid.uuid4()), 'url': url, 'payload': payload, 'queued': time.time()}
+        if key is not None:
+            record['key'] = key
+            record['context'] = context
+        self._append(record)
+        return
+
+    def deliver(self, client, onResult=None):
+        # Send every pending event.  Returns the number of events still pending afterwards.
+        # Only one run delivers a spool at a time, the others just leave their events queued
+        with open(self.spool_file + ".lock", 'a') as lock_file:
+            if fcntl:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    log.warning("Event spool is being delivered by another run, leaving it queued", extra=statusLog.fields(spool=self.spool_file))
+                    return len(self.pending())
+
+            # The counts are of this delivery, a spool kept by the status daemon delivers every cycle
+            with self._lock:
+                self.delivered = self.failed = self.expired = 0
+            pending = self.pending()
+            fresh = []
+            newest = {}
+            for record in pending:
+                if time.time() - record['queued'] > self.max_age_seconds:
+                    log.warning("Dropping event older than the spool max age", extra=statusLog.fields(title=record['payload'].get('title')))
+                    self._append({'op': 'done', 'id': record['id'], 'status': 'expired'})
+                    self.expired +=1
+                    continue
+                if 'key' in record:
+                    # A later run queued the same issue again, only its newest event is sent
+                    key = json.dumps(record['key'], sort_keys=True)
+                    if key in newest:
+                        fresh.remove(newest[key])
+                        self._append({'op': 'done', 'id': newest[key]['id'], 'status': 'superseded'})
+                    newest[key] = record
+                fresh.append(record)
+
+            bucket = TokenBucket(self.rate_per_second)
+            with ThreadPoolExecutor(max_workers=max(1, self.workers)) as executor:
+                statuses = list(executor.map(lambda record: self._send(client, bucket, record), fresh))
+
+            remaining = self._compact()
+
+        if onResult:
+            # On the calling thread, after the sends, so the callback needs no locking of its own
+            for record, status in zip(fresh, statuses):
+                if status is not None:
+                    onResult(record.get('key'), record.get('context'), record['payload'], status)
+
+        log.info("Events delivered", extra=statusLog.fields(delivered=self.delivered, failed=self.failed, expired=self.expired, queued=len(remaining)))
+        return len(remaining)
+
+    def pending(self):
+        # Events in the file that have not been marked done, in the order they were queued
+        events = {}
+        if not os.path.exists(self.spool_file):
+            return []
+        with open(self.spool_file) as spool:
+            for line in spool:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A line cut short by a crash mid write, the events around it are still good
+                    continue
+                if record.get('op') == 'event':
+                    events[record['id']] = record
+                elif record.get('op') == 'done':
+                    events.pop(record['id'], None)
+        return list(events.values())
+
+    def _send(self, client, bucket, record):
+        # Returns the status code of a final answer, None when the event stays queued
+        bucket.acquire()
+        try:
+            response = client.post(record['url'], data=json.dumps(record['payload']))
+        except requests.exceptions.RequestException as e:
+            log.warning("Error sending event to Dynatrace, keeping it queued: %s", e, extra=statusLog.fields(title=record['payload'].get('title')))
+            self._count('failed')
+            return None
+
+        log.debug("Sent event to Dynatrace", extra=statusLog.fields(title=record['payload'].get('title'), status_code=response.status_code))
+        if response.ok:
+            self._append({'op': 'done', 'id': record['id'], 'status': response.status_code})
+            self._count('delivered')
+        elif 400 <= response.status_code < 500 and response.status_code != 429:
+            # The tenant rejected the event itself, sending it again won't help
+            log.warning("Event rejected by Dynatrace", extra=statusLog.fields(title=record['payload'].get('title'), status_code=response.status_code))
+            log.debug("Event response body: %s", statusLog.lazy(lambda: response.text))
+            self._append({'op': 'done', 'id': record['id'], 'status': response.status_code})
+            self._count('failed')
+        else:
+            self._count('failed')
+            return None
+        return response.status_code
+
+    def _append(self, record):
+        line = json.dumps(record) + "\n"
+        with self._lock:
+            with open(self.spool_file, 'a') as spool:
+                if fcntl:
+                    fcntl.flock(spool, fcntl.LOCK_EX)
+                spool.write(line)
+                spool.flush()
+                os.fsync(spool.fileno())
+        return
+
+    def _compact(self):
+        # Rewrite the file in place with just the pending events.  The file lock keeps other runs from
+        # appending half way through, and rewriting in place (not renaming a new file over it) means an
+        # append that was waiting on the lock still lands in the live file.
+        if not os.path.exists(self.spool_file):
+            return []
+        with self._lock:
+            with open(self.spool_file, 'r+') as spool:
+                if fcntl:
+                    fcntl.flock(spool, fcntl.LOCK_EX)
+                remaining = self.pending()
+                spool.seek(0)
+                spool.truncate()
+                for record in remaining:
+                    spool.write(json.dumps(record) + "\n")
+                spool.flush()
+                os.fsync(spool.fileno())
+        return remaining
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+        return
+
+
+def fromConfig(section):
+    # Build a spool from the optional event_spool_* keys of an ini section, None when not configured
+    if not section.get('event_spool_file'):
+        return None
+
+    return EventSpool(section['event_spool_file'],
+                      workers=section.getint('event_delivery_workers', DEFAULT_WORKERS),
+                      rate_per_second=section.getfloat('event_rate_per_second', DEFAULT_RATE_PER_SECOND),
+                      max_age_minutes=section.getfloat('event_spool_max_age_minutes', DEFAULT_MAX_AGE_MINUTES))
@@ -0,0 +1,119 @@
+# Description: On disk cache for the RSS feeds read by the status extensions.  The cache is keyed by
+# feed url and keeps the ETag / Last-Modified validators returned by the feed along with the last
+# parsed result.  Every fetch is sent as a conditional GET, when the feed answers 304 (Not Modified)
+# the cached result is handed back without downloading or parsing anything.
+#
+# The cache is a single json file.  Entries that have not been used for max_age_days are dropped and
+# the least recently used entries are dropped once there are more than max_entries, so the file can
+# not grow without bound.
+#
+# Usage:
+#   cache = feedCache.FeedCache('~/feed_cache.json')
+#   NewsFeed = cache.fetch(url, timeout=20)
+#   cache.save()
+#
+import os, time, threading, requests, feedparser, jsonStore
+
+DEFAULT_MAX_ENTRIES = 500
+DEFAULT_MAX_AGE_DAYS = 30
+DEFAULT_TIMEOUT = 20
+
+
+class FeedCache:
+
+    def __init__(self, cache_file, max_entries=DEFAULT_MAX_ENTRIES, max_age_days=DEFAULT_MAX_AGE_DAYS):
+        self.cache_file = os.path.expanduser(cache_file)
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_days * 24 * 60 * 60
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = jsonStore.load(self.cache_file, {})
+
+    def fetch(self, url, timeout=DEFAULT_TIMEOUT, session=None):
+        # Returns the parsed feed, either freshly downloaded or from the cache on a 304.
+        # requests exceptions are left for the caller to handle.
+        with self._lock:
+            cached = self._entries.get(url)
+
+        request_headers = {}
+        if cached:
+            if cached.get('etag'):
+                request_headers['If-None-Match'] = cached['etag']
+            if cached.get('modified'):
+                request_headers['If-Modified-Since'] = cached['modified']
+
+        response = (session or requests).get(url, headers=request_headers, timeout=timeout)
+
+        if response.status_code == 304 and cached:
+            with self._lock:
+                cached['lastUsed'] = time.time()
+                self.hits +=1
+            return toFeedParserDict(cached['parsed'])
+
+        response.raise_for_status()
+        NewsFeed = feedparser.parse(response.content)
+
+        with self._lock:
+            self.misses +=1
+            self._entries[url] = {
+                'etag': response.headers.get('ETag'),
+                'modified': response.headers.get('Last-Modified'),
+                'lastUsed': time.time(),
+                'parsed': {'feed': jsonSafe(NewsFeed.feed), 'entries': jsonSafe(NewsFeed.entries)}
+            }
+
+        return NewsFeed
+
+    def save(self):
+        with self._lock:
+            self._evict()
+            entries = dict(self._entries)
+
+        jsonStore.save(self.cache_file, entries)
+        return
+
+    def _evict(self):
+        oldest_allowed = time.time() - self.max_age_seconds
+        for url in [url for url, entry in self._entries.items() if entry.get('lastUsed', 0) < oldest_allowed]:
+            del self._entries[url]
+
+        if len(self._entries) > self.max_entries:
+            by_last_used = sorted(self._entries, key=lambda url: self._entries[url].get('lastUsed', 0))
+            for url in by_last_used[:len(self._entries) - self.max_entries]:
+                del self._entries[url]
+
+        return
+
+
+def jsonSafe(value):
+    # feedparser results hold time.struct_time values (the *_parsed keys) which json can't store,
+    # keep only the plain values the extensions read.
+    if isinstance(value, dict):
+        return {key: jsonSafe(item) for key, item in value.items() if isStorable(item)}
+    if isinstance(value, list):
+        return [jsonSafe(item) for item in value if isStorable(item)]
+    return value
+
+
+def isStorable(value):
+    return value is None or isinstance(value, (str, int, float, bool, dict, list))
+
+
+def toFeedParserDict(value):
+    # Rebuild the attribute style access (NewsFeed.feed.subtitle, entry.title) the scripts rely on
+    if isinstance(value, dict):
+        return feedparser.FeedParserDict({key: toFeedParserDict(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return [toFeedParserDict(item) for item in value]
+    return value
+
+
+def fromConfig(section):
+    # Build a cache from the optional feed_cache_* keys of an ini section, None when not configured
+    if not section.get('feed_cache_file'):
+        return None
+
+    return FeedCache(section['feed_cache_file'],
+                     max_entries=section.getint('feed_cache_max_entries', DEFAULT_MAX_ENTRIES),
+                     max_age_days=section.getfloat('feed_cache_max_age_days', DEFAULT_MAX_AGE_DAYS))
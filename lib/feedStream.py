@@ -0,0 +1,174 @@
+# Description: Streaming reader for RSS / Atom feeds that keep a long history, such as the Okta trust
+# feed (about two years of entries).  The feed is parsed while it downloads and the download stops as
+# soon as max_entries entries have been read, or as soon as it reaches an entry the previous run
+# already read.  The entries after that point are taken from the saved state instead, so the work
+# done on each run follows the number of new entries rather than the length of the feed history.
+#
+# The state file also keeps the ETag / Last-Modified values so an unchanged feed is answered with a
+# 304 (Not Modified) and nothing is downloaded at all.
+#
+# The streaming parser needs well formed xml.  A feed it can't parse (an html entity such as &nbsp; or
+# &rsquo; outside CDATA) is downloaded in full and read with feedparser instead, the same way the
+# extension read every feed before.
+#
+# Usage:
+#   reader = feedStream.fromConfig(config['RFD_PRD'])
+#   entries = reader.fetch(url, timeout=20)      # newest first, entry.title / entry.summary / ...
+#   reader.save()
+#
+import time, threading, requests, feedparser, jsonStore
+import xml.etree.ElementTree as ElementTree
+
+DEFAULT_MAX_ENTRIES = 5
+DEFAULT_TIMEOUT = 20
+CHUNK_SIZE = 8192
+
+# RSS and Atom element names (without namespace) -> entry key
+ENTRY_FIELDS = {'title': 'title', 'link': 'link', 'description': 'summary', 'summary': 'summary',
+                'content': 'summary', 'guid': 'id', 'id': 'id', 'pubDate': 'updated', 'updated': 'updated',
+                'published': 'published'}
+
+
+class FeedReader:
+
+    def __init__(self, state_file=None, max_entries=DEFAULT_MAX_ENTRIES):
+        self.state_file = state_file
+        self.max_entries = max_entries
+        self.not_modified = 0
+        self.entries_read = 0
+        self.entries_reused = 0
+        self._lock = threading.Lock()
+        self._state = jsonStore.load(state_file, {}) if state_file else {}
+
+    def fetch(self, url, timeout=DEFAULT_TIMEOUT, session=None):
+        # Returns up to max_entries entries, newest first.  requests exceptions are left for the caller
+        # to handle.
+        with self._lock:
+            cached = self._state.get(url) if isinstance(self._state.get(url), dict) else None
+        cached_entries = cached.get('entries', []) if cached else []
+
+        request_headers = {}
+        if cached and cached_entries:
+            if cached.get('etag'):
+                request_headers['If-None-Match'] = cached['etag']
+            if cached.get('modified'):
+                request_headers['If-Modified-Since'] = cached['modified']
+
+        response = (session or requests).get(url, headers=request_headers, timeout=timeout, stream=True)
+        try:
+            if response.status_code == 304 and cached_entries:
+                self.not_modified +=1
+                entries = cached_entries
+            else:
+                response.raise_for_status()
+                entries = self._read(response, cached_entries)
+        finally:
+            # Leaves the rest of the feed undownloaded when the reading stopped early
+            response.close()
+
+        # A 304 does not have to repeat the validators, keep the ones the feed sent last time
+        previous = cached if response.status_code == 304 and cached else {}
+        with self._lock:
+            self._state[url] = {'etag': response.headers.get('ETag') or previous.get('etag'),
+                                'modified': response.headers.get('Last-Modified') or previous.get('modified'),
+                                'lastUsed': time.time(), 'entries': entries}
+        return [feedparser.FeedParserDict(entry) for entry in entries]
+
+    def save(self):
+        if not self.state_file:
+            return
+        with self._lock:
+            state = dict(self._state)
+        jsonStore.save(self.state_file, state)
+        return
+
+    def _read(self, response, cached_entries):
+        chunks = []
+        try:
+            entries, read, reused = self._take(streamEntries(response, chunks), cached_entries)
+        except ElementTree.ParseError:
+            # Not well formed xml, read what is left of the feed and parse all of it the forgiving way
+            chunks.extend(response.iter_content(CHUNK_SIZE))
+            entries, read, reused = self._take(parseEntries(b"".join(chunks)), cached_entries)
+        with self._lock:
+            self.entries_read += read
+            self.entries_reused += reused
+        return entries
+
+    def _take(self, new_entries, cached_entries):
+        # Take entries until there are max_entries of them or one matches what the last run read, then
+        # fill up from the cached entries that follow the match.  Returns (entries, read, reused).
+        known = {entryKey(entry): index for index, entry in enumerate(cached_entries)}
+        entries = []
+        for entry in new_entries:
+            if entryKey(entry) in known:
+                reused = cached_entries[known[entryKey(entry)]:][:self.max_entries - len(entries)]
+                return entries + reused, len(entries), len(reused)
+
+            entries.append(entry)
+            if len(entries) >= self.max_entries:
+                break
+        return entries, len(entries), 0
+
+
+def streamEntries(response, chunks):
+    # Generator over the entries of the feed as it downloads, the chunks read are added to `chunks`
+    parser = ElementTree.XMLPullParser(events=('end',))
+    for chunk in response.iter_content(CHUNK_SIZE):
+        chunks.append(chunk)
+        parser.feed(chunk)
+        for event, element in parser.read_events():
+            if localName(element.tag) not in ('item', 'entry'):
+                continue
+            entry = toEntry(element)
+            element.clear()
+            yield entry
+    parser.close()
+
+
+def parseEntries(body):
+    # The entries of a whole feed read with feedparser, in the form toEntry() gives them
+    entries = []
+    for item in feedparser.parse(body).entries:
+        entry = {'title': item.get('title', ''), 'link': item.get('link', ''), 'summary': item.get('summary', '')}
+        # dict.get, the FeedParserDict falls back from updated to published with a deprecation warning
+        entry['updated'] = dict.get(item, 'updated') or dict.get(item, 'published', '')
+        entry['id'] = item.get('id') or entry['link']
+        entries.append(entry)
+    return entries
+
+
+def localName(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def toEntry(element):
+    entry = {}
+    for child in element:
+        name = localName(child.tag)
+        key = ENTRY_FIELDS.get(name)
+        if not key or key in entry:
+            continue
+        if name == 'link' and child.get('href'):
+            # Atom puts the link in an attribute
+            entry[key] = child.get('href')
+        else:
+            entry[key] = (child.text or '').strip()
+    entry.setdefault('updated', entry.get('published', ''))
+    entry.setdefault('id', entry.get('link', ''))
+    entry.setdefault('title', '')
+    entry.setdefault('summary', '')
+    entry.setdefault('link', '')
+    return entry
+
+
+def entryKey(entry):
+    # An entry Okta edits in place keeps its guid but not its updated time, so it is read again
+    return (entry.get('id'), entry.get('updated'))
+
+
+def fromConfig(section):
+    # Build a reader from the optional feed_state_file / feed_max_entries keys of an ini section.  Without
+    # feed_state_file the feed is still read only as far as feed_max_entries, it just isn't remembered.
+    return FeedReader(section.get('feed_state_file'),
+                      max_entries=section.getint('feed_max_entries', DEFAULT_MAX_ENTRIES))
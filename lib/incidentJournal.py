@@ -0,0 +1,140 @@
+# Description: Local record of the issues the status extensions have already reported to Dynatrace.
+# Each open issue is kept under its source, issue id and a hash of its content together with the
+# payload and the time it was last sent.  On every run the extensions ask the journal whether an
+# issue needs to be sent:
+#
+#   - 'new'      the issue is not in the journal yet
+#   - 'changed'  the provider updated the issue text since it was last sent
+#   - 'refresh'  the Dynatrace event would time out before the next run, so send it again
+#   - None       already reported and still open in Dynatrace, nothing to send
+#
+# The events are sent with a timeout of event_timeout_minutes (default 60 with a journal), well past
+# run_interval_minutes, so an unchanged issue is skipped on most runs and only refreshed on the last
+# run before its event would time out.  Closing is done explicitly by resolve(), so the long timeout
+# doesn't keep a resolved issue open.  Without a journal every run sends the open issues again and
+# nothing closes them, so the events keep the short timeout (10 minutes) they always had.
+#
+# Issues that the provider stops reporting are handed back by resolve() so the extension can close
+# them out in Dynatrace and they are dropped from the journal.
+#
+# Usage:
+#   journal = incidentJournal.fromConfig(config['RFD_PRD'])
+#   if journal.check(source, issue_id, content):
+#       ...send the event...
+#       journal.markSent(source, issue_id, content, payload)
+#   for closed in journal.resolve(source, open_ids):
+#       sendEvent(incidentJournal.closingPayload(closed, "RESOLVED - ..."))
+#   journal.save()
+#
+import time, json, hashlib, threading, jsonStore, statusLog
+
+DEFAULT_EVENT_TIMEOUT_MINUTES = 60
+UNJOURNALED_EVENT_TIMEOUT_MINUTES = 10
+DEFAULT_RUN_INTERVAL_MINUTES = 5
+# Extra room so a run that starts a little late still refreshes the event before it times out
+REFRESH_MARGIN_MINUTES = 1
+
+log = statusLog.getLogger('incidentJournal')
+
+
+class IncidentJournal:
+
+    def __init__(self, journal_file, event_timeout_minutes=DEFAULT_EVENT_TIMEOUT_MINUTES,
+                 run_interval_minutes=DEFAULT_RUN_INTERVAL_MINUTES):
+        self.journal_file = journal_file
+        self.event_timeout_minutes = event_timeout_minutes
+        self.run_interval_minutes = run_interval_minutes
+        if event_timeout_minutes <= run_interval_minutes + REFRESH_MARGIN_MINUTES:
+            # Every run would be the last one before the event times out, so nothing is ever skipped
+            log.warning("event_timeout_minutes is not longer than run_interval_minutes + %s, every open issue is sent again on every run",
+                        REFRESH_MARGIN_MINUTES, extra=statusLog.fields(journal=journal_file, event_timeout_minutes=event_timeout_minutes,
+                                                                       run_interval_minutes=run_interval_minutes))
+        self._lock = threading.Lock()
+        self._issues = jsonStore.load(journal_file, {})
+
+    def check(self, source, issue_id, content, now=None):
+        now = now or time.time()
+        with self._lock:
+            issue = self._issues.get(self._key(source, issue_id))
+            if issue:
+                issue['lastSeen'] = now
+
+        if not issue:
+            return 'new'
+        if issue['contentHash'] != contentHash(content):
+            return 'changed'
+
+        # Refresh on the last run that still starts before the event times out in Dynatrace
+        expires = issue['lastSent'] + self.event_timeout_minutes * 60
+        if now + (self.run_interval_minutes + REFRESH_MARGIN_MINUTES) * 60 >= expires:
+            return 'refresh'
+        return None
+
+    def markSent(self, source, issue_id, content, payload, now=None):
+        now = now or time.time()
+        key = self._key(source, issue_id)
+        with self._lock:
+            opened = self._issues.get(key, {}).get('opened', now)
+            self._issues[key] = {'source': source, 'issueId': issue_id, 'contentHash': contentHash(content),
+                                 'payload': payload, 'opened': opened, 'lastSent': now, 'lastSeen': now}
+        return
+
+    def resolve(self, source, open_ids, checked_ids=None):
+        # Remove and return the issues of a source that are no longer open.  When checked_ids is given
+        # only those issue ids are considered, so an issue whose feed could not be read stays open.
+        open_ids = set(open_ids)
+        checked_ids = set(checked_ids) if checked_ids is not None else None
+        closed = []
+        with self._lock:
+            for key, issue in list(self._issues.items()):
+                if issue['source'] != source or issue['issueId'] in open_ids:
+                    continue
+                if checked_ids is not None and issue['issueId'] not in checked_ids:
+                    continue
+                closed.append(self._issues.pop(key))
+        return closed
+
+    def save(self):
+        with self._lock:
+            issues = dict(self._issues)
+        jsonStore.save(self.journal_file, issues)
+        return
+
+    def _key(self, source, issue_id):
+        return source + "|" + str(issue_id)
+
+
+def closingPayload(issue, message):
+    # The last payload sent for the issue with a short timeout so Dynatrace closes the problem
+    # within a minute rather than waiting out the full event timeout.
+    payload = dict(issue['payload'])
+    if 'timeout' in payload:
+        # Events v2, the description is one of the event properties
+        properties = dict(payload.get('properties') or {})
+        properties['dt.event.description'] = message + "\n\n" + properties.get('dt.event.description', '')
+        payload['properties'] = properties
+        payload['timeout'] = 1
+    else:
+        payload['description'] = message + "\n\n" + payload.get('description', '')
+        payload['timeoutMinutes'] = 1
+    return payload
+
+
+def contentHash(content):
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def eventTimeoutMinutes(section):
+    # The timeout of the events an extension sends, longer by default when a journal closes them
+    default = DEFAULT_EVENT_TIMEOUT_MINUTES if section.get('incident_journal_file') else UNJOURNALED_EVENT_TIMEOUT_MINUTES
+    return section.getint('event_timeout_minutes', default)
+
+
+def fromConfig(section):
+    # Build a journal from the optional incident_journal_file key of an ini section, None when not configured
+    if not section.get('incident_journal_file'):
+        return None
+
+    return IncidentJournal(section['incident_journal_file'],
+                           event_timeout_minutes=eventTimeoutMinutes(section),
+                           run_interval_minutes=section.getfloat('run_interval_minutes', DEFAULT_RUN_INTERVAL_MINUTES))
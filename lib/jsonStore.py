@@ -0,0 +1,38 @@
+# Description: Small helpers for the json files the extensions keep between runs (feed cache, entity
+# cache, ...).  Files are written to a temporary file and renamed into place so a run that dies half
+# way can never leave a truncated file behind, and an unreadable file is treated as empty.
+#
+import os, json, tempfile, statusLog
+
+log = statusLog.getLogger('jsonStore')
+
+
+def load(path, default=None):
+    path = os.path.expanduser(path)
+    if not os.path.exists(path):
+        return default
+
+    try:
+        with open(path) as json_file:
+            return json.load(json_file)
+    except (OSError, ValueError) as e:
+        # Losing a cache only costs the lookups it saved, so start over rather than fail the run
+        log.warning("Ignoring unreadable file: %s", e, extra=statusLog.fields(path=path))
+        return default
+
+
+def save(path, data):
+    path = os.path.expanduser(path)
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+
+    fd, temp_file = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path) + '_')
+    try:
+        with os.fdopen(fd, 'w') as json_file:
+            json.dump(data, json_file)
+        os.replace(temp_file, path)
+    except BaseException:
+        os.remove(temp_file)
+        raise
+
+    return
@@ -0,0 +1,240 @@
+# Description: Self monitoring for the status extensions.  A run records how long each phase took
+# (entity lookup, feed fetch, classification, event send, ...), how many http requests it made to each
+# service with the bytes received and the errors seen, and how often its caches were hit.  flush()
+# sends everything in as few requests as possible, as Dynatrace metric line protocol, to the local
+# OneAgent ingest endpoint (the same one Java/DynatraceMetric.java posts to), so the cost of the
+# extensions can be charted next to what they report on.
+#
+# Nothing is sent unless self_metrics=true is set in the ini section.  A failed flush is logged and
+# dropped, it never fails the run.
+#
+# Usage:
+#   metrics = selfMetrics.fromConfig(config['RFD_PRD'], 'aws', customer='RFD', environment='PRD')
+#   metrics.watch(session, 'aws_status')       # requests / bytes / errors of every call on the session
+#   with metrics.timer('feed_fetch'):
+#       ...
+#   metrics.cache('feed', hits=12, misses=3)
+#   metrics.flush()
+#
+# Lines look like:
+#   rfd.status.phase.duration,extension=aws,customer=RFD,environment=PRD,phase=feed_fetch gauge,min=12.1,max=830.4,sum=4210.9,count=120
+#   rfd.status.http.requests,extension=aws,customer=RFD,environment=PRD,target=aws_status,status=2xx count,delta=120
+#
+# metricLine() and postLines() are also used on their own to send line protocol anywhere, in requests
+# that stay within the ingest limits:
+#   lines = [selfMetrics.metricLine('rfd.status.service.status', [('provider', 'aws'), ('service', 'EC2')], 0)]
+#   selfMetrics.postLines(dynatrace, tenant_url + "/api/v2/metrics/ingest", lines)
+#
+import re, time, threading, contextlib, requests, statusLog
+
+DEFAULT_INGEST_URL = 'http://localhost:14499/metrics/ingest'
+DEFAULT_PREFIX = 'rfd.status'
+DEFAULT_TIMEOUT = 5
+# Limits of one ingest request, a bigger flush is split over several requests
+MAX_LINES_PER_REQUEST = 1000
+MAX_BYTES_PER_REQUEST = 512 * 1024
+
+UNQUOTED_VALUE = re.compile(r'^[A-Za-z0-9_.:/\-]+$')
+
+log = statusLog.getLogger('selfMetrics')
+
+
+class MetricRecorder:
+
+    def __init__(self, extension, ingest_url=DEFAULT_INGEST_URL, dimensions=None, prefix=DEFAULT_PREFIX,
+                 enabled=True, timeout=DEFAULT_TIMEOUT):
+        self.ingest_url = ingest_url
+        self.prefix = prefix
+        self.enabled = enabled
+        self.timeout = timeout
+        self.dimensions = dict(extension=extension, **(dimensions or {}))
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._summaries = {}
+
+    def count(self, key, value=1, **dimensions):
+        if not self.enabled:
+            return
+        series = seriesKey(key, dimensions)
+        with self._lock:
+            self._counters[series] = self._counters.get(series, 0) + value
+        return
+
+    def gauge(self, key, value, **dimensions):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._gauges[seriesKey(key, dimensions)] = value
+        return
+
+    def observe(self, key, value, **dimensions):
+        # Adds one sample to a min / max / sum / count summary
+        if not self.enabled:
+            return
+        series = seriesKey(key, dimensions)
+        with self._lock:
+            summary = self._summaries.get(series)
+            if summary is None:
+                self._summaries[series] = [value, value, value, 1]
+            else:
+                summary[0] = min(summary[0], value)
+                summary[1] = max(summary[1], value)
+                summary[2] += value
+                summary[3] += 1
+        return
+
+    @contextlib.contextmanager
+    def timer(self, phase, **dimensions):
+        # Milliseconds spent in the block, a phase timed several times (once per feed for example)
+        # is reported as a summary of all of them
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe('phase.duration', (time.monotonic() - started) * 1000.0, phase=phase, **dimensions)
+
+    def cache(self, name, hits=0, misses=0):
+        if hits:
+            self.count('cache.hits', hits, cache=name)
+        if misses:
+            self.count('cache.misses', misses, cache=name)
+        return
+
+    def error(self, target, exception):
+        # A request that never got a response (connection refused, timeout, ...)
+        self.count('http.errors', target=target, reason=type(exception).__name__)
+        return
+
+    def watch(self, session, target):
+        # Count every response a requests session receives.  Bytes are taken from Content-Length so a
+        # streamed response that is closed early is not read just to be measured.
+        if not self.enabled:
+            return session
+
+        def onResponse(response, *args, **kwargs):
+            self.count('http.requests', target=target, status=str(response.status_code // 100) + 'xx')
+            size = response.headers.get('Content-Length')
+            if size and size.isdigit() and int(size) > 0:
+                self.count('http.bytes', int(size), target=target)
+            if response.status_code >= 400:
+                self.count('http.errors', target=target, reason=str(response.status_code))
+            return response
+
+        session.hooks['response'].append(onResponse)
+        return session
+
+    def lines(self):
+        # Line protocol for everything recorded so far, with the hit ratio of every cache worked out
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            summaries = {series: list(summary) for series, summary in self._summaries.items()}
+
+        for (key, dimensions), hits in counters.items():
+            if key != 'cache.hits':
+                continue
+            misses = counters.get(('cache.misses', dimensions), 0)
+            gauges.setdefault(('cache.hit_ratio', dimensions), round(100.0 * hits / (hits + misses), 1))
+        for (key, dimensions), misses in counters.items():
+            if key == 'cache.misses' and ('cache.hits', dimensions) not in counters:
+                gauges.setdefault(('cache.hit_ratio', dimensions), 0.0)
+
+        lines = []
+        for (key, dimensions), value in sorted(counters.items()):
+            lines.append(self._line(key, dimensions, "count,delta=" + formatNumber(value)))
+        for (key, dimensions), value in sorted(gauges.items()):
+            lines.append(self._line(key, dimensions, formatNumber(value)))
+        for (key, dimensions), (low, high, total, samples) in sorted(summaries.items()):
+            lines.append(self._line(key, dimensions, "gauge,min=" + formatNumber(low) + ",max=" + formatNumber(high) +
+                                    ",sum=" + formatNumber(total) + ",count=" + str(samples)))
+        return lines
+
+    def flush(self):
+        # Send what was recorded and start over.  Returns the number of lines accepted.
+        if not self.enabled:
+            return 0
+        lines = self.lines()
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._summaries.clear()
+
+        return postLines(requests, self.ingest_url, lines, timeout=self.timeout, label="Self monitoring metrics")
+
+    def _line(self, key, dimensions, payload):
+        return metricLine(self.prefix + "." + key, list(self.dimensions.items()) + list(dimensions), payload)
+
+
+def metricLine(key, dimensions, payload):
+    # One line of line protocol.  dimensions is a list of (name, value) pairs, payload a number or a
+    # "count,delta=..." / "gauge,min=..." string.
+    if not isinstance(payload, str):
+        payload = formatNumber(payload)
+    return key + "".join("," + name + "=" + formatValue(value) for name, value in dimensions) + " " + payload
+
+
+def postLines(client, url, lines, timeout=DEFAULT_TIMEOUT, label="Metrics"):
+    # POST line protocol to a metric ingest endpoint, as few requests as the line and byte limits allow.
+    # client is the requests module, a requests session or a DynatraceClient.  Returns the number of
+    # lines accepted, a failed request is logged and not retried here.
+    accepted = 0
+    for chunk in chunkLines(lines):
+        try:
+            response = client.post(url, data="\n".join(chunk).encode('utf-8'), timeout=timeout,
+                                   headers={'Content-Type': 'text/plain; charset=utf-8'})
+        except requests.exceptions.RequestException as e:
+            log.warning("Unable to send " + label.lower() + ": %s", e, extra=statusLog.fields(url=url))
+            return accepted
+        if not response.ok:
+            log.warning(label + " rejected, response code %s: %s", response.status_code, statusLog.lazy(lambda: response.text))
+            continue
+        accepted += len(chunk)
+    log.info(label + " sent", extra=statusLog.fields(lines=accepted))
+    return accepted
+
+
+def seriesKey(key, dimensions):
+    return key, tuple(sorted((name, str(value)) for name, value in dimensions.items()))
+
+
+def formatValue(value):
+    # Dimension values with anything but plain characters are quoted, with quotes and backslashes escaped
+    value = str(value)
+    if UNQUOTED_VALUE.match(value):
+        return value
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def formatNumber(value):
+    if isinstance(value, int):
+        return str(value)
+    return repr(round(float(value), 3))
+
+
+def chunkLines(lines, max_lines=MAX_LINES_PER_REQUEST, max_bytes=MAX_BYTES_PER_REQUEST):
+    # Split line protocol into request bodies that stay within both the line and the byte limit
+    chunk = []
+    size = 0
+    for line in lines:
+        line_size = len(line.encode('utf-8')) + 1
+        if chunk and (len(chunk) >= max_lines or size + line_size > max_bytes):
+            yield chunk
+            chunk = []
+            size = 0
+        chunk.append(line)
+        size += line_size
+    if chunk:
+        yield chunk
+    return
+
+
+def fromConfig(section, extension, **dimensions):
+    # Build a recorder from the optional self_metrics* keys of an ini section.  Without self_metrics=true
+    # the recorder is still handed back but records and sends nothing.
+    return MetricRecorder(extension,
+                          ingest_url=section.get('self_metrics_url', DEFAULT_INGEST_URL),
+                          dimensions=dimensions,
+                          prefix=section.get('self_metrics_prefix', DEFAULT_PREFIX),
+                          enabled=section.getboolean('self_metrics', False),
+                          timeout=section.getfloat('self_metrics_timeout', DEFAULT_TIMEOUT))
@@ -0,0 +1,183 @@
+# Description: Leveled, structured logging for the status extensions.  Every record is one compact json
+# line (or one plain text line) with the time, level, logger, message and the fields passed with it.
+# The extensions only put records on a queue (logging QueueHandler), a QueueListener thread formats and
+# writes them, so a slow disk or pipe never holds up a run.
+#
+# Payloads and response bodies are logged at debug level through lazyJson() / lazy(), which are only
+# rendered when a record at that level is actually written.  At the default INFO level a run logs what
+# it found and did, not the bodies it sent and received.
+#
+# The shared modules the extensions call (dynatraceClient, eventSpool, selfMetrics, tenantFanout,
+# jsonStore, feedManifest, awsScan) log through here too, so their retries and delivery counts follow the same
+# settings.  A script that never calls fromConfig() gets INFO json lines on stdout.
+#
+# The ini section keys are log_level (DEBUG, INFO, WARNING, ERROR, default INFO), log_format (json or
+# text, default json) and log_file (default stdout).  The first fromConfig() of a process sets the
+# logging up, later ones are ignored unless override=True (the status daemon sets it up from its own
+# ini file and keeps it across the runs of all the sources).
+#
+# Usage:
+#   log = statusLog.getLogger('aws')
+#   statusLog.fromConfig(config['RFD_PRD'])
+#   log.info("Service alert", extra=statusLog.fields(service='EC2', status=status))
+#   log.debug("Event payload: %s", statusLog.lazyJson(payload))
+#
+# Lines look like:
+#   {"time":"2024-03-01T22:00:00.123Z","level":"INFO","logger":"rfd.status.aws","message":"Service alert","service":"EC2","status":"Increased error rates"}
+#
+import os, sys, json, time, queue, atexit, logging, threading
+import logging.handlers
+
+ROOT_LOGGER = 'rfd.status'
+DEFAULT_LEVEL = 'INFO'
+DEFAULT_FORMAT = 'json'
+
+_lock = threading.Lock()
+_listener = None
+_settings = None
+_explicit = False
+
+
+class Lazy:
+    # Calls fn(*args) when the record is rendered, never when its level is filtered out
+
+    def __init__(self, fn, *args, **kwargs):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+
+    def __str__(self):
+        return str(self.fn(*self.args, **self.kwargs))
+
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record):
+        line = {'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + '.%03dZ' % record.msecs,
+                'level': record.levelname,
+                'logger': record.name,
+                'message': record.getMessage()}
+        line.update(getattr(record, 'fields', None) or {})
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            line['error'] = record.exc_text
+        return json.dumps(line, separators=(',', ':'), default=str)
+
+
+class TextFormatter(logging.Formatter):
+
+    def __init__(self):
+        logging.Formatter.__init__(self, '%(asctime)s %(levelname)s %(name)s %(message)s')
+
+    def format(self, record):
+        text = logging.Formatter.format(self, record)
+        fields = getattr(record, 'fields', None)
+        if fields:
+            text += " " + " ".join(name + "=" + json.dumps(value, default=str) for name, value in fields.items())
+        return text
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    # Renders the message on the calling thread (so the lazy values see the objects as they were when
+    # logged) but leaves the json encoding and the write to the listener thread
+
+    def prepare(self, record):
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def getLogger(name):
+    # A logger below rfd.status, set up with the defaults if nothing set the logging up yet
+    with _lock:
+        if _listener is None:
+            _configure(DEFAULT_LEVEL, DEFAULT_FORMAT, None)
+    return logging.getLogger(ROOT_LOGGER + "." + name)
+
+
+def fields(**values):
+    # For the extra argument of a logging call, the values are written as fields of the line
+    return {'fields': values}
+
+
+def lazy(fn, *args, **kwargs):
+    return Lazy(fn, *args, **kwargs)
+
+
+def lazyJson(value):
+    return Lazy(json.dumps, value, separators=(',', ':'), default=str)
+
+
+def configure(level=DEFAULT_LEVEL, log_format=DEFAULT_FORMAT, log_file=None, override=True):
+    global _explicit
+    with _lock:
+        if _explicit and not override:
+            return
+        _explicit = True
+        _configure(level, log_format, log_file)
+    return
+
+
+def fromConfig(section, override=False):
+    # Set the logging up from the optional log_* keys of an ini section
+    configure(level=section.get('log_level', DEFAULT_LEVEL),
+              log_format=section.get('log_format', DEFAULT_FORMAT),
+              log_file=section.get('log_file'),
+              override=override)
+    return
+
+
+def shutdown():
+    # Write out what is still queued, called at exit
+    global _listener, _settings
+    with _lock:
+        if _listener:
+            _listener.stop()
+            for handler in _listener.handlers:
+                handler.close()
+        _listener = None
+        _settings = None
+    return
+
+
+def _configure(level, log_format, log_file):
+    # Called with _lock held.  Only the level changes while the output stays the same, otherwise the
+    # listener is replaced once everything queued for the old one is written.
+    global _listener, _settings
+    root = logging.getLogger(ROOT_LOGGER)
+    root.setLevel(str(level).upper())
+    root.propagate = False
+
+    settings = (str(log_format).lower(), os.path.expanduser(log_file) if log_file else None)
+    if _listener is not None and settings == _settings:
+        return
+
+    if log_file:
+        os.makedirs(os.path.dirname(settings[1]) or '.', exist_ok=True)
+        handler = logging.FileHandler(settings[1])
+    else:
+        handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(TextFormatter() if settings[0] == 'text' else JsonFormatter())
+
+    records = queue.Queue()
+    listener = logging.handlers.QueueListener(records, handler, respect_handler_level=False)
+    listener.start()
+
+    previous = _listener
+    for old_handler in list(root.handlers):
+        root.removeHandler(old_handler)
+    root.addHandler(QueueHandler(records))
+    _listener, _settings = listener, settings
+    if previous:
+        previous.stop()
+        for old_handler in previous.handlers:
+            old_handler.close()
+    return
+
+
+atexit.register(shutdown)
@@ -0,0 +1,166 @@
+# Description: Lets one run of a status extension report to several Dynatrace environments.  Every
+# ini section (<customer>_<environment>) is a tenant with its own api token, entity ids, entity cache,
+# incident journal, event spool and self monitoring.  The extension fetches and classifies its source
+# once and then hands the result to every tenant, a few tenants at a time, so the traffic to AWS, Okta
+# or Salesforce stays the same however many environments are added.
+#
+# The state files of a tenant (entity_cache_file, incident_journal_file, event_spool_file) must not be
+# shared with another tenant of the same run, each one is read and written by its own tenant only.
+#
+# A long running process (the status daemon) passes a TenantPool, the tenants are then built on its
+# first run and reused by the ones after, keeping their Dynatrace connections open in between.
+#
+# Usage:
+#   names = tenantFanout.selectSections(config, args, isTenantSection)
+#   tenants = tenantFanout.openTenants(config, names, 'aws', 'AWS', pool=tenant_pool)
+#   tenantFanout.dispatch(tenants, notifyTenant, workers=4)
+#   tenantFanout.close(tenants, metrics, pool=tenant_pool)
+#
+import threading, collections
+from concurrent.futures import ThreadPoolExecutor
+import dynatraceClient, entityCache, incidentJournal, eventSpool, selfMetrics, statusLog
+
+DEFAULT_WORKERS = 4
+STATE_FILE_KEYS = ('entity_cache_file', 'incident_journal_file', 'event_spool_file')
+
+log = statusLog.getLogger('tenantFanout')
+
+
+class Tenant:
+
+    def __init__(self, config, name, extension, source_prefix):
+        self.name = name
+        self.section = config[name]
+        self.customer, separator, self.environment = name.rpartition('_')
+        if not separator:
+            self.customer, self.environment = name, ''
+
+        self.metrics = selfMetrics.fromConfig(self.section, extension, customer=self.customer, environment=self.environment)
+        self.dynatrace = dynatraceClient.fromConfig(self.section, metrics=self.metrics)
+        self.entity_cache = entityCache.fromConfig(self.section)
+        self.journal = incidentJournal.fromConfig(self.section)
+        self.event_spool = eventSpool.fromConfig(self.section)
+        self.journal_source = source_prefix + "/" + name
+        self.reset()
+
+    def reset(self):
+        # Start a run: the entity ids are looked up again (or taken from the entity cache) and the
+        # events sent / skipped / closed are counted from zero for the summary
+        self.entity_ids = []
+        self.counts = collections.Counter()
+        return
+
+    def close(self):
+        self.dynatrace.close()
+        return
+
+
+class TenantPool:
+    # The tenants of one status source in a long running process, kept between its runs.  The state
+    # files are only read when a tenant is built, so close() the pool and start a new one when the ini
+    # file is reloaded.
+
+    def __init__(self):
+        self._tenants = {}
+
+    def tenants(self, config, names, extension, source_prefix):
+        for name in names:
+            if name not in self._tenants:
+                self._tenants[name] = Tenant(config, name, extension, source_prefix)
+        tenants = [self._tenants[name] for name in names]
+        for tenant in tenants:
+            tenant.reset()
+        return tenants
+
+    def close(self):
+        for tenant in self._tenants.values():
+            tenant.close()
+        self._tenants = {}
+        return
+
+
+def openTenants(config, names, extension, source_prefix, pool=None):
+    # The tenants of a run, taken from the pool when there is one
+    if pool is not None:
+        return pool.tenants(config, names, extension, source_prefix)
+    return [Tenant(config, name, extension, source_prefix) for name in names]
+
+
+def selectSections(config, args, isTenantSection):
+    # The ini sections to report to: --allSections, --sections or the usual --customer/--environment.
+    # Raises ValueError naming what is wrong with the selection.
+    if getattr(args, 'allSections', False):
+        names = [name for name in config.sections() if isTenantSection(config[name])]
+        if not names:
+            raise ValueError("No ini section is set up for this extension")
+    elif getattr(args, 'sections', None):
+        names = []
+        for name in args.sections.split(','):
+            if name.strip() and name.strip() not in names:
+                names.append(name.strip())
+    else:
+        names = [str(args.customer) + "_" + str(args.environment)]
+
+    missing = [name for name in names if not config.has_section(name)]
+    if missing:
+        raise ValueError("Section(s) not found in the ini file: " + ", ".join(missing))
+
+    owners = {}
+    for name in names:
+        for key in STATE_FILE_KEYS:
+            state_file = config[name].get(key)
+            if not state_file:
+                continue
+            if state_file in owners and owners[state_file] != name:
+                raise ValueError(key + " " + state_file + " is used by both " + owners[state_file] + " and " + name)
+            owners[state_file] = name
+    return names
+
+
+def dispatch(tenants, notifyTenant, workers=DEFAULT_WORKERS):
+    # Run notifyTenant(tenant) for every tenant, `workers` at a time.  A tenant that fails is reported
+    # and does not stop the others.  Returns the names of the tenants that failed.
+    failed = []
+    lock = threading.Lock()
+
+    def notify(tenant):
+        try:
+            notifyTenant(tenant)
+        except Exception:
+            log.error("Reporting to the section failed", exc_info=True, extra=statusLog.fields(section=tenant.name))
+            with lock:
+                failed.append(tenant.name)
+        except SystemExit:
+            # The extensions exit when there is nothing to attach events to, that only ends this tenant
+            log.warning("Reporting to the section ended early", extra=statusLog.fields(section=tenant.name))
+            with lock:
+                failed.append(tenant.name)
+        return
+
+    if len(tenants) == 1:
+        # A single environment behaves as the extensions always have, errors and exits included
+        notifyTenant(tenants[0])
+    else:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            list(executor.map(notify, tenants))
+    return failed
+
+
+def close(tenants, metrics=None, pool=None):
+    # Send the self monitoring of the run (once per recorder) and close the tenant connections, unless
+    # the tenants came from a pool which keeps them open for the next run
+    recorders = [metrics] if metrics else []
+    for tenant in tenants:
+        if all(tenant.metrics is not recorder for recorder in recorders):
+            recorders.append(tenant.metrics)
+    for recorder in recorders:
+        recorder.flush()
+    if pool is not None:
+        return
+    for tenant in tenants:
+        tenant.close()
+    return
+
+
+def workersFromConfig(section, override=None):
+    return override or section.getint('tenant_workers', DEFAULT_WORKERS)
@@ -0,0 +1,65 @@
+# Run from the root of the repository with: python3 -m unittest discover tests  (or pytest)
+import os, sys, unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+import requests, dynatraceClient
+
+
+class Response:
+
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.headers = {'Retry-After': '0'}
+
+
+class Session:
+    # Answers every request with the next status code, or raises it when it is an exception
+
+    def __init__(self, *answers):
+        self.answers = list(answers)
+        self.methods = []
+
+    def request(self, method, url, **kwargs):
+        self.methods.append(method)
+        answer = self.answers.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        return Response(answer)
+
+
+class RetryTest(unittest.TestCase):
+
+    def client(self, *answers):
+        client = dynatraceClient.DynatraceClient('token', retries=3, backoff=0)
+        client.session = Session(*answers)
+        return client
+
+    def test_get_is_retried_on_5xx(self):
+        client = self.client(503, 502, 200)
+        self.assertEqual(client.get('http://tenant/api').status_code, 200)
+        self.assertEqual(len(client.session.methods), 3)
+
+    def test_post_is_not_retried_on_5xx(self):
+        client = self.client(503, 201)
+        self.assertEqual(client.post('http://tenant/api').status_code, 503)
+        self.assertEqual(len(client.session.methods), 1)
+
+    def test_post_is_not_retried_on_read_timeout(self):
+        client = self.client(requests.exceptions.ReadTimeout(), 201)
+        with self.assertRaises(requests.exceptions.ReadTimeout):
+            client.post('http://tenant/api')
+        self.assertEqual(len(client.session.methods), 1)
+
+    def test_post_is_retried_on_429_and_refused_connection(self):
+        client = self.client(429, requests.exceptions.ConnectionError(), 201)
+        self.assertEqual(client.post('http://tenant/api').status_code, 201)
+        self.assertEqual(len(client.session.methods), 3)
+
+    def test_post_is_retried_on_5xx_when_asked(self):
+        client = self.client(500, 201)
+        self.assertEqual(client.post('http://tenant/api', retry_post=True).status_code, 201)
+        self.assertEqual(len(client.session.methods), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+# Run from the root of the repository with: python3 -m unittest discover tests  (or pytest)
+import os, sys, tempfile, unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+import eventSpool
+
+
+class Response:
+
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.ok = 200 <= status_code < 300
+        self.text = ''
+
+
+class Client:
+    # Answers every post with the next status code, and records the bodies posted
+
+    def __init__(self, *status_codes):
+        self.status_codes = list(status_codes)
+        self.bodies = []
+
+    def post(self, url, data=None):
+        self.bodies.append(data)
+        return Response(self.status_codes.pop(0))
+
+
+class DeliverTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.spool = eventSpool.EventSpool(os.path.join(self.directory.name, 'spool.jsonl'), workers=1, rate_per_second=1000)
+        self.results = []
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def onResult(self, key, context, payload, status):
+        self.results.append((key, context, payload['title'], status))
+
+    def test_result_is_only_reported_for_a_final_answer(self):
+        self.spool.enqueue('http://tenant/api/v1/events', {'title': 'EC2'}, key=['AWS/RFD_PRD', 'EC2'], context='Increased error rates')
+        self.assertEqual(self.spool.deliver(Client(503), onResult=self.onResult), 1)
+        self.assertEqual(self.results, [])
+
+        self.assertEqual(self.spool.deliver(Client(201), onResult=self.onResult), 0)
+        self.assertEqual(self.results, [(['AWS/RFD_PRD', 'EC2'], 'Increased error rates', 'EC2', 201)])
+
+    def test_rejected_event_is_reported_and_dropped(self):
+        self.spool.enqueue('http://tenant/api/v1/events', {'title': 'EC2'}, key=['AWS/RFD_PRD', 'EC2'])
+        self.assertEqual(self.spool.deliver(Client(400), onResult=self.onResult), 0)
+        self.assertEqual(self.results[0][3], 400)
+
+    def test_only_the_newest_event_of_a_key_is_sent(self):
+        self.spool.enqueue('http://tenant/api/v1/events', {'title': 'old'}, key=['AWS/RFD_PRD', 'EC2'])
+        self.spool.enqueue('http://tenant/api/v1/events', {'title': 'new'}, key=['AWS/RFD_PRD', 'EC2'])
+        client = Client(201)
+        self.assertEqual(self.spool.deliver(client, onResult=self.onResult), 0)
+        self.assertEqual([result[2] for result in self.results], ['new'])
+        self.assertEqual(len(client.bodies), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
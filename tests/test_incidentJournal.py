@@ -0,0 +1,33 @@
+# Run from the root of the repository with: python3 -m unittest discover tests  (or pytest)
+import os, sys, tempfile, unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+import incidentJournal
+
+
+class CheckTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.journal = incidentJournal.IncidentJournal(os.path.join(self.directory.name, 'journal.json'),
+                                                       event_timeout_minutes=incidentJournal.DEFAULT_EVENT_TIMEOUT_MINUTES,
+                                                       run_interval_minutes=incidentJournal.DEFAULT_RUN_INTERVAL_MINUTES)
+        self.sent = 1700000000
+        self.journal.markSent('aws', 'EC2', ['Increased error rates'], {'title': 'EC2'}, now=self.sent)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_unchanged_issue_is_skipped_on_the_next_run(self):
+        self.assertIsNone(self.journal.check('aws', 'EC2', ['Increased error rates'], now=self.sent + 5 * 60))
+
+    def test_changed_issue_is_sent_again(self):
+        self.assertEqual(self.journal.check('aws', 'EC2', ['Recovered'], now=self.sent + 5 * 60), 'changed')
+
+    def test_issue_is_refreshed_on_the_last_run_before_it_times_out(self):
+        self.assertIsNone(self.journal.check('aws', 'EC2', ['Increased error rates'], now=self.sent + 50 * 60))
+        self.assertEqual(self.journal.check('aws', 'EC2', ['Increased error rates'], now=self.sent + 55 * 60), 'refresh')
+
+
+if __name__ == '__main__':
+    unittest.main()
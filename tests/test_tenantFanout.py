@@ -0,0 +1,38 @@
+# Run from the root of the repository with: python3 -m unittest discover tests  (or pytest)
+import os, sys, configparser, unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+import tenantFanout
+
+
+class TenantPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.config = configparser.ConfigParser()
+        self.config.read_dict({'RFD_PRD': {'api_token': 'token'}, 'ABC_TST': {'api_token': 'token'}})
+        self.pool = tenantFanout.TenantPool()
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_tenants_are_reused_and_reset(self):
+        first = tenantFanout.openTenants(self.config, ['RFD_PRD', 'ABC_TST'], 'aws', 'AWS', pool=self.pool)
+        first[0].entity_ids.append('APPLICATION-1')
+        first[0].counts['sent'] += 2
+        tenantFanout.close(first, pool=self.pool)
+
+        second = tenantFanout.openTenants(self.config, ['RFD_PRD', 'ABC_TST'], 'aws', 'AWS', pool=self.pool)
+        self.assertIs(second[0], first[0])
+        self.assertIs(second[0].dynatrace, first[0].dynatrace)
+        self.assertEqual(second[0].entity_ids, [])
+        self.assertEqual(second[0].counts['sent'], 0)
+
+    def test_closed_pool_builds_new_tenants(self):
+        first = tenantFanout.openTenants(self.config, ['RFD_PRD'], 'aws', 'AWS', pool=self.pool)
+        self.pool.close()
+        second = tenantFanout.openTenants(self.config, ['RFD_PRD'], 'aws', 'AWS', pool=self.pool)
+        self.assertIsNot(second[0], first[0])
+
+
+if __name__ == '__main__':
+    unittest.main()